@@ -0,0 +1,108 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Processing, Dataset, CachedResult
+from .kernels import KERNEL_VERSION
+from .report_cache import bump_generation
+
+# Content-addressed cache of the test function's results.
+#
+# On submission each dataset gets a hash of its canonical JSON (see parsers.json_hash).
+# Once a dataset gets processed, its result and exception are stored under
+# (hash, KERNEL_VERSION). Datasets of the same content submitted later get the stored result
+# copied on them, with no tasks run. Bumping KERNEL_VERSION makes all stored results stale.
+
+
+def use_cached_results(query_set, processing_pk):
+    """
+    Assign cached results to datasets whose data have been processed before.
+
+    Datasets get linked to the processing, result and exception copied from the cache,
+    all with a single UPDATE. Hits and misses get counted on the processing.
+
+    :param query_set: QuerySet of Dataset objects
+    :param processing_pk: Processing PK
+    :return: QuerySet of datasets left to process
+    """
+    qn = connection.ops.quote_name
+    subquery, params = query_set.values('pk').query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE {dataset} AS d '
+            'SET {processing} = %s, {result} = c.{result}, {exception} = c.{exception}, '
+            '{processed} = %s '
+            'FROM {cache} AS c '
+            'WHERE d.{pk} IN ({subquery}) AND d.{hash} <> %s '
+            'AND c.{hash} = d.{hash} AND c.{version} = %s '
+            'RETURNING d.{pk}, c.{pk}, c.{exception} <> %s'.format(
+                dataset=qn(Dataset._meta.db_table), cache=qn(CachedResult._meta.db_table),
+                processing=qn('processing_id'), result=qn('result'), exception=qn('exception'),
+                processed=qn('processed'),
+                pk=qn('id'), hash=qn('data_hash'), version=qn('kernel_version'),
+                subquery=subquery),
+            [processing_pk, timezone.now()] + list(params) + ['', KERNEL_VERSION, ''])
+        rows = cursor.fetchall()
+
+    hit_pks = [dataset_pk for dataset_pk, _, _ in rows]
+    query_set = query_set.exclude(pk__in=hit_pks)
+
+    # the same entry may be used by a few datasets at once
+    now = timezone.now()
+    entry_hits = Counter(entry_pk for _, entry_pk, _ in rows)
+    for hits in set(entry_hits.values()):
+        CachedResult.objects.filter(pk__in=[pk for pk, n in entry_hits.items() if n == hits]).\
+            update(hits=F('hits') + hits, last_used=now)
+
+    processing_fields = {'cache_hits': len(hit_pks),
+                         'cache_misses': query_set.exclude(data_hash='').count()}
+    if any(has_exception for _, _, has_exception in rows):
+        processing_fields['exceptions'] = True
+    Processing.objects.filter(pk=processing_pk).update(**processing_fields)
+    bump_generation()
+
+    return query_set
+
+
+def store_result(data_hash, result, exception):
+    """
+    Store the test function's result for a dataset in the cache.
+
+    Nothing is stored if the cache is off or the dataset has no hash.
+
+    :param data_hash: str: hash of the dataset's data
+    :param result: JSON (Python's list of dicts)
+    :param exception: str: exception message, empty if none
+    :return: None
+    """
+    if not settings.DATASETS_RESULT_CACHE or not data_hash:
+        return
+
+    CachedResult.objects.get_or_create(data_hash=data_hash, kernel_version=KERNEL_VERSION,
+                                       defaults={'result': result, 'exception': exception})
+
+
+def evict_cached_results():
+    """
+    Delete stale entries from the cache.
+
+    These are entries of older kernel versions, ones unused for DATASETS_RESULT_CACHE_MAX_AGE days,
+    and least recently used ones beyond DATASETS_RESULT_CACHE_MAX_ENTRIES.
+
+    :return: int: number of entries deleted
+    """
+    max_age = timedelta(days=settings.DATASETS_RESULT_CACHE_MAX_AGE)
+
+    deleted, _ = CachedResult.objects.exclude(kernel_version=KERNEL_VERSION).delete()
+    expired, _ = CachedResult.objects.filter(last_used__lt=timezone.now() - max_age).delete()
+
+    least_used = CachedResult.objects.order_by('-last_used', '-pk').\
+        values('pk')[settings.DATASETS_RESULT_CACHE_MAX_ENTRIES:]
+    evicted, _ = CachedResult.objects.filter(pk__in=least_used).delete()
+
+    return deleted + expired + evicted
@@ -0,0 +1,257 @@
+import json
+
+from django.db import connection
+
+# Raw SQL helpers for the things Django ORM (as of 1.10) can't do in one query.
+
+
+def bulk_update(model, objs, fields, batch_size=1000):
+    """
+    Update given fields of many model instances with UPDATE ... FROM (VALUES ...) queries.
+
+    Unlike Model.save(), only the given columns get written,
+    so large JSON fields that have not changed are left alone.
+
+    :param model: Model class
+    :param objs: iterable of model instances (saved ones, with PKs)
+    :param fields: list of field names to update
+    :param batch_size: int: max number of rows per query
+    :return: int: number of updated rows
+    """
+    objs = list(objs)
+    meta = model._meta
+    pk = meta.pk
+    columns = [pk] + [meta.get_field(name) for name in fields]
+    qn = connection.ops.quote_name
+
+    # explicit casts, since VALUES lists have no column types of their own;
+    # rel_db_type() gives 'integer' rather than 'serial' for AutoField
+    row = '({0})'.format(', '.join('%s::{0}'.format(column.rel_db_type(connection))
+                                   for column in columns))
+    sql = 'UPDATE {table} SET {assignments} FROM (VALUES {{rows}}) AS v ({names}) ' \
+          'WHERE {table}.{pk} = v.{pk}'.format(
+              table=qn(meta.db_table),
+              assignments=', '.join('{0} = v.{0}'.format(qn(column.column))
+                                    for column in columns[1:]),
+              names=', '.join(qn(column.column) for column in columns),
+              pk=qn(pk.column))
+
+    updated = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = []
+            for obj in batch:
+                for column in columns:
+                    value = getattr(obj, column.attname)
+                    params.append(column.get_db_prep_save(value, connection))
+
+            cursor.execute(sql.format(rows=', '.join([row] * len(batch))), params)
+            updated += cursor.rowcount
+
+    return updated
+
+
+def claim_rows(query_set, field, value, limit=None):
+    """
+    Set a field on the rows of a QuerySet that no one else holds locked, with a single UPDATE.
+
+    The rows are picked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent claims
+    never wait for each other and never claim the same row twice.
+    Requires PostgreSQL >= 9.5.
+
+    :param query_set: QuerySet; it is also expected to filter out already claimed rows
+    :param field: str: name of the field to set
+    :param value: value to set the field to
+    :param limit: int: max number of rows to claim, first ones in the QuerySet's order; None for all
+    :return: list of PKs of the claimed rows
+    """
+    meta = query_set.model._meta
+    qn = connection.ops.quote_name
+    column = meta.get_field(field)
+    query_set = query_set.values('pk')
+    query_set = query_set.order_by() if limit is None else query_set[:limit]
+    subquery, params = query_set.query.sql_with_params()
+
+    sql = 'UPDATE {table} SET {column} = %s WHERE {pk} IN ({subquery} FOR UPDATE SKIP LOCKED) ' \
+          'RETURNING {pk}'.format(table=qn(meta.db_table), column=qn(column.column),
+                                  pk=qn(meta.pk.column), subquery=subquery)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [column.get_db_prep_save(value, connection)] + list(params))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def json_array_slice(model, pk, field, start, stop):
+    """
+    Fetch items [start:stop] of a JSON array stored in a model's field, along with the array length.
+
+    Slicing happens inside PostgreSQL, which picks the requested items by index,
+    so only they are extracted from the array and cross the wire.
+
+    :param model: Model class
+    :param pk: PK of the model instance
+    :param field: str: name of the JSON field
+    :param start: int: index of the first item
+    :param stop: int: index past the last item
+    :return: tuple of two (JSON (Python's list); int: array length), both None if the field holds no array
+    :raises: model.DoesNotExist
+    """
+    meta = model._meta
+    qn = connection.ops.quote_name
+    column = _qualified_column(model, field)
+
+    # cast to text and decode here, regardless of the jsonb typecaster psycopg2 is set up with
+    sql = "SELECT CASE WHEN jsonb_typeof({column}) = 'array' THEN jsonb_array_length({column}) END, " \
+          "CASE WHEN jsonb_typeof({column}) = 'array' THEN " \
+          "COALESCE((SELECT jsonb_agg({column} -> i ORDER BY i) " \
+          "FROM generate_series(GREATEST(%s, 0), LEAST(%s, jsonb_array_length({column})) - 1) AS i), " \
+          "'[]'::jsonb)::text END " \
+          "FROM {table} WHERE {pk} = %s".format(column=column,
+                                                table=qn(meta.db_table),
+                                                pk=qn(meta.pk.column))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [start, stop, pk])
+        row = cursor.fetchone()
+
+    if row is None:
+        raise model.DoesNotExist('{0} matching query does not exist.'.format(meta.object_name))
+
+    length, items = row
+    if items is None:
+        return None, None
+    return json.loads(items), length
+
+
+def iter_json_array(model, pk, field, chunk_size):
+    """
+    Iterate over items of a JSON array stored in a model's field, chunk by chunk.
+
+    Items are fetched through a server-side cursor, so no more than a chunk of them
+    is ever held in memory, neither by psycopg2 nor here. The cursor lives till the end of
+    the current transaction, so iterate in an atomic block.
+
+    :param model: Model class
+    :param pk: PK of the model instance
+    :param field: str: name of the JSON field
+    :param chunk_size: int: max number of items per chunk
+    :return: generator of JSON (Python's lists); nothing for anything but an array
+    """
+    meta = model._meta
+    qn = connection.ops.quote_name
+    column = _qualified_column(model, field)
+
+    sql = "SELECT t.item::text " \
+          "FROM {table}, jsonb_array_elements({column}) WITH ORDINALITY AS t (item, idx) " \
+          "WHERE {table}.{pk} = %s AND jsonb_typeof({column}) = 'array' " \
+          "ORDER BY t.idx".format(column=column, table=qn(meta.db_table), pk=qn(meta.pk.column))
+
+    # Django (as of 1.10) has no server-side cursors of its own, so take a named one of psycopg2
+    connection.ensure_connection()
+    cursor = connection.connection.cursor(name='iter_{0}_{1}'.format(meta.db_table, pk))
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(sql, [pk])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [json.loads(item) for item, in rows]
+    finally:
+        cursor.close()
+
+
+def bytea_slice(model, pk, field, start, stop):
+    """
+    Fetch bytes [start:stop] of a binary field, along with the field's length.
+
+    :param model: Model class
+    :param pk: PK of the model instance
+    :param field: str: name of the binary field
+    :param start: int: index of the first byte
+    :param stop: int: index past the last byte
+    :return: tuple of two (bytes; int: length), both None if the field is NULL
+    :raises: model.DoesNotExist
+    """
+    meta = model._meta
+    qn = connection.ops.quote_name
+    column = _qualified_column(model, field)
+
+    # SQL substring() counts from 1
+    sql = "SELECT octet_length({column}), substring({column} from %s for %s) " \
+          "FROM {table} WHERE {pk} = %s".format(column=column,
+                                                table=qn(meta.db_table),
+                                                pk=qn(meta.pk.column))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [start + 1, max(stop - start, 0), pk])
+        row = cursor.fetchone()
+
+    if row is None:
+        raise model.DoesNotExist('{0} matching query does not exist.'.format(meta.object_name))
+
+    length, data = row
+    if data is None:
+        return None, None
+    return bytes(data), length
+
+
+def estimate_count(query_set):
+    """
+    Estimate number of rows a QuerySet returns, with no COUNT(*) run.
+
+    The estimate is the one PostgreSQL's planner makes from table statistics,
+    so it is as good as the last ANALYZE.
+
+    :param query_set: QuerySet
+    :return: int
+    """
+    sql, params = query_set.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+
+    # psycopg2 may or may not be set up to decode JSON
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def json_array_length_sql(model, field):
+    """
+    Return SQL expression for number of items in a JSON array stored in a model's field.
+
+    :param model: Model class
+    :param field: str: name of the JSON field
+    :return: str: SQL; the expression is 0 for anything but an array
+    """
+    column = _qualified_column(model, field)
+    return "CASE WHEN jsonb_typeof({column}) = 'array' " \
+           "THEN jsonb_array_length({column}) ELSE 0 END".format(column=column)
+
+
+def json_array_head_sql(model, field, items):
+    """
+    Return SQL expression for first items of a JSON array stored in a model's field.
+
+    :param model: Model class
+    :param field: str: name of the JSON field
+    :param items: int: max number of items
+    :return: str: SQL; the expression is NULL for anything but an array
+    """
+    column = _qualified_column(model, field)
+    return "CASE WHEN jsonb_typeof({column}) = 'array' THEN " \
+           "COALESCE((SELECT jsonb_agg({column} -> i ORDER BY i) " \
+           "FROM generate_series(0, LEAST({items:d}, jsonb_array_length({column})) - 1) AS i), " \
+           "'[]'::jsonb) END".format(column=column, items=items)
+
+
+def _qualified_column(model, field):
+    """
+    Return quoted column name qualified with the model's table name.
+    """
+    meta = model._meta
+    qn = connection.ops.quote_name
+    return '{0}.{1}'.format(qn(meta.db_table), qn(meta.get_field(field).column))
@@ -0,0 +1,377 @@
+import re
+import json
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, close_old_connections
+
+from .status import processing_status
+
+# Completion notifications of processings.
+#
+# Whenever a dataset of a processing gets started or processed, PostgreSQL sends a NOTIFY
+# on CHANNEL with the processing's PK (see migration 0020): a trigger fires on the very rows
+# tasks write, whichever way they write them (one by one, buffered, in bulk or by SQL),
+# and notifications are delivered once their transaction commits, at most one per processing
+# per transaction.
+#
+# Clients waiting for a processing are held by a separate asyncio server process (see the
+# serve_events command), never by uWSGI workers: a single event loop holds any number of idle
+# connections, LISTENs on a single DB connection, and reads status of a notified processing once
+# for all its clients, in a small pool of threads, see status.processing_status.
+#
+#   GET /events/<processing_pk>              server-sent events: `status` events as the processing
+#                                            changes, the stream ends once it is finished
+#   GET /events/<processing_pk>?poll[&done=N] long-poll: status JSON as soon as it changes
+#                                            (at once if `done` is not the current count)
+#
+# Connections are held for DATASETS_EVENTS_TIMEOUT seconds at most; EventSource reconnects
+# by itself, long-polling clients just ask again. Should the LISTEN connection drop, it is
+# opened again, every RECONNECT_SECONDS till it succeeds, and all waited for processings are
+# read once more, as their notifications may have been missed meanwhile.
+
+CHANNEL = 'datasets_processing'
+EVENTS_PATH = re.compile(r'^/events/(?P<processing_pk>\d+)$')
+RECONNECT_SECONDS = 1
+
+# Fields of status that tell whether a processing changed
+STATE_FIELDS = ('running', 'done', 'failed', 'finished')
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_status(processing_pk, fresh=False):
+    """
+    Return progress of a processing; run it in a thread of EventServer.executor.
+
+    :param processing_pk: Processing PK
+    :param fresh: bool: bypass the cache
+    :return: dict, None if there is no such processing
+    """
+    # just like a request would
+    close_old_connections()
+    try:
+        return processing_status(processing_pk, fresh=fresh)
+    finally:
+        close_old_connections()
+
+
+def state(status):
+    """
+    :param status: dict, see status.processing_status
+    :return: tuple of fields that tell whether a processing changed
+    """
+    return tuple(status[field] for field in STATE_FIELDS)
+
+
+def to_json(status):
+    """
+    :param status: dict, see status.processing_status
+    :return: bytes
+    """
+    return json.dumps(status, cls=DjangoJSONEncoder).encode()
+
+
+def response_head(status_line, content_type, content_length=None):
+    """
+    :param status_line: str, e.g. '200 OK'
+    :param content_type: str
+    :param content_length: int or None for a stream
+    :return: bytes
+    """
+    headers = ['HTTP/1.1 {0}'.format(status_line),
+               'Content-Type: {0}'.format(content_type),
+               'Cache-Control: no-cache',
+               'Connection: close',
+               # let nginx pass events through as they come
+               'X-Accel-Buffering: no']
+    if content_length is not None:
+        headers.append('Content-Length: {0}'.format(content_length))
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+
+class EventServer(object):
+    """
+    Hold clients waiting for processings and push them status of those as it changes.
+    """
+    def __init__(self, loop, threads=4):
+        """
+        :param loop: asyncio event loop to run in
+        :param threads: int: max number of status reads at once
+        """
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(threads)
+        # processing PK to set of queues of its clients, each holding the latest status only
+        self.subscribers = {}
+        # processing PK to whether it has been notified again while its status is being read
+        self.refreshing = {}
+        # connected with psycopg2 itself, as Django doesn't connect from within an event loop
+        self.listener_params = connection.get_connection_params()
+        self.listener = None
+        self.listener_fd = None
+        self.closed = False
+
+    def listen(self):
+        """
+        LISTEN on a connection of its own, and read notifications as they come.
+
+        :return: None
+        """
+        self.listener = psycopg2.connect(**self.listener_params)
+        self.listener.autocommit = True
+        with self.listener.cursor() as cursor:
+            cursor.execute('LISTEN {0}'.format(connection.ops.quote_name(CHANNEL)))
+        self.listener_fd = self.listener.fileno()
+        self.loop.add_reader(self.listener_fd, self.read_notifications)
+
+    def unlisten(self):
+        """
+        Close the LISTEN connection, whether it is still open or not.
+
+        :return: None
+        """
+        if self.listener_fd is not None:
+            self.loop.remove_reader(self.listener_fd)
+        if self.listener is not None:
+            try:
+                self.listener.close()
+            except psycopg2.Error:
+                pass
+            self.listener = self.listener_fd = None
+
+    def reconnect(self):
+        """
+        Open the LISTEN connection again, and read status of all processings waited for.
+
+        :return: None
+        """
+        self.unlisten()
+        if self.closed:
+            return
+
+        try:
+            self.listen()
+        except psycopg2.Error:
+            logger.warning('Could not LISTEN, retrying in %s seconds', RECONNECT_SECONDS)
+            self.unlisten()
+            self.loop.call_later(RECONNECT_SECONDS, self.reconnect)
+            return
+
+        for processing_pk in list(self.subscribers):
+            self.notify(processing_pk)
+
+    def close(self):
+        """
+        :return: None
+        """
+        self.closed = True
+        self.unlisten()
+        self.executor.shutdown(wait=False)
+
+    def read_notifications(self):
+        """
+        :return: None
+        """
+        try:
+            self.listener.poll()
+        except psycopg2.Error:
+            logger.warning('Lost the LISTEN connection, reconnecting')
+            self.reconnect()
+            return
+
+        while self.listener.notifies:
+            notification = self.listener.notifies.pop(0)
+            self.notify(int(notification.payload))
+
+    def notify(self, processing_pk):
+        """
+        Read status of a changed processing for its clients, unless there are none.
+
+        Notifications coming while it is being read get it read once more afterwards,
+        so that however many datasets get processed, clients wait for one read at a time.
+
+        :param processing_pk: Processing PK
+        :return: None
+        """
+        if processing_pk in self.refreshing:
+            self.refreshing[processing_pk] = True
+        elif self.subscribers.get(processing_pk):
+            self.refreshing[processing_pk] = False
+            asyncio.ensure_future(self.refresh(processing_pk), loop=self.loop)
+
+    async def refresh(self, processing_pk):
+        """
+        :param processing_pk: Processing PK
+        :return: None
+        """
+        try:
+            while True:
+                status = await self.loop.run_in_executor(self.executor, fetch_status, processing_pk, True)
+                if status is not None:
+                    self.publish(processing_pk, status)
+                if not self.refreshing[processing_pk]:
+                    break
+                self.refreshing[processing_pk] = False
+        except Exception:
+            logger.exception('Status of processing %s could not be read', processing_pk)
+        finally:
+            del self.refreshing[processing_pk]
+
+    def publish(self, processing_pk, status):
+        """
+        Push status of a processing to its clients; clients that are behind skip older ones.
+
+        :param processing_pk: Processing PK
+        :param status: dict, see status.processing_status
+        :return: None
+        """
+        for queue in self.subscribers.get(processing_pk, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(status)
+
+    def subscribe(self, processing_pk):
+        """
+        :param processing_pk: Processing PK
+        :return: asyncio.Queue of status updates
+        """
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault(processing_pk, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, processing_pk, queue):
+        """
+        :param processing_pk: Processing PK
+        :param queue: asyncio.Queue, see subscribe
+        :return: None
+        """
+        queues = self.subscribers.get(processing_pk, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(processing_pk, None)
+
+    async def handle(self, reader, writer):
+        """
+        Serve a single HTTP request; asyncio.start_server callback.
+
+        :param reader: asyncio.StreamReader
+        :param writer: asyncio.StreamWriter
+        :return: None
+        """
+        try:
+            try:
+                request_line = await asyncio.wait_for(self.read_head(reader),
+                                                      settings.DATASETS_EVENTS_KEEPALIVE)
+                method, target = request_line.split()[:2]
+                url = urlsplit(target)
+            except (asyncio.TimeoutError, ValueError):
+                await self.send(writer, '400 Bad Request', b'')
+                return
+
+            match = EVENTS_PATH.match(url.path)
+            if method != 'GET':
+                await self.send(writer, '405 Method Not Allowed', b'')
+            elif match is None:
+                await self.send(writer, '404 Not Found', b'')
+            else:
+                await self.serve(writer, int(match.group('processing_pk')),
+                                 parse_qs(url.query, keep_blank_values=True))
+        except ConnectionError:
+            # the client is gone
+            pass
+        except Exception:
+            logger.exception('Request failed')
+        finally:
+            writer.close()
+
+    async def read_head(self, reader):
+        """
+        :param reader: asyncio.StreamReader
+        :return: str: request line; headers are skipped
+        :raises: ValueError if the request is cut short
+        """
+        request_line = (await reader.readline()).decode('latin-1')
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ValueError('Incomplete request')
+            if line in (b'\r\n', b'\n'):
+                return request_line
+
+    async def send(self, writer, status_line, body, content_type='application/json'):
+        """
+        :param writer: asyncio.StreamWriter
+        :param status_line: str, e.g. '200 OK'
+        :param body: bytes
+        :param content_type: str
+        :return: None
+        """
+        writer.write(response_head(status_line, content_type, len(body)) + body)
+        await writer.drain()
+
+    async def serve(self, writer, processing_pk, query):
+        """
+        Stream status of a processing, or answer a long-poll for it.
+
+        :param writer: asyncio.StreamWriter
+        :param processing_pk: Processing PK
+        :param query: dict of query parameters, see urllib.parse.parse_qs
+        :return: None
+        """
+        # subscribed first and read fresh, so that no change after the status read below is missed
+        queue = self.subscribe(processing_pk)
+        try:
+            status = await self.loop.run_in_executor(self.executor, fetch_status, processing_pk, True)
+            if status is None:
+                await self.send(writer, '404 Not Found', b'')
+            elif 'poll' in query:
+                await self.long_poll(writer, queue, status, query.get('done', [None])[0])
+            else:
+                await self.stream(writer, queue, status)
+        finally:
+            self.unsubscribe(processing_pk, queue)
+
+    async def long_poll(self, writer, queue, status, done):
+        """
+        :param writer: asyncio.StreamWriter
+        :param queue: asyncio.Queue, see subscribe
+        :param status: dict: current status
+        :param done: str: number of processed datasets the client knows of, None if any
+        :return: None
+        """
+        if not status['finished'] and (done is None or done == str(status['done'])):
+            deadline = self.loop.time() + settings.DATASETS_EVENTS_TIMEOUT
+            current = state(status)
+            while state(status) == current:
+                try:
+                    status = await asyncio.wait_for(queue.get(), deadline - self.loop.time())
+                except asyncio.TimeoutError:
+                    break
+        await self.send(writer, '200 OK', to_json(status))
+
+    async def stream(self, writer, queue, status):
+        """
+        :param writer: asyncio.StreamWriter
+        :param queue: asyncio.Queue, see subscribe
+        :param status: dict: current status
+        :return: None
+        """
+        writer.write(response_head('200 OK', 'text/event-stream'))
+        writer.write(b'event: status\ndata: ' + to_json(status) + b'\n\n')
+        await writer.drain()
+
+        deadline = self.loop.time() + settings.DATASETS_EVENTS_TIMEOUT
+        while not status['finished'] and self.loop.time() < deadline:
+            try:
+                status = await asyncio.wait_for(queue.get(), min(settings.DATASETS_EVENTS_KEEPALIVE,
+                                                                 deadline - self.loop.time()))
+                writer.write(b'event: status\ndata: ' + to_json(status) + b'\n\n')
+            except asyncio.TimeoutError:
+                # a comment, so that proxies keep the connection and gone clients get noticed
+                writer.write(b': keepalive\n\n')
+            await writer.drain()
@@ -0,0 +1,127 @@
+import os
+import logging
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+
+import django
+from django.conf import settings
+from django.db import connections
+
+from .writes import flush_status
+
+# Executors run tasks of dataset processing.
+#
+# The celery executor sends tasks to the broker, just as process_datasets always did.
+# The local executor calls task bodies right away in this process, the pool one calls them
+# in a pool of processes on this machine, with no broker or result backend involved.
+# Like Celery workers, local executors log a failed task and go on with the rest,
+# and flush buffered status updates (see writes.py) once done.
+
+logger = logging.getLogger(__name__)
+
+
+class CeleryExecutor(object):
+    """
+    Send tasks to Celery workers.
+    """
+    local = False
+
+    def submit(self, task, arg):
+        """
+        Run a task on a single argument.
+
+        :param task: Celery task
+        :param arg: task's argument
+        :return: AsyncResult
+        """
+        return task.delay(arg)
+
+    def join(self):
+        """
+        Wait for submitted tasks to finish; Celery tasks are not waited for.
+        """
+
+
+class LocalExecutor(object):
+    """
+    Run tasks in this very process, one by one.
+    """
+    local = True
+
+    def submit(self, task, arg):
+        try:
+            return task(arg)
+        except Exception:
+            logger.exception('Task %s raised an exception', _task_name(task))
+
+    def join(self):
+        flush_status()
+
+
+class PoolExecutor(object):
+    """
+    Run tasks in a pool of processes.
+
+    Each process gets a DB connection of its own.
+    """
+    local = True
+
+    def __init__(self, workers=None):
+        """
+        :param workers: int: number of processes, number of CPUs by default
+        """
+        # forked processes must not share the parent's connections
+        connections.close_all()
+        self.pool = Pool(workers or os.cpu_count(), initializer=_init_worker)
+        self.results = []
+
+    def submit(self, task, arg):
+        result = self.pool.apply_async(task, (arg,))
+        self.results.append((task, result))
+        return result
+
+    def join(self):
+        self.pool.close()
+        for task, result in self.results:
+            try:
+                result.get()
+            except Exception:
+                logger.exception('Task %s raised an exception', _task_name(task))
+        self.pool.join()
+        self.results = []
+
+
+EXECUTORS = {
+    'celery': CeleryExecutor,
+    'local': LocalExecutor,
+    'pool': PoolExecutor,
+}
+
+
+def get_executor(name=None, workers=None):
+    """
+    Return an executor, the one set with DATASETS_EXECUTOR setting by default.
+
+    :param name: str: 'celery', 'local' or 'pool'
+    :param workers: int: number of processes of the pool executor;
+                    DATASETS_EXECUTOR_WORKERS or number of CPUs by default
+    :return: executor instance
+    """
+    name = name or settings.DATASETS_EXECUTOR
+    if name == 'pool':
+        return PoolExecutor(workers or settings.DATASETS_EXECUTOR_WORKERS)
+    return EXECUTORS[name]()
+
+
+def _init_worker():
+    """
+    Set Django up in a pool's process, in case it is spawned rather than forked.
+
+    Buffered status updates of the process get flushed as it exits.
+    """
+    django.setup()
+    Finalize(None, flush_status, exitpriority=10)
+
+
+def _task_name(task):
+    return getattr(task, 'name', getattr(task, '__name__', repr(task)))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from datasets.models import Dataset
+from datasets.executors import EXECUTORS, get_executor
+from datasets.tasks import process_datasets
+
+
+class Command(BaseCommand):
+    help = 'Process all unprocessed datasets on this machine, with no Celery broker involved.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Number of processes of the pool; '
+                                 'defaults to DATASETS_EXECUTOR_WORKERS or number of CPUs.')
+        parser.add_argument('--executor', choices=sorted(EXECUTORS), default='pool',
+                            help='What runs the tasks. Defaults to a pool of processes.')
+
+    def handle(self, *args, **options):
+        executor = get_executor(options['executor'], options['workers'])
+        processing_pk = process_datasets(Dataset.objects.filter(processing__isnull=True), executor)
+
+        done = executor.local and settings.DATASETS_PIPELINE != 'queue'
+        self.stdout.write(self.style.SUCCESS('Datasets processing #{0} {1}'.format(
+            processing_pk, 'is done' if done else 'has started')))
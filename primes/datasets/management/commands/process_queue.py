@@ -0,0 +1,49 @@
+import os
+import time
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from datasets.queue import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Process datasets claimed with DATASETS_PIPELINE = "queue", pulling them ' \
+           'straight from the database, with no Celery broker involved.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of processes to run the test function in; '
+                                 '0 to run it in this very process. Defaults to number of CPUs.')
+        parser.add_argument('--batch-size', type=int, default=settings.DATASETS_BATCH_SIZE,
+                            help='Max number of datasets taken at once. '
+                                 'Defaults to DATASETS_BATCH_SIZE.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait for new datasets when there are none.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no pending datasets left.')
+
+    def handle(self, *args, **options):
+        pool = Pool(options['workers']) if options['workers'] > 0 else None
+        map_function = pool.map if pool else map
+
+        processed = 0
+        try:
+            while True:
+                batch = process_pending(options['batch_size'], map_function)
+                processed += batch
+                if batch:
+                    self.stdout.write('Processed {0} datasets'.format(batch))
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        self.stdout.write(self.style.SUCCESS('Done: {0} datasets processed'.format(processed)))
@@ -0,0 +1,40 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from datasets.events import EventServer
+
+
+class Command(BaseCommand):
+    help = 'Serve completion notifications of processings at /events/<processing_pk>, ' \
+           'as server-sent events or long-polls, holding waiting clients off uWSGI workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1',
+                            help='Address to listen on. Defaults to 127.0.0.1.')
+        parser.add_argument('--port', type=int, default=8001,
+                            help='Port to listen on. Defaults to 8001.')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Max number of status reads at once. Defaults to 4.')
+
+    def handle(self, *args, **options):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        events = EventServer(loop, options['threads'])
+        events.listen()
+        server = loop.run_until_complete(asyncio.start_server(events.handle, options['host'],
+                                                              options['port']))
+        self.stdout.write('Serving events at http://{0}:{1}/events/'.format(options['host'],
+                                                                           options['port']))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            events.close()
+            loop.close()
+
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0009_auto_20161128_1002'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='dataset',
+            index_together=set([('processing', 'id')]),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0010_auto_20261018_1200'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='data_hash',
+            field=models.CharField(db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='cache_hits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='cache_misses',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CachedResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_hash', models.CharField(max_length=64)),
+                ('kernel_version', models.PositiveIntegerField()),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(default=None, null=True)),
+                ('exception', models.TextField(default='')),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('added', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='cachedresult',
+            unique_together=set([('data_hash', 'kernel_version')]),
+        ),
+    ]
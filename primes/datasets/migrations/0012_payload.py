@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 14:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0011_auto_20261018_1300'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.TextField()),
+                ('added', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.RunSQL('ALTER TABLE datasets_payload SET UNLOGGED',
+                          'ALTER TABLE datasets_payload SET LOGGED'),
+    ]
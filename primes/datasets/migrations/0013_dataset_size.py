@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 15:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0012_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='size',
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        # record sizes of datasets submitted so far
+        migrations.RunSQL(
+            "UPDATE datasets_dataset SET size = CASE WHEN jsonb_typeof(data) = 'array' "
+            "THEN jsonb_array_length(data) ELSE 0 END WHERE data IS NOT NULL",
+            migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 16:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0013_dataset_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processing',
+            name='dispatch_cursor',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
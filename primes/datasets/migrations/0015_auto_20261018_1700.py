@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 17:00
+from __future__ import unicode_literals
+
+import datasets.handlers
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0014_processing_dispatch_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='parse_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='upload',
+            field=models.FileField(blank=True, default='', upload_to=datasets.handlers.handle_uploaded_file),
+        ),
+    ]
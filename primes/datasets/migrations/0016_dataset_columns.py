@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 18:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0015_auto_20261018_1700'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='columns',
+            field=models.FileField(blank=True, default='', upload_to=''),
+        ),
+    ]
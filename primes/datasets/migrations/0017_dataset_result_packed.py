@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:00
+from __future__ import unicode_literals
+
+import sys
+from array import array
+
+from django.conf import settings
+from django.db import migrations, models
+
+from datasets.db import bulk_update
+
+BATCH_SIZE = 1000
+
+# The packing format as of this migration, see datasets/results.py;
+# copied, so that later changes to the format leave this migration alone
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def pack_result(result):
+    """
+    :param result: JSON (Python's list of dicts)
+    :return: bytes, None if the result can't be packed
+    """
+    if not isinstance(result, list):
+        return None
+    if not all(type(item) is dict and len(item) == 1 and 'result' in item for item in result):
+        return None
+
+    values = [item['result'] for item in result]
+    types = set(map(type, values))
+    if types <= {int} and all(INT64_MIN <= value <= INT64_MAX for value in values):
+        typecode = 'q'
+    elif types == {float}:
+        typecode = 'd'
+    else:
+        return None
+
+    items = array(typecode, values)
+    if sys.byteorder == 'little':
+        items.byteswap()
+    return typecode.encode() + items.tobytes()
+
+
+def unpack_result(packed):
+    """
+    :param packed: bytes, see pack_result
+    :return: JSON (Python's list of dicts)
+    """
+    values = array(packed[:1].decode())
+    values.frombytes(packed[1:])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return [{'result': value} for value in values]
+
+
+def pack_results(apps, schema_editor):
+    """
+    Pack results of datasets processed so far, whenever they can be packed,
+    unless results are set to be stored as JSON, see DATASETS_RESULT_ENCODING.
+    """
+    if settings.DATASETS_RESULT_ENCODING != 'packed':
+        return
+
+    Dataset = apps.get_model('datasets', 'Dataset')
+    last_pk = 0
+    while True:
+        rows = list(Dataset.objects.filter(pk__gt=last_pk, result__isnull=False).
+                    order_by('pk').values_list('pk', 'result')[:BATCH_SIZE])
+        if not rows:
+            break
+        datasets = []
+        for pk, result in rows:
+            packed = pack_result(result)
+            if packed is not None:
+                datasets.append(Dataset(pk=pk, result=None, result_packed=packed))
+        bulk_update(Dataset, datasets, ['result', 'result_packed'], BATCH_SIZE)
+        last_pk = rows[-1][0]
+
+
+def unpack_results(apps, schema_editor):
+    """
+    Turn packed results back into JSON.
+    """
+    Dataset = apps.get_model('datasets', 'Dataset')
+    last_pk = 0
+    while True:
+        rows = list(Dataset.objects.filter(pk__gt=last_pk, result_packed__isnull=False).
+                    order_by('pk').values_list('pk', 'result_packed')[:BATCH_SIZE])
+        if not rows:
+            break
+        datasets = [Dataset(pk=pk, result=unpack_result(bytes(packed)), result_packed=None)
+                    for pk, packed in rows]
+        bulk_update(Dataset, datasets, ['result', 'result_packed'], BATCH_SIZE)
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0016_dataset_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='result_packed',
+            field=models.BinaryField(default=None, null=True),
+        ),
+        migrations.RunPython(pack_results, unpack_results),
+    ]
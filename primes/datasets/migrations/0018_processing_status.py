@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0017_dataset_result_packed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='processed',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='datasets_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='datasets_failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='datasets_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # datasets processed before are taken as processed when their processing was last modified
+        migrations.RunSQL(
+            'UPDATE datasets_dataset AS d SET processed = p.last_modified '
+            'FROM datasets_processing AS p '
+            'WHERE d.processing_id = p.id '
+            "AND (d.result IS NOT NULL OR d.result_packed IS NOT NULL OR d.exception <> '')",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'UPDATE datasets_processing AS p '
+            'SET datasets_total = s.total, datasets_done = s.done, datasets_failed = s.failed '
+            'FROM (SELECT processing_id, count(*) AS total, count(processed) AS done, '
+            "count(*) FILTER (WHERE processed IS NOT NULL AND exception <> '') AS failed "
+            'FROM datasets_dataset WHERE processing_id IS NOT NULL GROUP BY processing_id) AS s '
+            'WHERE p.id = s.processing_id',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 20:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0018_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='started',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='datasets_running',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processing',
+            name='rows_processed',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            'UPDATE datasets_processing AS p SET rows_processed = s.rows '
+            'FROM (SELECT processing_id, sum(COALESCE(size, 0)) AS rows FROM datasets_dataset '
+            'WHERE processed IS NOT NULL GROUP BY processing_id) AS s '
+            'WHERE p.id = s.processing_id',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 21:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0019_processing_progress'),
+    ]
+
+    operations = [
+        # see events.py
+        migrations.RunSQL(
+            'CREATE FUNCTION datasets_dataset_notify() RETURNS trigger AS $$ '
+            'BEGIN '
+            "PERFORM pg_notify('datasets_processing', NEW.processing_id::text); "
+            'RETURN NULL; '
+            'END; '
+            '$$ LANGUAGE plpgsql; '
+            'CREATE TRIGGER datasets_dataset_notify '
+            'AFTER UPDATE OF started, processed ON datasets_dataset '
+            'FOR EACH ROW WHEN (NEW.processing_id IS NOT NULL '
+            'AND (OLD.started, OLD.processed) IS DISTINCT FROM (NEW.started, NEW.processed)) '
+            'EXECUTE PROCEDURE datasets_dataset_notify();',
+            'DROP TRIGGER datasets_dataset_notify ON datasets_dataset; '
+            'DROP FUNCTION datasets_dataset_notify();',
+        ),
+    ]
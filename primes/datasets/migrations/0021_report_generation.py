@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 22:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0020_dataset_notify'),
+    ]
+
+    operations = [
+        # see report_cache.py
+        migrations.RunSQL(
+            'CREATE SEQUENCE datasets_report_generation',
+            'DROP SEQUENCE datasets_report_generation',
+        ),
+    ]
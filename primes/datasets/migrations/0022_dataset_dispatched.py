@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-19 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0021_report_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='dispatched',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
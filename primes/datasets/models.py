@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.postgres import fields
+from django.utils import timezone
+
+from .handlers import handle_uploaded_file
 
 
 class Processing(models.Model):
@@ -8,6 +11,19 @@ class Processing(models.Model):
     """
     exceptions = models.NullBooleanField(default=None)
     last_modified = models.DateTimeField(auto_now=True)
+    # datasets whose results were taken from the result cache or not
+    cache_hits = models.PositiveIntegerField(default=0)
+    cache_misses = models.PositiveIntegerField(default=0)
+    # PK of the last dataset dispatched by the windowed dispatcher
+    dispatch_cursor = models.PositiveIntegerField(default=0)
+    # datasets claimed, being processed, processed (with or without an exception) and failed
+    # (with an exception), items of processed datasets; tasks never write them,
+    # they are merged from the datasets, see status.py
+    datasets_total = models.PositiveIntegerField(default=0)
+    datasets_running = models.PositiveIntegerField(default=0)
+    datasets_done = models.PositiveIntegerField(default=0)
+    datasets_failed = models.PositiveIntegerField(default=0)
+    rows_processed = models.BigIntegerField(default=0)
 
     def __str__(self):
         return "{pk} {timestamp}".format(pk=self.pk, timestamp=self.last_modified)
@@ -24,8 +40,62 @@ class Dataset(models.Model):
     name = models.CharField(default='', max_length=255)
     data = fields.JSONField(null=True, default=None)
     result = fields.JSONField(null=True, default=None)
+    # result packed into an array of numbers instead of `result` field, see results.py
+    result_packed = models.BinaryField(null=True, default=None)
     exception = models.TextField(default='')
     added = models.DateTimeField(auto_now_add=True)
+    # SHA-256 of canonical JSON of the data; empty if the data hasn't been hashed
+    data_hash = models.CharField(default='', max_length=64, db_index=True)
+    # number of items in the data array, recorded on submission; None if not recorded
+    size = models.PositiveIntegerField(null=True, default=None)
+    # raw upload kept till parsed in a worker, see DATASETS_INGESTION
+    upload = models.FileField(upload_to=handle_uploaded_file, blank=True, default='')
+    # True while the upload waits to be parsed; such datasets can't be processed yet
+    parse_pending = models.BooleanField(default=False)
+    # columnar file holding the data instead of `data` field, see DATASETS_STORAGE
+    columns = models.FileField(blank=True, default='')
+    # when the windowed dispatcher sent the dataset's tasks; None if it hasn't
+    dispatched = models.DateTimeField(null=True, default=None)
+    # when a task started processing the dataset; None if no task has started yet
+    started = models.DateTimeField(null=True, default=None)
+    # when the dataset got its result or exception; None while it is not processed
+    processed = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        # keyset pagination of processed datasets
+        index_together = [('processing', 'id')]
 
     def __str__(self):
         return "{name} {timestamp}".format(name=self.name, timestamp=self.added)
+
+
+class CachedResult(models.Model):
+    """
+    A model for results of the test function, keyed by hash of the data and kernel version.
+    """
+    data_hash = models.CharField(max_length=64)
+    kernel_version = models.PositiveIntegerField()
+    result = fields.JSONField(null=True, default=None)
+    exception = models.TextField(default='')
+    hits = models.PositiveIntegerField(default=0)
+    added = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = [('data_hash', 'kernel_version')]
+
+    def __str__(self):
+        return "{hash} v{version}".format(hash=self.data_hash, version=self.kernel_version)
+
+
+class Payload(models.Model):
+    """
+    A model for results passed between tasks by reference rather than through the broker.
+
+    The table is UNLOGGED: payloads are short-lived, they are not worth WAL writes.
+    """
+    data = models.TextField()
+    added = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return "{pk} {timestamp}".format(pk=self.pk, timestamp=self.added)
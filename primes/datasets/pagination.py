@@ -0,0 +1,143 @@
+from django.db import connection
+from django.utils.functional import cached_property
+
+from .db import estimate_count
+
+# Keyset (cursor) pagination.
+#
+# Django's Paginator runs COUNT(*) on every request and fetches a page with OFFSET,
+# which gets slower the deeper the page is. Here a page is fetched with
+# WHERE (key columns) > (key of the last seen row) ORDER BY key columns LIMIT n,
+# that takes an index range scan whatever the page is. Cursors are keys of the first/last rows
+# on a page, e.g. "3.1201" for (processing_id, id) = (3, 1201).
+
+
+class CursorPage(object):
+    """
+    A page of objects, quacks like django.core.paginator.Page in templates.
+    """
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<CursorPage of {0} objects>'.format(len(self))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.cursor(self.object_list[0]) if self.object_list else ''
+
+    @property
+    def next_cursor(self):
+        return self.paginator.cursor(self.object_list[-1]) if self.object_list else ''
+
+
+class CursorPaginator(object):
+    """
+    Keyset pagination over a QuerySet ordered by a unique combination of integer fields.
+
+    All ordering fields go in the same direction, e.g. ('-processing_id', '-id').
+    """
+    def __init__(self, object_list, ordering, per_page, estimate=False):
+        """
+        :param object_list: QuerySet
+        :param ordering: tuple of field names, descending ones prefixed with '-'
+        :param per_page: int: max number of objects on a page
+        :param estimate: boolean: whether to estimate total number of objects
+        """
+        self.object_list = object_list
+        self.ordering = ordering
+        self.per_page = per_page
+        self.estimate = estimate
+
+        self.descending = ordering[0].startswith('-')
+        meta = object_list.model._meta
+        self.fields = [meta.get_field(name.lstrip('-')) for name in ordering]
+
+    @cached_property
+    def count(self):
+        """
+        Estimated number of objects, as PostgreSQL's planner sees it; None if estimation is off.
+        """
+        if not self.estimate:
+            return None
+        return estimate_count(self.object_list)
+
+    def cursor(self, obj):
+        """
+        Return a cursor pointing to the given object.
+
+        :param obj: Model instance
+        :return: str
+        """
+        return '.'.join(str(getattr(obj, field.attname)) for field in self.fields)
+
+    def parse_cursor(self, cursor):
+        """
+        Return a key the cursor points to.
+
+        :param cursor: str
+        :return: list of ints, None if cursor is invalid
+        """
+        try:
+            key = [int(value) for value in cursor.split('.')]
+        except (AttributeError, ValueError):
+            return None
+        return key if len(key) == len(self.fields) else None
+
+    def page(self, after=None, before=None):
+        """
+        Return a page of objects following the `after` cursor or preceding the `before` one.
+
+        If no valid cursor given, return the first page.
+
+        :param after: str: cursor
+        :param before: str: cursor
+        :return: CursorPage
+        """
+        after = self.parse_cursor(after)
+        before = self.parse_cursor(before) if after is None else None
+
+        forward = before is None
+        key = after if forward else before
+        ordering = self.ordering if forward else \
+            tuple(name[1:] if name.startswith('-') else '-' + name for name in self.ordering)
+
+        query_set = self.object_list
+        if key is not None:
+            # a row comparison, so that PostgreSQL can range scan over a multi-column index
+            qn = connection.ops.quote_name
+            table = qn(self.object_list.model._meta.db_table)
+            columns = ', '.join('{0}.{1}'.format(table, qn(field.column)) for field in self.fields)
+            operator = '<' if self.descending == forward else '>'
+            query_set = query_set.extra(
+                where=['({0}) {1} ({2})'.format(columns, operator,
+                                                ', '.join(['%s'] * len(key)))],
+                params=key)
+
+        object_list = list(query_set.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if forward:
+            return CursorPage(object_list, self, has_previous=after is not None, has_next=has_more)
+
+        object_list.reverse()
+        return CursorPage(object_list, self, has_previous=has_more, has_next=True)
@@ -0,0 +1,253 @@
+import re
+import json
+import codecs
+import hashlib
+
+# Incremental JSON parsing of the uploaded datasets.
+#
+# An upload is expected to be a JSON array of small objects: [{"a": .., "b": ..}, ...]
+# Rather than reading the whole file, decoding it to str and only then calling
+# json.loads(), we feed the file chunk by chunk into a small text buffer and
+# decode the array one element at a time with JSONDecoder.raw_decode().
+# So at any moment only a chunk or so of raw text is held in memory,
+# alongside the Python objects that have been decoded so far.
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DELIMITER = re.compile(r'[ \t\n\r,\]]')
+
+_decoder = json.JSONDecoder()
+# canonical JSON: sorted keys, no whitespace
+_canonical_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+
+class _ChunkBuffer(object):
+    """
+    A text buffer over an iterable of byte chunks.
+
+    Keeps track of how many bytes, characters and lines have been discarded already,
+    so that decoding errors report positions relative to the whole document,
+    just like bytes.decode() and json.loads() do.
+    """
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        # number of bytes decoded so far, bytes the decoder holds back included
+        self.bytes_read = 0
+        # absolute offset of self.text[0] in the document
+        self.offset = 0
+        # number of newlines and the absolute index of the current line start
+        self.lineno = 1
+        self.line_start = 0
+
+    def fill(self):
+        """
+        Append the next chunk to the buffer.
+
+        :return: boolean: False if there is no more input, True otherwise
+        """
+        if self.eof:
+            return False
+        self.compact()
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.text += self.decode(b'', final=True)
+            self.eof = True
+            return False
+        self.text += self.decode(chunk)
+        return True
+
+    def decode(self, chunk, final=False):
+        """
+        Decode a chunk of bytes, along with bytes held back from the previous one.
+
+        :param chunk: bytes
+        :param final: boolean: True for the end of input
+        :return: str
+        :raises: UnicodeDecodeError with positions relative to the whole document
+        """
+        held_back = self.decoder.getstate()[0]
+        try:
+            text = self.decoder.decode(chunk, final)
+        except UnicodeDecodeError as err:
+            # the object is padded to the document's offset, so that the error reads just like
+            # bytes.decode() of the whole document; only a failing upload pays for it
+            offset = self.bytes_read - len(held_back)
+            raise UnicodeDecodeError(err.encoding, bytes(offset) + err.object,
+                                     offset + err.start, offset + err.end, err.reason)
+        self.bytes_read += len(chunk)
+        return text
+
+    def compact(self):
+        """
+        Drop already consumed text from the buffer.
+        """
+        consumed = self.text[:self.pos]
+        newlines = consumed.count('\n')
+        if newlines:
+            self.lineno += newlines
+            self.line_start = self.offset + consumed.rindex('\n') + 1
+        self.offset += self.pos
+        self.text = self.text[self.pos:]
+        self.pos = 0
+
+    def skip_whitespace(self):
+        """
+        Move position to the next meaningful character, reading more input if needed.
+
+        :return: str: next character or '' at the end of input
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def error(self, msg, pos=None):
+        """
+        Build JSONDecodeError with the document-wide position.
+
+        :param msg: str: error message
+        :param pos: int: position in the buffer, current position by default
+        :return: json.JSONDecodeError
+        """
+        if pos is None:
+            pos = self.pos
+        err = json.JSONDecodeError(msg, self.text, pos)
+        newline = self.text.rfind('\n', 0, pos)
+        if newline == -1:
+            err.lineno = self.lineno
+            err.colno = self.offset + pos - self.line_start + 1
+        else:
+            err.lineno = self.lineno + self.text.count('\n', 0, pos)
+            err.colno = pos - newline
+        err.pos = self.offset + pos
+        err.args = ('{0}: line {1} column {2} (char {3})'.
+                    format(msg, err.lineno, err.colno, err.pos),)
+        return err
+
+
+def _element_is_complete(text, start):
+    """
+    Check if the buffer holds a whole array element starting at a given position.
+
+    An element is complete once a ',' or ']' is met outside of strings
+    and nested containers.
+
+    :param text: str
+    :param start: int: start position of the element
+    :return: boolean
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for char in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '[{':
+            depth += 1
+        elif char in ']}':
+            depth -= 1
+            if depth < 0:
+                return True
+        elif char == ',' and depth == 0:
+            return True
+    return False
+
+
+def _decode_element(buf):
+    """
+    Decode the next array element, reading more input until it is complete.
+
+    :param buf: _ChunkBuffer
+    :return: decoded Python object
+    """
+    while True:
+        try:
+            obj, end = _decoder.raw_decode(buf.text, buf.pos)
+        except json.JSONDecodeError as err:
+            # the element may just be cut by a chunk boundary
+            if not buf.eof and not _element_is_complete(buf.text, buf.pos):
+                buf.fill()
+                continue
+            raise buf.error(err.msg, err.pos)
+        # a number may continue in the next chunk
+        if not buf.eof and not DELIMITER.search(buf.text, end):
+            buf.fill()
+            continue
+        buf.pos = end
+        return obj
+
+
+def load_json_chunks(chunks, encoding='utf-8'):
+    """
+    Deserialize a JSON document given as an iterable of byte chunks.
+
+    A top-level array is decoded element by element without holding
+    the whole raw document in memory. Any other document is decoded as a whole.
+
+    :param chunks: iterable of bytes, e.g. UploadedFile.chunks()
+    :param encoding: str: input encoding
+    :return: deserialized Python object
+    :raises: json.JSONDecodeError, UnicodeDecodeError
+    """
+    buf = _ChunkBuffer(chunks, encoding)
+
+    first = buf.skip_whitespace()
+    if first != '[':
+        # not an array: nothing to stream over, fall back to plain json.loads()
+        while buf.fill():
+            pass
+        try:
+            return json.loads(buf.text)
+        except json.JSONDecodeError as err:
+            raise buf.error(err.msg, err.pos)
+
+    items = []
+    buf.pos += 1
+
+    if buf.skip_whitespace() == ']':
+        buf.pos += 1
+    else:
+        while True:
+            buf.skip_whitespace()
+            items.append(_decode_element(buf))
+
+            delimiter = buf.skip_whitespace()
+            if delimiter not in (',', ']'):
+                raise buf.error("Expecting ',' delimiter")
+            buf.pos += 1
+            if delimiter == ']':
+                break
+
+    if buf.skip_whitespace():
+        raise buf.error('Extra data')
+
+    return items
+
+
+def json_hash(obj):
+    """
+    Return SHA-256 of the canonical JSON of a Python object.
+
+    Objects that differ only in key order or whitespace of their JSON get the same hash.
+    JSON is encoded piece by piece, with no full string built in memory.
+
+    :param obj: Python object, e.g. deserialized dataset
+    :return: str: hex digest
+    """
+    digest = hashlib.sha256()
+    for chunk in _canonical_encoder.iterencode(obj):
+        digest.update(chunk.encode('utf-8'))
+    return digest.hexdigest()
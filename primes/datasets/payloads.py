@@ -0,0 +1,168 @@
+import os
+import json
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Payload
+
+# Claim-check passing of results between tasks.
+#
+# A task returns a small reference instead of a large result, so that the result
+# is neither pickled into a broker message nor stored in the result backend.
+# References are {"__payload__": [store, key]} dicts, so that they come through JSON
+# serialization of messages and of the result backend (e.g. chord results) unchanged.
+# The result itself is put into a payload store: 'db' (an UNLOGGED PostgreSQL table)
+# or 'file' (a directory shared by co-located workers). Results of no more than
+# DATASETS_PAYLOAD_INLINE_BYTES of JSON are passed inline, as before.
+# The task that loads a payload deletes it once done with it; payloads left behind
+# by failed chains are purged after DATASETS_PAYLOAD_MAX_AGE hours.
+
+PayloadRef = namedtuple('PayloadRef', ['store', 'key'])
+
+# Key of a reference put by put_payload; results themselves are lists, never dicts
+PAYLOAD_TAG = '__payload__'
+
+
+def put_payload(obj):
+    """
+    Put an object into the payload store set with DATASETS_PAYLOAD_STORE.
+
+    :param obj: JSON (Python's list of dicts)
+    :return: dict: reference to the payload, see payload_ref;
+             or the object itself if the store is off or the object is small enough
+    """
+    store = settings.DATASETS_PAYLOAD_STORE
+    if not store:
+        return obj
+
+    data = json.dumps(obj)
+    if len(data) <= settings.DATASETS_PAYLOAD_INLINE_BYTES:
+        return obj
+
+    return {PAYLOAD_TAG: [store, STORES[store].put(data)]}
+
+
+def payload_ref(obj):
+    """
+    Decode a reference to a payload.
+
+    :param obj: reference put by put_payload, PayloadRef, or an inline object
+    :return: PayloadRef, None for an inline object
+    """
+    if isinstance(obj, PayloadRef):
+        return obj
+    if isinstance(obj, dict) and obj.keys() == {PAYLOAD_TAG}:
+        return PayloadRef(*obj[PAYLOAD_TAG])
+    return None
+
+
+def load_payload(obj):
+    """
+    Load an object from the payload store.
+
+    :param obj: reference to a payload (see payload_ref) or an inline object
+    :return: JSON (Python's list of dicts)
+    """
+    ref = payload_ref(obj)
+    if ref is None:
+        return obj
+    return json.loads(STORES[ref.store].get(ref.key))
+
+
+def delete_payload(obj):
+    """
+    Delete an object from the payload store; inline objects are left alone.
+
+    :param obj: reference to a payload (see payload_ref) or an inline object
+    :return: None
+    """
+    ref = payload_ref(obj)
+    if ref is not None:
+        STORES[ref.store].delete(ref.key)
+
+
+def purge_payloads():
+    """
+    Delete payloads older than DATASETS_PAYLOAD_MAX_AGE hours from all stores.
+
+    :return: int: number of payloads deleted
+    """
+    before = timezone.now() - timedelta(hours=settings.DATASETS_PAYLOAD_MAX_AGE)
+    return sum(store.purge(before) for store in STORES.values())
+
+
+class DatabaseStore(object):
+    """
+    Payloads in a PostgreSQL table.
+    """
+    @staticmethod
+    def put(data):
+        return Payload.objects.create(data=data).pk
+
+    @staticmethod
+    def get(key):
+        return Payload.objects.filter(pk=key).values_list('data', flat=True).get()
+
+    @staticmethod
+    def delete(key):
+        Payload.objects.filter(pk=key).delete()
+
+    @staticmethod
+    def purge(before):
+        deleted, _ = Payload.objects.filter(added__lt=before).delete()
+        return deleted
+
+
+class FileStore(object):
+    """
+    Payloads in files of DATASETS_PAYLOAD_DIR directory.
+    """
+    @staticmethod
+    def path(key):
+        return os.path.join(settings.DATASETS_PAYLOAD_DIR, '{0}.json'.format(key))
+
+    @classmethod
+    def put(cls, data):
+        os.makedirs(settings.DATASETS_PAYLOAD_DIR, exist_ok=True)
+        key = uuid.uuid4().hex
+        # write to a temporary file first, so that a payload is never seen half-written
+        temp_path = cls.path(key) + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as payload_file:
+            payload_file.write(data)
+        os.replace(temp_path, cls.path(key))
+        return key
+
+    @classmethod
+    def get(cls, key):
+        with open(cls.path(key), encoding='utf-8') as payload_file:
+            return payload_file.read()
+
+    @classmethod
+    def delete(cls, key):
+        try:
+            os.remove(cls.path(key))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def purge(before):
+        if not os.path.isdir(settings.DATASETS_PAYLOAD_DIR):
+            return 0
+
+        deleted = 0
+        before = before.timestamp()
+        for entry in os.scandir(settings.DATASETS_PAYLOAD_DIR):
+            if entry.is_file() and entry.stat().st_mtime < before:
+                os.remove(entry.path)
+                deleted += 1
+        return deleted
+
+
+STORES = {
+    'db': DatabaseStore,
+    'file': FileStore,
+}
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Dataset
+from .db import bulk_update, claim_rows
+from .cache import store_result
+from .tasks import compute_result
+from .storage import load_data
+from .results import set_result
+from .report_cache import bump_generation
+
+# Database queue: a broker-less way to process datasets.
+#
+# With DATASETS_PIPELINE = 'queue' process_datasets only claims datasets for a processing,
+# nothing is sent to Celery. Workers (see `manage.py process_queue`) poll the Dataset table
+# for claimed datasets with no result yet, and pick a batch of them by marking them started
+# with a single UPDATE over SKIP LOCKED rows, committed at once, so that the batch shows as running
+# just like datasets in the chain do. Then they run the test function and write the results back.
+# Concurrent workers never wait for each other's batches, and never pick a started batch,
+# unless it was started more than DATASETS_DISPATCH_TIMEOUT seconds ago: a batch of a crashed
+# worker is then taken for lost, and another worker picks it up.
+
+
+def pending_datasets():
+    """
+    Return datasets claimed for a processing, but not processed yet.
+
+    Datasets that got an exception on submission are never processed, just like in the chain.
+
+    :return: QuerySet of Dataset objects in PK order
+    """
+    return Dataset.objects.filter(processing__isnull=False, result__isnull=True,
+                                  result_packed__isnull=True, exception='').order_by('pk')
+
+
+def process_pending(batch_size, map_function=map):
+    """
+    Process a batch of pending datasets.
+
+    Datasets end up in the same state as if they went through the chain;
+    status of their processings is merged from them, see status.py.
+
+    :param batch_size: int: max number of datasets to process
+    :param map_function: function with the signature of the built-in map(),
+                         e.g. Pool.map to run the test function in a process pool
+    :return: int: number of processed datasets
+    """
+    now = timezone.now()
+    lost_before = now - timedelta(seconds=settings.DATASETS_DISPATCH_TIMEOUT)
+    not_started = pending_datasets().filter(Q(started__isnull=True) | Q(started__lt=lost_before))
+    dataset_pks = claim_rows(not_started, 'started', now, batch_size)
+    if not dataset_pks:
+        return 0
+
+    datasets = list(Dataset.objects.filter(pk__in=dataset_pks).
+                    only('id', 'processing', 'data', 'columns', 'data_hash'))
+    # columnar files are mapped by whatever process runs the test function
+    results = list(map_function(compute_stored_result,
+                                [(dataset.data, dataset.columns.name) for dataset in datasets]))
+
+    now = timezone.now()
+    for dataset, (result, exception_message) in zip(datasets, results):
+        set_result(dataset, result)
+        dataset.exception = exception_message
+        dataset.processed = now
+
+    with transaction.atomic():
+        bulk_update(Dataset, datasets, ['result', 'result_packed', 'exception', 'processed'])
+        bump_generation()
+
+    for dataset, (result, exception_message) in zip(datasets, results):
+        store_result(dataset.data_hash, result, exception_message)
+
+    return len(datasets)
+
+
+def compute_stored_result(data_and_columns_name):
+    """
+    Run the test function on a dataset's data, wherever it is stored.
+
+    :param data_and_columns_name: tuple of two (JSON (Python's list of dicts);
+                                  name of the dataset's columnar file, empty if none)
+    :return: tuple of two (JSON (Python's list of dicts); exception message, empty if none)
+    """
+    return compute_result(load_data(*data_and_columns_name))
@@ -0,0 +1,100 @@
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+# Caching of the report page.
+#
+# Results on the report page only change once datasets get claimed for a processing or processed.
+# Whatever does that bumps the report generation, a PostgreSQL sequence (see migration 0021):
+# nextval() takes no row locks, so workers never wait on each other for it, and all web processes
+# see the same value whatever cache they use. It is bumped once the transaction commits, so a page
+# rendered at a generation never misses results written before it.
+#
+# Fragments of the page, the datasets of a page (or cursor) and the Last Check sidebar, are cached
+# in the `report` cache (see CACHES) under the generation they were rendered at: a bump makes them
+# all stale at once, with nothing to delete. The generation and the page make the page's ETag,
+# the time the generation was first rendered makes its Last-Modified, so unchanged pages get 304
+# for a single query. With DATASETS_REPORT_CACHE_SECONDS = 0 nothing is cached.
+
+GENERATION_SEQUENCE = 'datasets_report_generation'
+FRAGMENT_CACHE_KEY = 'datasets:report:{0}:{1}'
+
+# Query parameters that select a page of the report
+PAGE_PARAMETERS = ('page', 'after', 'before')
+
+
+def bump_generation():
+    """
+    Make cached report pages stale once the current transaction commits, right away if there is none.
+
+    :return: None
+    """
+    if settings.DATASETS_REPORT_CACHE_SECONDS:
+        transaction.on_commit(_next_generation)
+
+
+def _next_generation():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT nextval(%s)', [GENERATION_SEQUENCE])
+
+
+def current_generation():
+    """
+    :return: int, None if caching is off
+    """
+    if not settings.DATASETS_REPORT_CACHE_SECONDS:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT CASE WHEN is_called THEN last_value ELSE 0 END '
+                       'FROM {0}'.format(connection.ops.quote_name(GENERATION_SEQUENCE)))
+        return cursor.fetchone()[0]
+
+
+def page_key(request):
+    """
+    :param request: Request
+    :return: str: key of the page of the report requested
+    """
+    page = [settings.DATASETS_PAGINATION, settings.DATASETS_RESULT_PREVIEW_ITEMS] + \
+        [request.GET.get(parameter, '') for parameter in PAGE_PARAMETERS]
+    return hashlib.md5(repr(page).encode()).hexdigest()
+
+
+def get_fragments(generation, names):
+    """
+    Return fragments of the report rendered at a generation, and the time it was first rendered.
+
+    :param generation: int, None if caching is off
+    :param names: list of str: names of fragments
+    :return: tuple of two (dict of names to fragments found; int: timestamp, None if unknown)
+    """
+    if generation is None:
+        return {}, None
+
+    keys = {FRAGMENT_CACHE_KEY.format(generation, name): name for name in names + ['modified']}
+    found = {keys[key]: value for key, value in caches['report'].get_many(list(keys)).items()}
+    return found, found.pop('modified', None)
+
+
+def set_fragments(generation, fragments):
+    """
+    Cache fragments of the report rendered at a generation.
+
+    :param generation: int, None if caching is off
+    :param fragments: dict of names to fragments
+    :return: int: timestamp of the generation, None if caching is off
+    """
+    if generation is None:
+        return None
+
+    cache = caches['report']
+    timeout = settings.DATASETS_REPORT_CACHE_SECONDS
+    modified_key = FRAGMENT_CACHE_KEY.format(generation, 'modified')
+    cache.add(modified_key, int(time.time()), timeout)
+    cache.set_many({FRAGMENT_CACHE_KEY.format(generation, name): fragment
+                    for name, fragment in fragments.items()}, timeout)
+    return cache.get(modified_key)
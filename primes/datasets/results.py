@@ -0,0 +1,161 @@
+import sys
+from array import array
+
+from django.conf import settings
+
+from .models import Dataset
+from .db import bytea_slice
+
+# Compact encoding of results.
+#
+# A result of [{"result": n}, ...] repeats the "result" key on every item. With
+# DATASETS_RESULT_ENCODING = 'packed' it is stored in Dataset.result_packed instead:
+#
+#   type tag: b'q' for int64 or b'd' for float64 items
+#   items: 8 bytes each, big-endian (as PostgreSQL's int8send/float8send give them)
+#
+# and Dataset.result is left NULL. Results of any other items (e.g. ints beyond int64,
+# ints mixed with floats, strings) are stored as JSON, so are results written before.
+# Packed results get decoded to the JSON shape only when asked for, and only the items asked for.
+
+ITEM_SIZE = 8
+HEADER_SIZE = 1
+TYPECODES = (b'q', b'd')
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def pack_result(result):
+    """
+    Encode a result into bytes.
+
+    :param result: JSON (Python's list of dicts)
+    :return: bytes, None if the result can't be packed
+    """
+    if not isinstance(result, list):
+        return None
+    if not all(type(item) is dict and len(item) == 1 and 'result' in item for item in result):
+        return None
+
+    values = [item['result'] for item in result]
+    typecode = values_typecode(values)
+    if typecode is None:
+        return None
+
+    items = array(typecode, values)
+    if sys.byteorder == 'little':
+        items.byteswap()
+    return typecode.encode() + items.tobytes()
+
+
+def values_typecode(values):
+    """
+    Return the array typecode values can be stored with as int64 or float64 with no change.
+
+    Used for results, columnar files (see storage.py) and columns of the columnar kernel.
+
+    :param values: list of values
+    :return: str: 'q' or 'd'; None if the values are of any other type
+    """
+    # exact types: bools are ints too, but they must stay bools
+    types = set(map(type, values))
+    if types <= {int}:
+        if all(INT64_MIN <= value <= INT64_MAX for value in values):
+            return 'q'
+    elif types == {float}:
+        return 'd'
+    return None
+
+
+class PackedResult(object):
+    """
+    A packed result, decoded item by item on demand.
+    """
+    def __init__(self, packed):
+        """
+        :param packed: bytes: type tag followed by items, possibly a slice of them
+        """
+        self.typecode = bytes(packed[:HEADER_SIZE]).decode()
+        self.items = memoryview(packed)[HEADER_SIZE:]
+
+    def __len__(self):
+        return len(self.items) // ITEM_SIZE
+
+    def __getitem__(self, index):
+        """
+        :param index: slice
+        :return: JSON (Python's list of dicts)
+        """
+        start, stop, _ = index.indices(len(self))
+        values = array(self.typecode)
+        values.frombytes(self.items[start * ITEM_SIZE:stop * ITEM_SIZE])
+        if sys.byteorder == 'little':
+            values.byteswap()
+        return [{'result': value} for value in values]
+
+    def to_list(self):
+        """
+        :return: JSON (Python's list of dicts)
+        """
+        return self[:]
+
+
+def result_fields(result):
+    """
+    Return fields to save a result with, encoded as set with DATASETS_RESULT_ENCODING.
+
+    :param result: JSON (Python's list of dicts)
+    :return: dict of field names to values, e.g. for QuerySet.update()
+    """
+    packed = pack_result(result) if settings.DATASETS_RESULT_ENCODING == 'packed' else None
+    if packed is None:
+        return {'result': result, 'result_packed': None}
+    return {'result': None, 'result_packed': packed}
+
+
+def set_result(dataset, result):
+    """
+    Set a result on a dataset, encoded as set with DATASETS_RESULT_ENCODING.
+
+    :param dataset: Dataset instance
+    :param result: JSON (Python's list of dicts)
+    :return: None
+    """
+    for field, value in result_fields(result).items():
+        setattr(dataset, field, value)
+
+
+def load_result(result, packed):
+    """
+    Return a result in the JSON shape, however it is stored.
+
+    :param result: JSON (Python's list of dicts) from Dataset.result
+    :param packed: bytes from Dataset.result_packed, or None
+    :return: JSON (Python's list of dicts), None if there is no result
+    """
+    if packed is not None:
+        return PackedResult(packed).to_list()
+    return result
+
+
+def packed_result_slice(dataset_pk, start, stop):
+    """
+    Fetch items [start:stop] of a packed result, along with the number of its items.
+
+    Only the bytes of the items asked for are fetched from the DB.
+
+    :param dataset_pk: Dataset PK
+    :param start: int: index of the first item
+    :param stop: int: index past the last item
+    :return: tuple of two (JSON (Python's list of dicts); int: number of items),
+             both None if the result is not packed
+    :raises: Dataset.DoesNotExist
+    """
+    header, length = bytea_slice(Dataset, dataset_pk, 'result_packed', 0, HEADER_SIZE)
+    if header is None:
+        return None, None
+
+    total = (length - HEADER_SIZE) // ITEM_SIZE
+    start, stop = min(start, total), min(max(stop, start), total)
+    items, _ = bytea_slice(Dataset, dataset_pk, 'result_packed',
+                           HEADER_SIZE + start * ITEM_SIZE, HEADER_SIZE + stop * ITEM_SIZE)
+    return PackedResult(header + items).to_list(), total
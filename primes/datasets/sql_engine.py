@@ -0,0 +1,173 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Dataset
+from .db import bulk_update
+from .results import set_result
+from .report_cache import bump_generation
+
+# In-database execution of the test function.
+#
+# With DATASETS_PIPELINE = 'sql' results of a processing's datasets are computed by PostgreSQL
+# with a single UPDATE ... FROM over jsonb_array_elements() of their data, packed into
+# Dataset.result_packed with int8send/float8send or aggregated into Dataset.result as JSON,
+# just as the Python path would store them. No data leaves the DB, no tasks are sent.
+#
+# SQL only takes pairs of JSON numbers, with Python's semantics: ints are added up as numerics
+# (Python ints never overflow), anything with a decimal point as float8. JSONB doesn't keep
+# the original number token, so a float written with an exponent, e.g. 1e+16, reads back as
+# a whole number with no decimal point: whole numbers beyond MAX_EXACT_INT can't be told from
+# such floats, and pairs of them are left to Python. A dataset with any other item (strings,
+# bools, nulls, missing keys, floats about to overflow, whole numbers that may be floats) is looked
+# at item by item:
+# the first such item alone is run through the Python test function, so that its exception,
+# if it raises one, is recorded in Dataset.exception with exactly the Python wording
+# (e.g. "TypeError: unsupported operand type(s) for +: 'int' and 'str'").
+# Datasets that don't raise (e.g. strings concatenated), datasets stored in columnar files or
+# not as arrays, and kernels SQL can't express, are left to the Celery path.
+#
+# Whole float results are written to JSON with a trailing `.0` (to_jsonb() would write 3.0 as 3),
+# from the shortest text that reads back as the same float, so that they read back as floats.
+
+# Kernels expressed in SQL below; both add up `a` and `b` of each pair
+SQL_KERNELS = ('python', 'columnar')
+
+# Floats beyond that are left to Python, which may overflow them into inf
+MAX_FLOAT = '1e308'
+
+# Whole numbers from that on may have been floats written with an exponent, see above
+MAX_EXACT_INT = 2 ** 53
+
+INT8_MIN, INT8_MAX = -2 ** 63, 2 ** 63 - 1
+
+# Items of candidate datasets, one row per item: index, item, `a` and `b` as numerics,
+# whether either of them is a float, whether the item can be computed in SQL.
+# A dataset of no items gets a single row of NULL item.
+ITEMS_SQL = '''
+    WITH items AS (
+        SELECT d.{pk} AS dataset, e.idx, e.item,
+               e.item IS NULL OR COALESCE(jsonb_typeof(e.item) = 'object'
+                                          AND jsonb_typeof(e.item -> 'a') = 'number'
+                                          AND jsonb_typeof(e.item -> 'b') = 'number', false) AS numbers
+        FROM {table} AS d
+        LEFT JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(d.{data}) = 'array' THEN d.{data} ELSE '[]'::jsonb END
+        ) WITH ORDINALITY AS e (item, idx) ON true
+        WHERE d.{pk} IN ({subquery}) AND jsonb_typeof(d.{data}) = 'array'
+    ), operands AS (
+        SELECT dataset, idx, item, numbers,
+               CASE WHEN numbers THEN (item ->> 'a')::numeric END AS a,
+               CASE WHEN numbers THEN (item ->> 'b')::numeric END AS b,
+               COALESCE(numbers AND (strpos(item ->> 'a', '.') > 0 OR strpos(item ->> 'b', '.') > 0),
+                        false) AS is_float
+        FROM items
+    ), checked AS (
+        SELECT dataset, idx, item, a, b, is_float,
+               numbers AND NOT (is_float AND (abs(a) >= {max_float} OR abs(b) >= {max_float}
+                                           OR abs(a + b) >= {max_float}))
+                       AND NOT COALESCE(NOT is_float AND (abs(a) >= {max_exact_int}
+                                                          OR abs(b) >= {max_exact_int}), false)
+                       AS computable
+        FROM operands
+    )
+'''
+
+UPDATE_SQL = ITEMS_SQL + '''
+    , results AS (
+        SELECT dataset,
+               COALESCE(jsonb_agg(jsonb_build_object('result', CASE
+                   WHEN NOT computable THEN NULL
+                   WHEN is_float AND a::float8 + b::float8 = trunc(a::float8 + b::float8)
+                   THEN ((a::float8 + b::float8)::text::numeric::text || '.0')::jsonb
+                   WHEN is_float THEN to_jsonb(a::float8 + b::float8)
+                   ELSE to_jsonb(a + b) END) ORDER BY idx) FILTER (WHERE item IS NOT NULL),
+                   '[]'::jsonb) AS result,
+               CASE
+                   WHEN NOT {packed} THEN NULL
+                   WHEN bool_and(NOT is_float AND (item IS NULL OR a + b BETWEEN {int8_min} AND {int8_max}))
+                   THEN '\\x71'::bytea || COALESCE(string_agg(CASE
+                       WHEN computable AND NOT is_float AND a + b BETWEEN {int8_min} AND {int8_max}
+                       THEN int8send((a + b)::int8) END, ''::bytea ORDER BY idx), ''::bytea)
+                   WHEN bool_and(is_float)
+                   THEN '\\x64'::bytea || string_agg(CASE
+                       WHEN computable AND is_float THEN float8send(a::float8 + b::float8) END,
+                       ''::bytea ORDER BY idx)
+               END AS packed
+        FROM checked
+        GROUP BY dataset
+        HAVING bool_and(computable)
+    )
+    UPDATE {table} AS d
+    SET {result} = CASE WHEN r.packed IS NULL THEN r.result END, {result_packed} = r.packed,
+        {processed} = now()
+    FROM results AS r
+    WHERE d.{pk} = r.dataset
+    RETURNING d.{pk}
+'''
+
+FIRST_ITEMS_SQL = ITEMS_SQL + '''
+    SELECT DISTINCT ON (dataset) dataset, item::text
+    FROM checked
+    WHERE NOT computable
+    ORDER BY dataset, idx
+'''
+
+
+def compute_in_database(query_set):
+    """
+    Compute results of datasets in the database, as many as SQL can.
+
+    :param query_set: QuerySet of Dataset objects claimed for a processing
+    :return: QuerySet of datasets left to process the usual way
+    """
+    if settings.DATASETS_KERNEL not in SQL_KERNELS:
+        return query_set
+
+    # datasets that got an exception on submission are left for the chain to flag
+    candidates = query_set.filter(exception='', result__isnull=True, result_packed__isnull=True,
+                                  columns='')
+
+    computed_pks = [dataset_pk for dataset_pk, in _execute(UPDATE_SQL, candidates)]
+    failed = _execute(FIRST_ITEMS_SQL, candidates.exclude(pk__in=computed_pks))
+
+    # all items before the first one SQL can't compute are fine,
+    # so the first one alone tells whether the whole dataset raises
+    from .tasks import compute_result
+
+    datasets = []
+    for dataset_pk, item in failed:
+        _, exception = compute_result([json.loads(item)])
+        if exception:
+            dataset = Dataset(pk=dataset_pk, exception=exception, processed=timezone.now())
+            set_result(dataset, [])
+            datasets.append(dataset)
+    bulk_update(Dataset, datasets, ['result', 'result_packed', 'exception', 'processed'])
+    bump_generation()
+
+    return query_set.exclude(pk__in=computed_pks + [dataset.pk for dataset in datasets])
+
+
+def _execute(sql, query_set):
+    """
+    Run one of the SQL statements above over datasets of a QuerySet.
+
+    :param sql: str: UPDATE_SQL or FIRST_ITEMS_SQL
+    :param query_set: QuerySet of Dataset objects
+    :return: list of rows returned
+    """
+    qn = connection.ops.quote_name
+    subquery, params = query_set.values('pk').query.sql_with_params()
+
+    sql = sql.format(table=qn(Dataset._meta.db_table), pk=qn('id'), data=qn('data'),
+                     result=qn('result'), result_packed=qn('result_packed'), processed=qn('processed'),
+                     packed='true' if settings.DATASETS_RESULT_ENCODING == 'packed' else 'false',
+                     int8_min=INT8_MIN, int8_max=INT8_MAX, max_float=MAX_FLOAT,
+                     max_exact_int=MAX_EXACT_INT,
+                     subquery=subquery)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+
+from .models import Processing, Dataset
+
+# Status of processings, merged from their datasets.
+#
+# Tasks never write the Processing row their dataset belongs to: with thousands of datasets
+# per processing that single row would serialize the workers on its lock. Each task only marks
+# its own dataset started and processed (Dataset.started, Dataset.processed, Dataset.exception).
+# Counters, the exceptions flag and last_modified of a processing are merged from its datasets
+# with a single UPDATE whenever they are about to be read, e.g. by the report page; finished
+# processings are left alone. The flag is only ever raised, just like the tasks used to do it.
+#
+# Progress of a processing is served as a small dict, cached for DATASETS_STATUS_CACHE_SECONDS
+# (for good once the processing of some datasets is finished), so that clients polling it cost
+# a cache lookup.
+
+STATUS_CACHE_KEY = 'datasets:status:{0}'
+
+
+def merge_status(query_set):
+    """
+    Merge status of datasets into their processings.
+
+    :param query_set: QuerySet of Processing objects
+    :return: list of PKs of the processings whose status changed
+    """
+    qn = connection.ops.quote_name
+    subquery, params = query_set.values('pk').query.sql_with_params()
+
+    sql = 'UPDATE {processing} AS p ' \
+          'SET {running} = s.running, {done} = s.done, {failed} = s.failed, {rows} = s.processed_rows, ' \
+          '{exceptions} = CASE WHEN s.failed > 0 THEN true ELSE p.{exceptions} END, ' \
+          '{last_modified} = GREATEST(p.{last_modified}, s.last_processed) ' \
+          'FROM (SELECT {processing_id}, ' \
+          'count(*) FILTER (WHERE {started} IS NOT NULL AND {processed} IS NULL) AS running, ' \
+          'count({processed}) AS done, ' \
+          'count(*) FILTER (WHERE {processed} IS NOT NULL AND {exception} <> %s) AS failed, ' \
+          'COALESCE(sum({size}) FILTER (WHERE {processed} IS NOT NULL), 0) AS processed_rows, ' \
+          'max({processed}) AS last_processed ' \
+          'FROM {dataset} WHERE {processing_id} IN ({subquery}) ' \
+          'GROUP BY {processing_id}) AS s ' \
+          'WHERE p.{pk} = s.{processing_id} ' \
+          'AND (p.{running}, p.{done}, p.{failed}) IS DISTINCT FROM (s.running, s.done, s.failed) ' \
+          'RETURNING p.{pk}'.format(processing=qn(Processing._meta.db_table),
+                                    dataset=qn(Dataset._meta.db_table),
+                                    running=qn('datasets_running'), done=qn('datasets_done'),
+                                    failed=qn('datasets_failed'), rows=qn('rows_processed'),
+                                    exceptions=qn('exceptions'), last_modified=qn('last_modified'),
+                                    processing_id=qn('processing_id'), started=qn('started'),
+                                    processed=qn('processed'), exception=qn('exception'),
+                                    size=qn('size'), pk=qn('id'), subquery=subquery)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [''] + list(params))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def unfinished_processings():
+    """
+    Return processings some datasets of which are not processed yet, as of the last merge.
+
+    :return: QuerySet of Processing objects
+    """
+    return Processing.objects.filter(datasets_done__lt=F('datasets_total'))
+
+
+def merge_unfinished():
+    """
+    Merge status of all unfinished processings.
+
+    :return: list of PKs of the processings whose status changed
+    """
+    return merge_status(unfinished_processings())
+
+
+def processing_status(processing_pk, fresh=False):
+    """
+    Return progress of a processing, from the cache if it is there.
+
+    :param processing_pk: Processing PK
+    :param fresh: bool: merge and read it anyway, e.g. once it is known to have changed
+    :return: dict, None if there is no such processing
+    """
+    key = STATUS_CACHE_KEY.format(processing_pk)
+    status = None if fresh else cache.get(key)
+    if status is not None:
+        return status
+
+    merge_status(unfinished_processings().filter(pk=processing_pk))
+    try:
+        processing = Processing.objects.get(pk=processing_pk)
+    except Processing.DoesNotExist:
+        return None
+
+    total, running, done = \
+        processing.datasets_total, processing.datasets_running, processing.datasets_done
+    status = {
+        'id': processing.pk,
+        'total': total,
+        'queued': max(total - running - done, 0),
+        'running': running,
+        'done': done,
+        'failed': processing.datasets_failed,
+        'rows_processed': processing.rows_processed,
+        'exceptions': processing.exceptions is True,
+        'finished': done >= total,
+        'last_modified': processing.last_modified,
+    }
+    timeout = settings.DATASETS_STATUS_CACHE_SECONDS
+    # a processing of no datasets may be just about to get them counted
+    if status['finished'] and total:
+        timeout = None
+    cache.set(key, status, timeout)
+    return status
@@ -0,0 +1,138 @@
+import sys
+import mmap
+import struct
+from array import array
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .handlers import handle_uploaded_file
+from .results import values_typecode
+
+# Columnar file storage of datasets' data.
+#
+# With DATASETS_STORAGE = 'file' a dataset of [{"a": .., "b": ..}, ...] pairs is written once
+# on submission into a file under MEDIA_ROOT rather than into Dataset.data:
+#
+#   header: magic (8 bytes), number of rows (uint64), type codes of columns `a` and `b`, padding
+#   column a: number of rows of int64 or float64
+#   column b: number of rows of int64 or float64
+#
+# Workers mmap the file and read columns (or slices of them) as typed memoryviews,
+# no JSON gets fetched from the DB or decoded. Data that doesn't fit the layout,
+# e.g. pairs with other keys, strings, or ints mixed with floats in a column, stays in the DB.
+# Files are written in native byte order, so the layout is used on little-endian machines only.
+
+MAGIC = b'PRIMCOL1'
+HEADER = struct.Struct('<8sQcc6x')
+COLUMNS = ('a', 'b')
+KEYS = frozenset(COLUMNS)
+
+
+def to_columns(data):
+    """
+    Split data into typed columns.
+
+    :param data: JSON (Python's list of dicts)
+    :return: tuple of array.array for columns `a` and `b`; None if data doesn't fit the columnar layout
+    """
+    if sys.byteorder != 'little' or not isinstance(data, list):
+        return None
+    if not all(type(item) is dict and item.keys() == KEYS for item in data):
+        return None
+
+    columns = []
+    for key in COLUMNS:
+        values = [item[key] for item in data]
+        typecode = values_typecode(values)
+        if typecode is None:
+            return None
+        columns.append(array(typecode, values))
+
+    return tuple(columns)
+
+
+def write_columns(name, columns):
+    """
+    Write columns into a file of the default storage.
+
+    :param name: str: name of the uploaded file
+    :param columns: tuple of array.array, see to_columns
+    :return: str: name of the file written
+    """
+    a, b = columns
+    header = HEADER.pack(MAGIC, len(a), a.typecode.encode(), b.typecode.encode())
+    path = handle_uploaded_file(None, name).rsplit('.', 1)[0] + '.columns'
+    return default_storage.save(path, ContentFile(header + a.tobytes() + b.tobytes()))
+
+
+class ColumnarData(object):
+    """
+    Data of a dataset as typed columns, read from a memory-mapped file.
+
+    Quacks like a list of {'a': .., 'b': ..} dicts just enough for slicing and len().
+    """
+    def __init__(self, columns):
+        """
+        :param columns: dict of column name to memoryview of int64 or float64
+        """
+        self.columns = columns
+
+    @classmethod
+    def open(cls, name):
+        """
+        Map a columnar file of the default storage into memory.
+
+        :param name: str: name of the file
+        :return: ColumnarData
+        :raises: ValueError if the file is not a columnar one
+        """
+        with open(default_storage.path(name), 'rb') as columns_file:
+            buffer = mmap.mmap(columns_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, rows, *typecodes = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError('{0} is not a columnar file'.format(name))
+
+        view = memoryview(buffer)
+        columns = {}
+        offset = HEADER.size
+        for key, typecode in zip(COLUMNS, typecodes):
+            column = view[offset:offset + rows * 8].cast(typecode.decode())
+            columns[key] = column
+            offset += rows * 8
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns['a'])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return {key: column[index] for key, column in self.columns.items()}
+        return ColumnarData({key: column[index] for key, column in self.columns.items()})
+
+    def column(self, key):
+        """
+        :param key: str: either 'a' or 'b'
+        :return: memoryview of int64 or float64
+        """
+        return self.columns[key]
+
+    def to_list(self):
+        """
+        :return: JSON (Python's list of dicts), just as it was submitted
+        """
+        return [{'a': a, 'b': b} for a, b in zip(self.columns['a'], self.columns['b'])]
+
+
+def load_data(data, columns_name):
+    """
+    Return data of a dataset, wherever it is stored.
+
+    :param data: JSON (Python's list of dicts) from Dataset.data
+    :param columns_name: str: name of the dataset's columnar file, empty if none
+    :return: JSON (Python's list of dicts) or ColumnarData
+    """
+    if columns_name:
+        return ColumnarData.open(columns_name)
+    return data
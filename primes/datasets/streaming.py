@@ -0,0 +1,94 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Dataset, Payload
+from .results import result_fields, values_typecode
+
+# Streaming of huge datasets through the test function.
+#
+# With DATASETS_STREAM_ROWS set, a dataset of more items gets read chunk by chunk, through
+# a server-side cursor (see db.iter_json_array) or slices of its columnar file. Results of each
+# chunk are staged in the UNLOGGED payload table, and once all chunks are done, PostgreSQL itself
+# assembles them into Dataset.result or Dataset.result_packed with a single UPDATE.
+# A worker holds no more than a chunk of data and results at a time, whatever the dataset's size.
+
+# Result of the staged chunks, packed as int64 or float64 items, or aggregated as JSON
+ASSEMBLE_SQL = {
+    'q': "'\\x71'::bytea || COALESCE(string_agg(int8send((t.item ->> 'result')::int8), ''::bytea "
+         "ORDER BY p.{pk}, t.idx), ''::bytea)",
+    'd': "'\\x64'::bytea || COALESCE(string_agg(float8send((t.item ->> 'result')::float8), ''::bytea "
+         "ORDER BY p.{pk}, t.idx), ''::bytea)",
+    None: "COALESCE(jsonb_agg(t.item ORDER BY p.{pk}, t.idx), '[]'::jsonb)",
+}
+
+
+def stream_result(dataset_pk, chunks, compute):
+    """
+    Run the test function on a dataset chunk by chunk and save its result.
+
+    Call it in an atomic block: staged results are only ever seen by this transaction,
+    and they are gone once it is over, whether the task succeeds or not.
+
+    :param dataset_pk: Dataset PK
+    :param chunks: iterable of consecutive chunks of the dataset's data
+    :param compute: function that runs the test function on a chunk, see tasks.compute_result
+    :return: tuple of two (int: number of result items; exception message, empty if none)
+    """
+    packed = settings.DATASETS_RESULT_ENCODING == 'packed'
+    typecodes = set()
+    staged = []
+    items = 0
+
+    for chunk in chunks:
+        result, exception_message = compute(chunk)
+        if exception_message:
+            # the dataset fails on the very item it would fail without streaming
+            Payload.objects.filter(pk__in=staged).delete()
+            Dataset.objects.filter(pk=dataset_pk).\
+                update(exception=exception_message, **result_fields([]))
+            return 0, exception_message
+
+        if packed:
+            typecodes.add(values_typecode([item['result'] for item in result]))
+        staged.append(Payload.objects.create(data=json.dumps(result)).pk)
+        items += len(result)
+
+    # all chunks must pack the same way, just as the whole result would; empty results pack as int64
+    if not packed:
+        typecode = None
+    elif not staged:
+        typecode = 'q'
+    else:
+        typecode = typecodes.pop() if len(typecodes) == 1 else None
+    _assemble(dataset_pk, staged, typecode)
+    Payload.objects.filter(pk__in=staged).delete()
+
+    return items, ''
+
+
+def _assemble(dataset_pk, payload_pks, typecode):
+    """
+    Save staged results of chunks on a dataset, in one UPDATE.
+
+    :param dataset_pk: Dataset PK
+    :param payload_pks: list of Payload PKs, in chunk order
+    :param typecode: str: 'q' or 'd' to pack the result with; None to save it as JSON
+    :return: None
+    """
+    qn = connection.ops.quote_name
+    target, other = ('result_packed', 'result') if typecode else ('result', 'result_packed')
+
+    sql = 'UPDATE {dataset} SET {target} = (' \
+          'SELECT {assemble} FROM {payload} AS p, ' \
+          'jsonb_array_elements(p.{data}::jsonb) WITH ORDINALITY AS t (item, idx) ' \
+          'WHERE p.{pk} = ANY(%s)), {other} = NULL ' \
+          'WHERE {pk} = %s'.format(dataset=qn(Dataset._meta.db_table),
+                                   payload=qn(Payload._meta.db_table),
+                                   assemble=ASSEMBLE_SQL[typecode].format(pk=qn('id')),
+                                   target=qn(target), other=qn(other),
+                                   data=qn('data'), pk=qn('id'))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [payload_pks, dataset_pk])
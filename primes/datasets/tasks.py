@@ -1,28 +1,344 @@
-from celery import shared_task, chain
+import time
+from datetime import timedelta
+from contextlib import contextmanager
+
+from celery import shared_task, chain, chord, group
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 from primes import celery_app
 
 from .models import Processing, Dataset
 from .exceptions import DatasetInputError
+from .kernels import get_kernel, add_column_pairs
+from .db import bulk_update, claim_rows, json_array_slice, json_array_length_sql, iter_json_array
+from .cache import use_cached_results, store_result, evict_cached_results
+from .executors import get_executor
+from .parsers import load_json_chunks, json_hash
+from .sql_engine import compute_in_database
+from .status import merge_status
+from .writes import update_status
+from .report_cache import bump_generation
+from .streaming import stream_result
+from .storage import ColumnarData, to_columns, write_columns, load_data
+from .results import set_result, result_fields
+from .payloads import put_payload, load_payload, delete_payload, purge_payloads
+
+# Number of items in dataset's JSON array: the one recorded on submission, or computed by PostgreSQL;
+# 0 for anything but an array
+DATASET_SIZE_SQL = 'COALESCE({table}.{size}, {length})'.format(
+    table=connection.ops.quote_name(Dataset._meta.db_table),
+    size=connection.ops.quote_name(Dataset._meta.get_field('size').column),
+    length=json_array_length_sql(Dataset, 'data'))
+
+logger = get_task_logger(__name__)
+
 
 # Test function chain #
-def process_datasets(query_set):
+def process_datasets(query_set, executor=None):
     """
     Process each item of the given QuerySet.
+
+    Unprocessed datasets of the QuerySet are claimed for a new processing first, atomically,
+    so that datasets claimed by concurrent calls are neither waited for nor processed twice.
+    With DATASETS_PIPELINE = 'batch' small datasets are grouped into batches,
+    each processed by a single task; larger ones still go through the chain.
+    With DATASETS_PIPELINE = 'fused' each dataset is processed by a single task.
+    With DATASETS_PIPELINE = 'queue' datasets are only claimed, no tasks are sent;
+    `manage.py process_queue` workers pick them up from the DB.
+    With DATASETS_PIPELINE = 'sql' results are computed by PostgreSQL with a single UPDATE;
+    datasets SQL can't compute go through the chain, see sql_engine.compute_in_database.
+    Datasets of more than DATASETS_SHARD_ROWS items are processed in shards.
+    Datasets of more than DATASETS_STREAM_ROWS items are streamed through a single task in chunks.
+    Tasks of datasets of more than DATASETS_LARGE_ROWS items go to the large lanes of queues.
+    With DATASETS_RESULT_CACHE on, datasets processed before get their results from the cache.
+
+    Tasks are run by the executor set with DATASETS_EXECUTOR: sent to Celery workers, or run
+    in this process or a local process pool; local executors return once all datasets are processed.
+    With Celery, datasets are prepared and dispatched by a task rather than right here,
+    so this returns as soon as datasets are claimed; see first_prepare_processing.
+    Tasks never write the processing, its status is merged from the datasets, see status.py.
+
     :param query_set: QuestySet of Dataset objects
-    :return: None
+    :param executor: executor to run tasks with, see executors.get_executor
+    :return: Processing PK
     """
 
-    # create Processing object in order to assign dataset to it
-    processing = Processing.objects.create()
+    # create Processing object in order to assign dataset to it; it is never seen
+    # with its datasets claimed, but not counted yet
+    with transaction.atomic():
+        processing = Processing.objects.create()
+        claimed = claim_rows(query_set.filter(processing__isnull=True, parse_pending=False),
+                             'processing', processing.pk)
+        Processing.objects.filter(pk=processing.pk).update(datasets_total=len(claimed))
+    bump_generation()
+
+    if settings.DATASETS_PIPELINE == 'queue':
+        # no tasks to send, datasets are left to process_queue workers
+        prepare_processing(processing.pk)
+        return processing.pk
+
+    executor = executor or get_executor()
+
+    if not executor.local:
+        first_prepare_processing.delay(processing.pk)
+        return processing.pk
 
-    for dataset in query_set:
-        # Chaining three tasks with Celery chain
-        chain_result = chain(first_select_json_from_dataset.s((dataset.pk, processing.pk)),
-                             second_test_function.s(),
-                             third_save_json_to_db.s()).apply_async()
+    dispatch_datasets(prepare_processing(processing.pk), processing.pk, executor)
+    executor.join()
+    merge_status(Processing.objects.filter(pk=processing.pk))
 
     return processing.pk
 
+
+def prepare_processing(processing_pk):
+    """
+    Get datasets claimed for a processing ready to be dispatched.
+
+    With DATASETS_RESULT_CACHE on, datasets processed before get their results from the cache;
+    with DATASETS_PIPELINE = 'sql' results are computed by PostgreSQL, as many as it can;
+    with DATASETS_PIPELINE = 'queue' datasets that got an exception on submission are marked processed.
+
+    :param processing_pk: Processing PK
+    :return: QuerySet of Dataset objects left to dispatch
+    """
+    query_set = Dataset.objects.filter(processing_id=processing_pk)
+
+    if settings.DATASETS_RESULT_CACHE:
+        evict_cached_results()
+        query_set = use_cached_results(query_set, processing_pk)
+
+    if settings.DATASETS_PAYLOAD_STORE:
+        purge_payloads()
+
+    if settings.DATASETS_PIPELINE == 'queue':
+        # datasets that got an exception on submission are never processed
+        query_set.exclude(exception='').update(processed=timezone.now())
+        bump_generation()
+        return query_set.none()
+
+    if settings.DATASETS_PIPELINE == 'sql':
+        query_set = compute_in_database(query_set)
+
+    return query_set
+
+
+def dispatch_datasets(query_set, processing_pk, executor=None):
+    """
+    Start tasks for each dataset of the given QuerySet, as set with DATASETS_PIPELINE.
+
+    :param query_set: QuestySet of Dataset objects
+    :param processing_pk: Processing PK
+    :param executor: executor to run tasks with; tasks are sent to Celery by default
+    :return: None
+    """
+    executor = executor or get_executor('celery')
+
+    if settings.DATASETS_PIPELINE == 'batch':
+        # datasets too large for a batch go through the chain below
+        batches, sizes = make_batches(query_set)
+        for dataset_pks in batches:
+            executor.submit(second_test_function_batch, (dataset_pks, processing_pk))
+    elif settings.DATASETS_SHARD_ROWS or settings.DATASETS_STREAM_ROWS or settings.DATASETS_LARGE_ROWS:
+        sizes = dataset_sizes(query_set)
+    else:
+        # sizes are not needed without sharding
+        sizes = ((dataset_pk, 0) for dataset_pk in query_set.values_list('pk', flat=True))
+
+    for dataset_pk, size in sizes:
+        dispatch_dataset(dataset_pk, processing_pk, size, executor)
+
+
+def dispatch_dataset(dataset_pk, processing_pk, size=0, executor=None):
+    """
+    Start a chain of three tasks for a dataset, or a single fused task.
+
+    A dataset of more than DATASETS_SHARD_ROWS items is split into index ranges:
+    the second task runs for each range in parallel, then the third one merges the results.
+    Local executors run datasets in parallel already, so they never shard them.
+    A dataset of more than DATASETS_STREAM_ROWS items is streamed through a single task instead.
+
+    :param dataset_pk: Dataset PK
+    :param processing_pk: Processing PK
+    :param size: int: number of items in the dataset
+    :param executor: executor to run tasks with; tasks are sent to Celery by default
+    :return: AsyncResult
+    """
+    stream_rows = settings.DATASETS_STREAM_ROWS
+    stream = stream_rows and size > stream_rows
+
+    if executor is not None and executor.local:
+        if stream:
+            task = second_test_function_stream
+        elif settings.DATASETS_PIPELINE == 'fused':
+            task = second_test_function_fused
+        else:
+            task = run_chain
+        return executor.submit(task, (dataset_pk, processing_pk))
+
+    if stream:
+        return route(second_test_function_stream.s((dataset_pk, processing_pk)), size).apply_async()
+
+    shard_rows = settings.DATASETS_SHARD_ROWS
+
+    if shard_rows and size > shard_rows:
+        shards = group(route(second_test_function_shard.s(start, min(start + shard_rows, size)), size)
+                       for start in range(0, size, shard_rows))
+        return chain(route(first_select_json_from_dataset.s((dataset_pk, processing_pk)), size),
+                     chord(shards, route(third_merge_shards.s(), size))).apply_async()
+
+    if settings.DATASETS_PIPELINE == 'fused':
+        return route(second_test_function_fused.s((dataset_pk, processing_pk)), size).apply_async()
+
+    # Chaining three tasks with Celery chain
+    return chain(route(first_select_json_from_dataset.s((dataset_pk, processing_pk)), size),
+                 route(second_test_function.s(), size),
+                 route(third_save_json_to_db.s(), size)).apply_async()
+
+
+def route(signature, size):
+    """
+    Send a task of a large dataset to the large lane of its stage's queue.
+
+    Tasks of datasets of no more than DATASETS_LARGE_ROWS items, and tasks of stages
+    with no large lane set up, are routed with CELERY_TASK_ROUTES as usual.
+
+    :param signature: Celery signature of a task
+    :param size: int: number of items in the dataset
+    :return: the signature
+    """
+    large_rows = settings.DATASETS_LARGE_ROWS
+    if not large_rows or size <= large_rows:
+        return signature
+
+    stage = signature.task.rsplit('.', 1)[-1].split('_', 1)[0]
+    queue = settings.DATASETS_LARGE_QUEUES.get(stage)
+    if queue:
+        signature.set(queue=queue)
+    return signature
+
+
+def dataset_sizes(query_set):
+    """
+    Get number of items in each dataset, as recorded on submission,
+    or computed by PostgreSQL without fetching JSON data.
+
+    :param query_set: QuestySet of Dataset objects
+    :return: QuerySet of tuples of two (Dataset PK, number of items) in PK order
+    """
+    return query_set.annotate(items=RawSQL(DATASET_SIZE_SQL, [])).\
+        order_by('pk').values_list('pk', 'items')
+
+
+def make_batches(query_set):
+    """
+    Group datasets into bins bounded by DATASETS_BATCH_ROWS items and DATASETS_BATCH_SIZE datasets.
+
+    :param query_set: QuestySet of Dataset objects
+    :return: tuple of two (list of lists of Dataset PKs;
+             list of tuples (Dataset PK, number of items) for datasets too large for a batch)
+    """
+    max_rows = settings.DATASETS_BATCH_ROWS
+    max_datasets = settings.DATASETS_BATCH_SIZE
+
+    batches = []
+    large = []
+    batch = []
+    batch_rows = 0
+
+    for dataset_pk, size in dataset_sizes(query_set):
+        if size > max_rows:
+            large.append((dataset_pk, size))
+            continue
+        if batch and (batch_rows + size > max_rows or len(batch) >= max_datasets):
+            batches.append(batch)
+            batch = []
+            batch_rows = 0
+        batch.append(dataset_pk)
+        batch_rows += size
+
+    if batch:
+        batches.append(batch)
+
+    return batches, large
+
+
+def run_chain(dataset_and_processing_pks):
+    """
+    Run the chain's three tasks one after another in this process.
+
+    :param dataset_and_processing_pks: tuple of two (Dataset PK, Processing PK)
+    :return: boolean: True if data saved to the data base, False otherwise
+    """
+    try:
+        return third_save_json_to_db(second_test_function(
+            first_select_json_from_dataset(dataset_and_processing_pks)))
+    except DatasetInputError:
+        # the chain stops as the dataset got an exception on submission
+        return False
+
+
+@contextmanager
+def log_duration(stage, dataset_pk):
+    """
+    Log how long a stage of dataset processing took.
+
+    Chained tasks are timed by Celery itself, see "Task ... succeeded in ..." worker's log records.
+
+    :param stage: str: stage name
+    :param dataset_pk: Dataset PK
+    """
+    started = time.perf_counter()
+    yield
+    logger.info('Dataset %s: %s took %.6fs', dataset_pk, stage, time.perf_counter() - started)
+
+
+def compute_result(data):
+    """
+    Run the test function on a dataset's JSON.
+
+    :param data: JSON (Python's list of dicts) or ColumnarData
+    :return: tuple of two (JSON (Python's list of dicts); exception message, empty if none)
+    """
+    try:
+        if isinstance(data, ColumnarData):
+            return add_column_pairs(data.column('a'), data.column('b')), ''
+        return get_kernel()(data), ''
+    except Exception as err:
+        # exception string = exception type + exception args
+        return [], "{type}: {message}".format(type=type(err).__name__, message=err)
+
+
+def parse_dataset(dataset, chunks):
+    """
+    Parse uploaded JSON onto a dataset; parsing errors are saved as the dataset's exception.
+
+    With DATASETS_STORAGE = 'file' data that fits the columnar layout is written into a file
+    rather than onto the dataset. The dataset itself is not saved.
+
+    :param dataset: Dataset instance
+    :param chunks: iterable of bytes, e.g. UploadedFile.chunks()
+    :return: str: exception message, empty if none
+    """
+    try:
+        data = load_json_chunks(chunks)
+    except Exception as err:
+        dataset.exception = "{type}: {message}".format(type=type(err).__name__, message=err)
+        return dataset.exception
+
+    dataset.size = len(data) if isinstance(data, list) else 0
+    if settings.DATASETS_RESULT_CACHE:
+        dataset.data_hash = json_hash(data)
+
+    columns = to_columns(data) if settings.DATASETS_STORAGE == 'file' else None
+    if columns is None:
+        dataset.data = data
+    else:
+        dataset.columns = write_columns(dataset.name or 'dataset.json', columns)
+    return ''
+
 # main tasks
 
 # Since Celery is a distributed system, you can't know in which process,
@@ -31,6 +347,96 @@ def process_datasets(query_set):
 # re-fetch the object from the database instead, as there are possible
 # race conditions involved.
 
+@shared_task
+def first_prepare_processing(processing_pk):
+    """
+    Prepare datasets claimed for a processing, then send their tasks to Celery,
+    all at once or as set with DATASETS_DISPATCH_WINDOW.
+
+    :param processing_pk: Processing PK
+    :return: None
+    """
+    query_set = prepare_processing(processing_pk)
+
+    if settings.DATASETS_DISPATCH_WINDOW:
+        first_dispatch_window(processing_pk)
+    else:
+        dispatch_datasets(query_set, processing_pk)
+
+
+@shared_task
+def first_dispatch_window(processing_pk):
+    """
+    Keep up to DATASETS_DISPATCH_WINDOW datasets of a processing in flight.
+
+    Datasets are dispatched in PK order; the processing keeps the PK of the last one dispatched.
+    Each run tops the window up with as many datasets as have been processed since the last run,
+    then the task runs again in DATASETS_DISPATCH_INTERVAL seconds, till all datasets are dispatched.
+    Datasets dispatched more than DATASETS_DISPATCH_TIMEOUT seconds ago are no longer in flight,
+    so that chains that never complete (lost tasks, crashed workers) don't hold the window forever.
+    The processing is locked while dispatching, so that the runs never overlap.
+
+    :param processing_pk: Processing PK
+    :return: int: number of datasets dispatched
+    """
+    window = settings.DATASETS_DISPATCH_WINDOW
+    now = timezone.now()
+    lost_before = now - timedelta(seconds=settings.DATASETS_DISPATCH_TIMEOUT)
+
+    with transaction.atomic():
+        processing = Processing.objects.select_for_update().get(pk=processing_pk)
+        claimed = Dataset.objects.filter(processing_id=processing_pk)
+
+        # dispatched lately, but neither processed yet, nor stopped with an exception on submission
+        in_flight = claimed.filter(pk__lte=processing.dispatch_cursor,
+                                   dispatched__gte=lost_before,
+                                   result__isnull=True, result_packed__isnull=True,
+                                   exception='')[:window].count()
+        # datasets with results from the cache need no dispatching
+        pending = claimed.filter(pk__gt=processing.dispatch_cursor,
+                                 result__isnull=True, result_packed__isnull=True).order_by('pk')
+
+        dataset_pks = list(pending.values_list('pk', flat=True)[:max(window - in_flight, 0)])
+        if dataset_pks:
+            Dataset.objects.filter(pk__in=dataset_pks).update(dispatched=now)
+            dispatch_datasets(Dataset.objects.filter(pk__in=dataset_pks), processing_pk)
+            Processing.objects.filter(pk=processing_pk).update(dispatch_cursor=dataset_pks[-1])
+            more = pending.filter(pk__gt=dataset_pks[-1]).exists()
+        else:
+            more = pending.exists()
+
+    if more:
+        first_dispatch_window.apply_async((processing_pk,),
+                                          countdown=settings.DATASETS_DISPATCH_INTERVAL)
+
+    return len(dataset_pks)
+
+
+@shared_task
+def first_parse_upload(dataset_pk):
+    """
+    Parse the raw upload of a dataset submitted with DATASETS_INGESTION = 'async',
+    then delete it: once parsed, the dataset holds its data.
+
+    :param dataset_pk: Dataset PK
+    :return: boolean: True if parsed with no exception, False otherwise
+    """
+    dataset = Dataset.objects.get(pk=dataset_pk)
+
+    dataset.upload.open('rb')
+    try:
+        exception_message = parse_dataset(dataset, dataset.upload.chunks())
+    finally:
+        dataset.upload.close()
+    dataset.upload.delete(save=False)
+
+    dataset.parse_pending = False
+    dataset.save(update_fields=['data', 'exception', 'size', 'data_hash', 'columns', 'upload',
+                                'parse_pending'])
+
+    return not exception_message
+
+
 @shared_task
 def first_select_json_from_dataset(dataset_and_processing_pks):
     """
@@ -42,25 +448,26 @@ def first_select_json_from_dataset(dataset_and_processing_pks):
     # unpack tuple; needed for Celery chain compatibility
     dataset_pk, processing_pk = dataset_and_processing_pks
 
-    # re-fetch Dataset and Processing from DB
-    dataset = Dataset.objects.get(pk=dataset_pk)
-    processing = Processing.objects.get(pk=processing_pk)
-
-    # mark dataset belonging to the given Processing item
-    dataset.processing = processing
+    # re-fetch Dataset's status from DB, its data is not needed here
+    current_processing_pk, exception_message = Dataset.objects.filter(pk=dataset_pk).\
+        values_list('processing_id', 'exception').get()
 
-    # save dataset
-    dataset.save()
+    # mark dataset started and belonging to the given Processing item,
+    # unless it is claimed for it already
+    status = {'started': timezone.now()}
+    if current_processing_pk != processing_pk:
+        status['processing_id'] = processing_pk
 
-    # if dataset got an exception on submission,
-    # mark related processing having exceptions,
+    # if dataset got an exception on submission, it is done with:
+    # the processing gets marked having exceptions once its status is merged,
     # raise an error, so that further execution of the chain stops
-    if dataset.exception:
-        processing.exceptions = True
-        processing.save()
+    if exception_message:
+        update_status(dataset_pk, processed=timezone.now(), **status)
         raise DatasetInputError('Submitted dataset has got an exception')
 
-    return dataset.pk, processing.pk
+    update_status(dataset_pk, **status)
+
+    return dataset_pk, processing_pk
 
 
 @shared_task
@@ -68,32 +475,24 @@ def second_test_function(dataset_and_processing_pks):
     """
     Pass a result of JSON processing to a function that saves result on a model.
 
+    Large results are passed by reference to the payload store, see payloads.put_payload.
+
     :param dataset_and_processing_pks: tuple of two (Dataset PK, Processing PK)
-    :return: tuple of two (Dataset PK; JSON (Python's list of dicts))
+    :return: tuple of two (Dataset PK; JSON (Python's list of dicts) or payload reference)
     """
     # unpack tuple; needed for Celery chain compatibility
     dataset_pk, processing_pk = dataset_and_processing_pks
 
-    # re-fetch Dataset and Processing
-    dataset = Dataset.objects.get(pk=dataset_pk)
-    processing = Processing.objects.get(pk=processing_pk)
+    # re-fetch Dataset's data
+    data, columns_name = Dataset.objects.filter(pk=dataset_pk).values_list('data', 'columns').get()
 
-    result = []
     # calculate result; handle exceptions
-    try:
-        result = [{'result': pair['a'] + pair['b']} for pair in dataset.data]
-    except Exception as err:
-        # exception string = exception type + exception args
-        exception_message = "{type}: {message}". \
-            format(type=type(err).__name__, message=err)
-        # save exception to db
-        dataset.exception = exception_message
-        processing.exceptions = True
-
-    dataset.save()
-    processing.save()
+    result, exception_message = compute_result(load_data(data, columns_name))
+    if exception_message:
+        # save exception to db; the third task reads it back
+        Dataset.objects.filter(pk=dataset_pk).update(exception=exception_message)
 
-    return dataset_pk, result
+    return dataset_pk, put_payload(result)
 
 
 @shared_task
@@ -101,17 +500,213 @@ def third_save_json_to_db(dataset_pk_and_json):
     """
     Save input JSON on a model.
 
-    :param dataset_pk_and_json: tuple of two (Dataset PK, JSON (Python's list of dicts))
+    :param dataset_pk_and_json: tuple of two (Dataset PK,
+                                JSON (Python's list of dicts) or payload reference)
     :return: boolean: True if data saved to the data base, False otherwise
     """
     # unpack tuple; needed for Celery chain compatibility
-    dataset_pk, json_data = dataset_pk_and_json
+    dataset_pk, payload = dataset_pk_and_json
+    json_data = load_payload(payload)
 
-    # re-fetch Dataset and Processing
-    dataset = Dataset.objects.get(pk=dataset_pk)
+    # save results to the DB, leaving the dataset's data alone
+    updated = Dataset.objects.filter(pk=dataset_pk).\
+        update(processed=timezone.now(), **result_fields(json_data))
+    bump_generation()
+
+    if updated and settings.DATASETS_RESULT_CACHE:
+        data_hash, exception_message = Dataset.objects.filter(pk=dataset_pk).\
+            values_list('data_hash', 'exception').get()
+        store_result(data_hash, json_data, exception_message)
+    delete_payload(payload)
+
+    return bool(updated)
+
+
+@shared_task
+def second_test_function_batch(dataset_pks_and_processing_pk):
+    """
+    Run all three stages of the chain for a batch of small datasets.
+
+    Datasets are fetched with one query and written back with bulk updates.
+    Each dataset ends up in the same state as if it went through the chain.
+
+    :param dataset_pks_and_processing_pk: tuple of two (list of Dataset PKs, Processing PK)
+    :return: list of processed Dataset PKs
+    """
+    # unpack tuple; needed for Celery chain compatibility
+    dataset_pks, processing_pk = dataset_pks_and_processing_pk
+
+    datasets = list(Dataset.objects.filter(pk__in=dataset_pks))
+    results = {}
+
+    for dataset in datasets:
+        # mark dataset belonging to the given Processing item
+        dataset.processing_id = processing_pk
+
+        # dataset got an exception on submission: the chain would stop at the first task
+        if not dataset.exception:
+            result, dataset.exception = compute_result(load_data(dataset.data, dataset.columns.name))
+            set_result(dataset, result)
+            results[dataset.pk] = result
+        dataset.processed = timezone.now()
+
+    bulk_update(Dataset, datasets,
+                ['processing', 'result', 'result_packed', 'exception', 'processed'])
+    bump_generation()
+
+    for dataset in datasets:
+        if dataset.pk in results:
+            store_result(dataset.data_hash, results[dataset.pk], dataset.exception)
+
+    return [dataset.pk for dataset in datasets]
+
+
+@shared_task
+def second_test_function_shard(dataset_and_processing_pks, start, stop):
+    """
+    Run the test function on items [start:stop] of a dataset.
+
+    Only the given slice of the dataset's JSON is fetched from the DB.
+
+    :param dataset_and_processing_pks: tuple of two (Dataset PK, Processing PK)
+    :param start: int: index of the shard's first item
+    :param stop: int: index past the shard's last item
+    :return: tuple of four (Dataset PK; Processing PK; JSON (Python's list of dicts) or payload reference;
+             exception message, empty if none)
+    """
+    # unpack tuple; needed for Celery chain compatibility
+    dataset_pk, processing_pk = dataset_and_processing_pks
+
+    columns_name = Dataset.objects.filter(pk=dataset_pk).values_list('columns', flat=True).get()
+    if columns_name:
+        data = ColumnarData.open(columns_name)[start:stop]
+    else:
+        data, _ = json_array_slice(Dataset, dataset_pk, 'data', start, stop)
+    result, exception_message = compute_result(data)
+
+    return dataset_pk, processing_pk, put_payload(result), exception_message
+
+
+@shared_task
+def third_merge_shards(shard_results):
+    """
+    Save results of all shards of a dataset on a model, in the original order.
+
+    If any shard has failed, the dataset gets the exception of the first failed shard
+    and an empty result, just like it would without sharding.
+
+    :param shard_results: list of return values of second_test_function_shard, in shard order
+    :return: boolean: True if data saved to the data base, False otherwise
+    """
+    dataset_pk = shard_results[0][0]
+
+    result = []
+    exception_message = ''
+    for _, _, shard_result, shard_exception in shard_results:
+        if shard_exception:
+            exception_message = shard_exception
+            result = []
+            break
+        result.extend(load_payload(shard_result))
+
+    updated = Dataset.objects.filter(pk=dataset_pk).\
+        update(exception=exception_message, processed=timezone.now(), **result_fields(result))
+    bump_generation()
+
+    if settings.DATASETS_RESULT_CACHE:
+        data_hash = Dataset.objects.filter(pk=dataset_pk).values_list('data_hash', flat=True).get()
+        store_result(data_hash, result, exception_message)
+
+    for _, _, shard_result, _ in shard_results:
+        delete_payload(shard_result)
+
+    return bool(updated)
+
+
+@shared_task
+def second_test_function_fused(dataset_and_processing_pks):
+    """
+    Run all three stages of the chain for a dataset in a single task.
+
+    The dataset is read with one query of the needed columns only, and written with one UPDATE
+    of the changed columns; nothing is passed through the broker between the stages.
+
+    :param dataset_and_processing_pks: tuple of two (Dataset PK, Processing PK)
+    :return: boolean: True if data saved to the data base, False otherwise
+    """
+    # unpack tuple; needed for Celery chain compatibility
+    dataset_pk, processing_pk = dataset_and_processing_pks
+
+    update_status(dataset_pk, started=timezone.now())
+
+    # first stage: select JSON from the dataset
+    with log_duration('select', dataset_pk):
+        data, columns_name, exception_message, data_hash = Dataset.objects.filter(pk=dataset_pk).\
+            values_list('data', 'columns', 'exception', 'data_hash').get()
+        data = load_data(data, columns_name)
+
+    # second stage: test function
+    result = None
+    if not exception_message:
+        with log_duration('test function', dataset_pk):
+            result, exception_message = compute_result(data)
+
+    # third stage: save results
+    with log_duration('save', dataset_pk):
+        dataset_fields = {'processing_id': processing_pk, 'processed': timezone.now()}
+        if result is not None:
+            dataset_fields.update(exception=exception_message, **result_fields(result))
+        updated = Dataset.objects.filter(pk=dataset_pk).update(**dataset_fields)
+        bump_generation()
+
+        if result is not None:
+            store_result(data_hash, result, exception_message)
+
+    # dataset got an exception on submission: fail the task, as the chain does
+    if result is None:
+        raise DatasetInputError('Submitted dataset has got an exception')
+
+    return bool(updated)
+
+
+@shared_task
+def second_test_function_stream(dataset_and_processing_pks):
+    """
+    Run all three stages of the chain for a huge dataset in a single task, chunk by chunk.
+
+    No more than DATASETS_STREAM_ROWS items of the dataset's data and result are held in memory
+    at a time, see streaming.stream_result. Results of streamed datasets are not cached,
+    exceptions are.
+
+    :param dataset_and_processing_pks: tuple of two (Dataset PK, Processing PK)
+    :return: boolean: True if data saved to the data base, False otherwise
+    """
+    # unpack tuple; needed for Celery chain compatibility
+    dataset_pk, processing_pk = dataset_and_processing_pks
+    chunk_size = settings.DATASETS_STREAM_ROWS
+
+    columns_name, exception_message, data_hash = Dataset.objects.filter(pk=dataset_pk).\
+        values_list('columns', 'exception', 'data_hash').get()
+    updated = Dataset.objects.filter(pk=dataset_pk).\
+        update(processing_id=processing_pk, started=timezone.now())
+
+    # dataset got an exception on submission: fail the task, as the chain does
+    if exception_message:
+        Dataset.objects.filter(pk=dataset_pk).update(processed=timezone.now())
+        bump_generation()
+        raise DatasetInputError('Submitted dataset has got an exception')
+
+    with log_duration('stream', dataset_pk), transaction.atomic():
+        if columns_name:
+            data = ColumnarData.open(columns_name)
+            chunks = (data[start:start + chunk_size] for start in range(0, len(data), chunk_size))
+        else:
+            chunks = iter_json_array(Dataset, dataset_pk, 'data', chunk_size)
+        _, exception_message = stream_result(dataset_pk, chunks, compute_result)
+        Dataset.objects.filter(pk=dataset_pk).update(processed=timezone.now())
+        bump_generation()
 
-    # save results to the DB
-    dataset.result = json_data
-    dataset.save()
+    if exception_message:
+        store_result(data_hash, [], exception_message)
 
-    return not dataset._state.adding
+    return bool(updated)
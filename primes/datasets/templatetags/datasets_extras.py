@@ -2,6 +2,8 @@ import re
 from django import template
 from django.conf import settings
 
+from ..pagination import CursorPage
+
 # see more: https://docs.djangoproject.com/en/1.10/howto/custom-template-tags/#inclusion-tags
 register = template.Library()
 
@@ -36,7 +38,7 @@ def replace_flower_port(value):
 def show_pagination(items):
     """
     {% show_pagination items %}
-    :param items: QuerySet object
+    :param items: Page or CursorPage object
     :return:
     """
-    return {'items': items}
+    return {'items': items, 'cursor': isinstance(items, CursorPage)}
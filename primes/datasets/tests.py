@@ -1,17 +1,68 @@
 import os
 import json
+import time
+import select
+import asyncio
 import datetime
-
-
-from django.test import TestCase
+import threading
+import importlib
+import tempfile
+from io import StringIO
+
+
+from kombu.utils import json as kombu_json
+from django.apps import apps
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache, caches
 from django.utils import timezone
 from django.urls import reverse
-from .models import Processing, Dataset
+from .models import Processing, Dataset, CachedResult, Payload
 from .handlers import handle_uploaded_file
+from .parsers import load_json_chunks, json_hash
+from .kernels import add_pairs_python, add_pairs_columnar, get_kernel, KERNEL_VERSION
+from .cache import use_cached_results, store_result, evict_cached_results
+from .db import claim_rows, iter_json_array
+from .pagination import CursorPaginator
 from .templatetags.datasets_extras import settings_value, replace_flower_port
 from .tasks import first_select_json_from_dataset, second_test_function, third_save_json_to_db
+from .tasks import make_batches, second_test_function_batch
+from .tasks import second_test_function_shard, third_merge_shards, second_test_function_fused
+from .tasks import process_datasets, dataset_sizes, route, first_dispatch_window, run_chain
+from .tasks import first_prepare_processing
+from .tasks import first_parse_upload, parse_dataset, compute_result, second_test_function_stream
+from .sql_engine import compute_in_database
+from .status import merge_status, merge_unfinished, unfinished_processings, processing_status
+from .writes import update_status, status_buffer
+from .events import EventServer, CHANNEL
+from .report_cache import current_generation
+from .queue import pending_datasets, process_pending
+from .executors import LocalExecutor
+from .payloads import PayloadRef, put_payload, payload_ref, load_payload, delete_payload, purge_payloads
+from .storage import ColumnarData, to_columns, write_columns
+from .kernels import add_column_pairs
 from .exceptions import DatasetInputError
+from .results import load_result, pack_result, PackedResult, result_fields
+
+
+def get_result(dataset):
+    """
+    A non-testing helper function that returns a dataset's result in the JSON shape, however stored.
+    """
+    packed = dataset.result_packed
+    return load_result(dataset.result, None if packed is None else bytes(packed))
+
+
+def refresh_processing(processing):
+    """
+    A non-testing helper function that merges a processing's status from its datasets and reloads it.
+    """
+    merge_status(Processing.objects.filter(pk=processing.pk))
+    processing.refresh_from_db()
 
 
 class ProcessingAndDatasetModelsTest(TestCase):
@@ -117,6 +168,7 @@ class SubmitPageTest(TestCase):
 
         new_dataset = Dataset.objects.first()
         self.assertEqual(new_dataset.name, 'dataset1.json')
+        self.assertEqual(new_dataset.size, len(new_dataset.data))
 
     def test_submit_page_redirects_to_process_page_after_POST_request(self):
         test_files_dir = os.path.join(settings.MEDIA_ROOT, 'tests')
@@ -143,6 +195,45 @@ class SubmitPageTest(TestCase):
         dataset = Dataset.objects.first()
         self.assertIn('JSONDecodeError', dataset.exception)
 
+    def test_submit_page_stores_upload_for_async_parsing(self):
+        test_files_dir = os.path.join(settings.MEDIA_ROOT, 'tests')
+        first_legal_file = os.path.join(test_files_dir, 'dataset1.json')
+        second_illegal_file = os.path.join(test_files_dir, 'dataset2falsy.json')
+
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(DATASETS_INGESTION='async', MEDIA_ROOT=media_root):
+                for test_file in (first_legal_file, second_illegal_file):
+                    with open(test_file) as fp:
+                        self.client.post(reverse('datasets:submit'), {'upload': fp})
+
+                legal, illegal = Dataset.objects.order_by('pk')
+                for dataset in (legal, illegal):
+                    self.assertTrue(dataset.parse_pending)
+                    self.assertIsNone(dataset.data)
+                    self.assertTrue(dataset.upload.name.startswith('uploads/'))
+
+                # datasets pending parse can't be processed yet
+                response = self.client.get(reverse('datasets:process'))
+                self.assertEqual(len(response.context['datasets']), 0)
+
+                uploads = [os.path.join(media_root, dataset.upload.name) for dataset in (legal, illegal)]
+                self.assertTrue(first_parse_upload(legal.pk))
+                self.assertFalse(first_parse_upload(illegal.pk))
+
+                # parsed uploads are gone
+                for upload in uploads:
+                    self.assertFalse(os.path.exists(upload))
+
+        legal.refresh_from_db()
+        illegal.refresh_from_db()
+        with open(first_legal_file) as data_file:
+            self.assertEqual(legal.data, json.load(data_file))
+        self.assertEqual(legal.size, len(legal.data))
+        self.assertFalse(legal.parse_pending)
+        self.assertIn('JSONDecodeError', illegal.exception)
+        self.assertFalse(illegal.parse_pending)
+        self.assertEqual(legal.upload.name, '')
+
 
 class ProcessPageTest(TestCase):
     """
@@ -266,6 +357,159 @@ class ReportPageTest(TestCase):
         self.assertEqual(len(response.context['datasets']), 5)
 
 
+class CursorPaginationTest(TestCase):
+    """
+    Tests for keyset pagination.
+    """
+    def test_cursor_paginator_pages_forward_and_backward(self):
+        first_processing = Processing.objects.create()
+        second_processing = Processing.objects.create()
+        for i in range(30):
+            Dataset.objects.create(processing=first_processing if i % 2 else second_processing)
+
+        expected = list(Dataset.objects.order_by('-processing_id', '-id'))
+        paginator = CursorPaginator(Dataset.objects.all(), ('-processing_id', '-id'), 25)
+
+        first_page = paginator.page()
+        self.assertEqual(list(first_page), expected[:25])
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+
+        second_page = paginator.page(after=first_page.next_cursor)
+        self.assertEqual(list(second_page), expected[25:])
+        self.assertTrue(second_page.has_previous())
+        self.assertFalse(second_page.has_next())
+
+        previous_page = paginator.page(before=second_page.previous_cursor)
+        self.assertEqual(list(previous_page), expected[:25])
+        self.assertFalse(previous_page.has_previous())
+
+    def test_cursor_paginator_with_invalid_cursor(self):
+        Dataset.objects.create()
+        paginator = CursorPaginator(Dataset.objects.all(), ('id',), 25)
+
+        for cursor in ('foo', '1.2', None):
+            self.assertEqual(len(paginator.page(after=cursor)), 1)
+
+    def test_cursor_paginator_estimated_count(self):
+        paginator = CursorPaginator(Dataset.objects.all(), ('id',), 25)
+        self.assertIsNone(paginator.count)
+
+        paginator = CursorPaginator(Dataset.objects.all(), ('id',), 25, estimate=True)
+        self.assertIsInstance(paginator.count, int)
+
+    @override_settings(DATASETS_PAGINATION='cursor')
+    def test_report_page_with_cursor_pagination(self):
+        processing = Processing.objects.create()
+        for i in range(30):
+            Dataset.objects.create(processing=processing, name="{0}.json".format(i))
+
+        response = self.client.get(reverse("datasets:report"))
+        self.assertEqual(len(response.context['datasets']), 25)
+
+        next_cursor = response.context['datasets'].next_cursor
+        self.assertContains(response, '?after={0}'.format(next_cursor))
+
+        response = self.client.get(reverse("datasets:report"), data={'after': next_cursor})
+        self.assertEqual(len(response.context['datasets']), 5)
+
+
+class ReportQueriesTest(TestCase):
+    """
+    Tests for report page's queries and result endpoint.
+    """
+    def test_report_page_query_count_does_not_depend_on_rows(self):
+        processing = Processing.objects.create()
+        for i in range(3):
+            Dataset.objects.create(processing=processing, result=[{'result': 3}])
+
+        # status merge, count, page, last check
+        with self.assertNumQueries(4):
+            self.client.get(reverse('datasets:report'))
+
+        for i in range(20):
+            Dataset.objects.create(processing=processing, result=[{'result': 3}])
+
+        with self.assertNumQueries(4):
+            self.client.get(reverse('datasets:report'))
+
+    @override_settings(DATASETS_RESULT_PREVIEW_ITEMS=2)
+    def test_report_page_shows_result_preview(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(processing=processing,
+                                         result=[{'result': i} for i in range(5)])
+
+        response = self.client.get(reverse('datasets:report'))
+
+        self.assertEqual(response.context['datasets'][0].result_preview,
+                         [{'result': 0}, {'result': 1}])
+        self.assertEqual(response.context['datasets'][0].result_length, 5)
+        self.assertContains(response, reverse('datasets:result', args=[dataset.pk]))
+
+    def test_result_returns_full_result(self):
+        result = [{'result': i} for i in range(50)]
+        dataset = Dataset.objects.create(result=result)
+
+        response = self.client.get(reverse('datasets:result', args=[dataset.pk]))
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {'id': dataset.pk, 'result': result})
+
+    def test_result_of_missing_dataset(self):
+        response = self.client.get(reverse('datasets:result', args=[1000]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ItemsEndpointTest(TestCase):
+    """
+    Tests for the endpoint for slices of dataset's items.
+    """
+    def setUp(self):
+        self.result = [{'result': i} for i in range(50)]
+        self.dataset = Dataset.objects.create(data=[{'a': i, 'b': 0} for i in range(50)],
+                                              result=self.result)
+
+    def get_items(self, field='result', **kwargs):
+        """
+        A non-testing helper function that requests dataset's items.
+        """
+        return self.client.get(reverse('datasets:items', args=[self.dataset.pk, field]), **kwargs)
+
+    def test_items_with_offset_and_limit(self):
+        response = self.get_items(data={'offset': 10, 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content['items'], self.result[10:15])
+        self.assertEqual(content['total'], 50)
+
+    def test_items_of_data(self):
+        response = self.get_items(field='data', data={'offset': 48})
+
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content['items'], [{'a': 48, 'b': 0}, {'a': 49, 'b': 0}])
+
+    @override_settings(DATASETS_ITEMS_MAX_LIMIT=20)
+    def test_items_with_range_header(self):
+        response = self.get_items(HTTP_RANGE='items=45-60')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'items 45-49/50')
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content['items'], self.result[45:])
+
+        # limited with DATASETS_ITEMS_MAX_LIMIT
+        response = self.get_items(HTTP_RANGE='items=0-')
+        self.assertEqual(response['Content-Range'], 'items 0-19/50')
+
+    def test_items_with_unsatisfiable_range(self):
+        response = self.get_items(HTTP_RANGE='items=50-60')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'items */50')
+
+    def test_items_of_missing_dataset(self):
+        response = self.client.get(reverse('datasets:items', args=[1000, 'result']))
+        self.assertEqual(response.status_code, 404)
+
+
 class HandlersTest(TestCase):
     """
     Tests for handlers.
@@ -279,6 +523,114 @@ class HandlersTest(TestCase):
         self.assertIn(str(timezone.now().day), result)
 
 
+class ParsersTest(TestCase):
+    """
+    Tests for incremental JSON parsing.
+    """
+    def split_into_chunks(self, raw, size):
+        """
+        A non-testing helper function that splits bytes into chunks of a given size.
+        """
+        return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+    def test_load_json_chunks_equals_json_loads(self):
+        test_files_dir = os.path.join(settings.MEDIA_ROOT, 'tests')
+        first_legal_file = os.path.join(test_files_dir, 'dataset1.json')
+
+        with open(first_legal_file, 'rb') as data_file:
+            raw = data_file.read()
+
+        # chunk boundaries fall on every possible position
+        for size in (1, 3, 7, len(raw)):
+            self.assertEqual(load_json_chunks(self.split_into_chunks(raw, size)),
+                             json.loads(raw.decode('utf-8')))
+
+    def test_load_json_chunks_with_non_array_document(self):
+        raw = b' {"a": 1, "b": [2, 3]} '
+        self.assertEqual(load_json_chunks(self.split_into_chunks(raw, 2)),
+                         {'a': 1, 'b': [2, 3]})
+
+    def test_load_json_chunks_errors_are_the_same_as_json_loads(self):
+        test_files_dir = os.path.join(settings.MEDIA_ROOT, 'tests')
+        second_illegal_file = os.path.join(test_files_dir, 'dataset2falsy.json')
+
+        with open(second_illegal_file, 'rb') as data_file:
+            raw = data_file.read()
+
+        for doc in (raw, b'', b'[', b'[1 2]', b'[1]\n x', b'[{"a": 1},\n{"b" 2}]'):
+            with self.assertRaises(json.JSONDecodeError) as expected:
+                json.loads(doc.decode('utf-8'))
+            with self.assertRaises(json.JSONDecodeError) as actual:
+                load_json_chunks(self.split_into_chunks(doc, 3))
+            self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_load_json_chunks_decoding_errors_are_the_same_as_bytes_decode(self):
+        # invalid bytes, a sequence cut short, and one cut short at the end of input
+        for doc in (b'[1, 2, \xff]', b'[{"a": "\xe2\x82\x28"}]', b'["abc", "\xe2\x82'):
+            with self.assertRaises(UnicodeDecodeError) as expected:
+                doc.decode('utf-8')
+            with self.assertRaises(UnicodeDecodeError) as actual:
+                load_json_chunks(self.split_into_chunks(doc, 3))
+            self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_json_hash_ignores_key_order_and_whitespace(self):
+        first = load_json_chunks([b'[{"a": 1, "b": 2}]'])
+        second = load_json_chunks([b'[ {"b":2,\n "a":1} ]'])
+        self.assertEqual(json_hash(first), json_hash(second))
+        self.assertEqual(len(json_hash(first)), 64)
+        self.assertNotEqual(json_hash(first), json_hash([{'a': 2, 'b': 1}]))
+
+
+class KernelsTest(TestCase):
+    """
+    Tests for test function's compute kernels.
+    """
+    def run_kernel(self, kernel, data):
+        """
+        A non-testing helper function that returns either a result or an exception message.
+        """
+        try:
+            return kernel(data)
+        except Exception as err:
+            return "{type}: {message}".format(type=type(err).__name__, message=err)
+
+    def test_columnar_kernel_equals_python_kernel(self):
+        test_files_dir = os.path.join(settings.MEDIA_ROOT, 'tests')
+
+        for filename in ('dataset1.json', 'dataset3.json', 'dataset4falsy.json'):
+            with open(os.path.join(test_files_dir, filename)) as data_file:
+                data = json.load(data_file)
+
+            self.assertEqual(self.run_kernel(add_pairs_python, data),
+                             self.run_kernel(add_pairs_columnar, data))
+
+    def test_columnar_kernel_edge_cases(self):
+        for data in ([],
+                     [{'a': 2 ** 62, 'b': 2 ** 62}],
+                     [{'a': 1, 'b': 2.5}, {'a': 3, 'b': 4}],
+                     [{'a': [1], 'b': [2]}],
+                     [{'a': 1}],
+                     None):
+            expected = self.run_kernel(add_pairs_python, data)
+            actual = self.run_kernel(add_pairs_columnar, data)
+            # compare int and float results too
+            self.assertEqual(json.dumps(expected), json.dumps(actual))
+
+    @override_settings(DATASETS_KERNEL='columnar')
+    def test_get_kernel(self):
+        self.assertIs(get_kernel(), add_pairs_columnar)
+
+    @override_settings(DATASETS_KERNEL='columnar')
+    def test_columnar_kernel_requires_numpy(self):
+        kernels_module = importlib.import_module('datasets.kernels')
+        np, kernels_module.np = kernels_module.np, None
+        try:
+            with self.assertRaises(ImproperlyConfigured):
+                get_kernel()
+        finally:
+            kernels_module.np = np
+
+
 class TemplateTagsTest(TestCase):
     """
     Tests for custom template filters, tags, etc.
@@ -431,4 +783,1167 @@ class TasksTest(TestCase):
         status = third_save_json_to_db((dataset.pk, expected_result))
 
         fetched_dataset = Dataset.objects.get(pk=dataset.pk)
-        self.assertEqual(expected_result, fetched_dataset.result)
+        self.assertEqual(expected_result, get_result(fetched_dataset))
+
+    @override_settings(DATASETS_BATCH_ROWS=3, DATASETS_BATCH_SIZE=2)
+    def test_make_batches(self):
+        sizes = [1, 1, 1, 2, 5, 0]
+        datasets = [Dataset.objects.create(data=[{'a': 1, 'b': 2}] * size) for size in sizes]
+        # not an array
+        datasets.append(Dataset.objects.create(data={'a': 1, 'b': 2}))
+
+        batches, large_datasets = make_batches(Dataset.objects.all())
+
+        pks = [dataset.pk for dataset in datasets]
+        self.assertEqual(batches, [pks[0:2], pks[2:4], pks[5:7]])
+        self.assertEqual(large_datasets, [(pks[4], 5)])
+
+    def test_dataset_sizes_recorded_on_submission(self):
+        recorded = Dataset.objects.create(data=[{'a': 1, 'b': 2}], size=1000)
+        not_recorded = Dataset.objects.create(data=[{'a': 1, 'b': 2}] * 3)
+
+        self.assertEqual(list(dataset_sizes(Dataset.objects.all())),
+                         [(recorded.pk, 1000), (not_recorded.pk, 3)])
+
+    @override_settings(DATASETS_DISPATCH_WINDOW=2)
+    def test_dispatch_window(self):
+        datasets = [Dataset.objects.create(data=[{'a': 1, 'b': 2}]) for _ in range(5)]
+        cached = Dataset.objects.create(data=[{'a': 1, 'b': 2}])
+        processing_pk = process_datasets(Dataset.objects.all())
+        Dataset.objects.filter(pk=cached.pk).update(result=[{'result': 3}])
+
+        def dispatch_cursor():
+            return Processing.objects.get(pk=processing_pk).dispatch_cursor
+
+        # no datasets dispatched on the request
+        self.assertEqual(dispatch_cursor(), 0)
+
+        self.assertEqual(first_dispatch_window(processing_pk), 2)
+        self.assertEqual(dispatch_cursor(), datasets[1].pk)
+        # the window is full
+        self.assertEqual(first_dispatch_window(processing_pk), 0)
+
+        Dataset.objects.filter(pk=datasets[0].pk).update(result=[])
+        self.assertEqual(first_dispatch_window(processing_pk), 1)
+        self.assertEqual(dispatch_cursor(), datasets[2].pk)
+
+        Dataset.objects.filter(pk__in=[datasets[1].pk, datasets[2].pk]).update(result=[])
+        self.assertEqual(first_dispatch_window(processing_pk), 2)
+        self.assertEqual(dispatch_cursor(), datasets[4].pk)
+
+    @override_settings(DATASETS_PIPELINE='sql')
+    def test_datasets_prepared_off_the_request(self):
+        dataset = Dataset.objects.create(data=[{'a': 1, 'b': 2}])
+        processing_pk = process_datasets(Dataset.objects.all())
+
+        # only claimed on the request
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.processing_id, processing_pk)
+        self.assertIsNone(dataset.processed)
+
+        first_prepare_processing(processing_pk)
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), [{'result': 3}])
+
+    @override_settings(DATASETS_DISPATCH_WINDOW=1)
+    def test_dispatch_window_skips_lost_datasets(self):
+        datasets = [Dataset.objects.create(data=[{'a': 1, 'b': 2}]) for _ in range(2)]
+        processing_pk = process_datasets(Dataset.objects.all())
+
+        self.assertEqual(first_dispatch_window(processing_pk), 1)
+        self.assertEqual(first_dispatch_window(processing_pk), 0)
+
+        # tasks of the first dataset are lost: it never gets a result
+        with self.settings(DATASETS_DISPATCH_TIMEOUT=0):
+            self.assertEqual(first_dispatch_window(processing_pk), 1)
+        self.assertEqual(Processing.objects.get(pk=processing_pk).dispatch_cursor, datasets[1].pk)
+        self.assertIsNotNone(Dataset.objects.get(pk=datasets[1].pk).dispatched)
+
+    @override_settings(DATASETS_LARGE_ROWS=10,
+                       DATASETS_LARGE_QUEUES={'first': '', 'second': 'second_large', 'third': ''})
+    def test_route_by_size(self):
+        self.assertNotIn('queue', route(second_test_function.s(), 10).options)
+        self.assertEqual(route(second_test_function.s(), 11).options['queue'], 'second_large')
+        self.assertEqual(route(second_test_function_fused.s(), 11).options['queue'], 'second_large')
+        # no large lane for the stage
+        self.assertNotIn('queue', route(third_save_json_to_db.s(), 11).options)
+
+    def test_second_function_batch(self):
+        processing = Processing.objects.create()
+
+        legal = Dataset.objects.create(data=[{'a': 1, 'b': 2}])
+        illegal = Dataset.objects.create(data=[{'a': 1, 'b': 'Hello'}])
+        submitted_with_exception = Dataset.objects.create(exception='Unknown Exception')
+
+        processed_pks = second_test_function_batch(
+            ([legal.pk, illegal.pk, submitted_with_exception.pk], processing.pk))
+
+        self.assertEqual(sorted(processed_pks),
+                         [legal.pk, illegal.pk, submitted_with_exception.pk])
+
+        legal.refresh_from_db()
+        self.assertEqual(legal.processing, processing)
+        self.assertEqual(get_result(legal), [{'result': 3}])
+        self.assertEqual(legal.exception, '')
+
+        illegal.refresh_from_db()
+        self.assertEqual(illegal.processing, processing)
+        self.assertEqual(get_result(illegal), [])
+        self.assertIn('TypeError', illegal.exception)
+
+        submitted_with_exception.refresh_from_db()
+        self.assertEqual(submitted_with_exception.processing, processing)
+        self.assertIsNone(get_result(submitted_with_exception))
+        self.assertEqual(submitted_with_exception.exception, 'Unknown Exception')
+
+        refresh_processing(processing)
+        self.assertIs(processing.exceptions, True)
+
+    def test_shards_merge_in_original_order(self):
+        processing = Processing.objects.create()
+        data = [{'a': i, 'b': i} for i in range(10)]
+        dataset = Dataset.objects.create(processing=processing, data=data)
+
+        shard_results = [second_test_function_shard((dataset.pk, processing.pk), start, start + 4)
+                         for start in (0, 4, 8)]
+        self.assertEqual(len(shard_results[2][2]), 2)
+
+        self.assertTrue(third_merge_shards(shard_results))
+
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), add_pairs_python(data))
+        self.assertEqual(dataset.exception, '')
+
+    def test_shards_merge_with_exception(self):
+        processing = Processing.objects.create(exceptions=False)
+        data = [{'a': 1, 'b': 2}, {'a': 1, 'b': 2}, {'b': "Hello", 'a': 17}, {'a': 1}]
+        dataset = Dataset.objects.create(processing=processing, data=data)
+
+        shard_results = [second_test_function_shard((dataset.pk, processing.pk), start, start + 2)
+                         for start in (0, 2)]
+        third_merge_shards(shard_results)
+
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), [])
+        self.assertEqual(dataset.exception, self.get_exception_message(add_pairs_python, data))
+
+        refresh_processing(processing)
+        self.assertIs(processing.exceptions, True)
+
+    def get_exception_message(self, kernel, data):
+        """
+        A non-testing helper function that returns an exception message of a kernel.
+        """
+        try:
+            kernel(data)
+        except Exception as err:
+            return "{type}: {message}".format(type=type(err).__name__, message=err)
+
+    def test_fused_function(self):
+        processing = Processing.objects.create(exceptions=False)
+        legal = Dataset.objects.create(data=[{'a': 1, 'b': 2}])
+        illegal = Dataset.objects.create(data=[{'a': 1, 'b': 'Hello'}])
+
+        self.assertTrue(second_test_function_fused((legal.pk, processing.pk)))
+        legal.refresh_from_db()
+        self.assertEqual(legal.processing, processing)
+        self.assertEqual(get_result(legal), [{'result': 3}])
+        refresh_processing(processing)
+        self.assertIs(processing.exceptions, False)
+
+        second_test_function_fused((illegal.pk, processing.pk))
+        illegal.refresh_from_db()
+        self.assertEqual(get_result(illegal), [])
+        self.assertIn('TypeError', illegal.exception)
+        refresh_processing(processing)
+        self.assertIs(processing.exceptions, True)
+
+    def test_fused_function_with_exception(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(exception='Unknown Exception')
+
+        with self.assertRaises(DatasetInputError):
+            second_test_function_fused((dataset.pk, processing.pk))
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.processing, processing)
+        self.assertIsNone(get_result(dataset))
+        refresh_processing(processing)
+        self.assertIs(processing.exceptions, True)
+
+    @override_settings(DATASETS_STREAM_ROWS=2)
+    def test_stream_function_gives_the_same_results(self):
+        inputs = [[{'a': i, 'b': i} for i in range(5)],
+                  [{'a': 0.5, 'b': i} for i in range(5)],
+                  [{'a': 1, 'b': 2}, {'a': 1, 'b': 2}, {'a': 0.5, 'b': 2}],
+                  [{'a': 2 ** 63, 'b': 1}, {'a': 1, 'b': 2}, {'a': 3, 'b': 4}],
+                  [{'a': 1, 'b': 2}, {'a': 1, 'b': 2}, {'a': 1, 'b': 'Hello'}],
+                  []]
+        for encoding in ('packed', 'json'):
+            with self.settings(DATASETS_RESULT_ENCODING=encoding):
+                processing = Processing.objects.create(exceptions=False)
+                for data in inputs:
+                    dataset = Dataset.objects.create(data=data)
+                    self.assertTrue(second_test_function_stream((dataset.pk, processing.pk)))
+
+                    dataset.refresh_from_db()
+                    result, exception = compute_result(data)
+                    self.assertEqual(dataset.processing, processing)
+                    self.assertEqual(get_result(dataset), result)
+                    self.assertEqual(dataset.result_packed is not None,
+                                     result_fields(result)['result_packed'] is not None)
+                    self.assertEqual(dataset.exception, exception)
+
+                refresh_processing(processing)
+                self.assertIs(processing.exceptions, True)
+        self.assertFalse(Payload.objects.exists())
+
+    def test_iter_json_array(self):
+        dataset = Dataset.objects.create(data=[{'a': i, 'b': i} for i in range(5)])
+        with transaction.atomic():
+            chunks = list(iter_json_array(Dataset, dataset.pk, 'data', 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sum(chunks, []), dataset.data)
+
+        dataset = Dataset.objects.create(data={'a': 1, 'b': 2})
+        with transaction.atomic():
+            self.assertEqual(list(iter_json_array(Dataset, dataset.pk, 'data', 2)), [])
+
+    @override_settings(DATASETS_STREAM_ROWS=2)
+    def test_large_datasets_are_streamed(self):
+        large = Dataset.objects.create(data=[{'a': i, 'b': i} for i in range(3)])
+        small = Dataset.objects.create(data=[{'a': 1, 'b': 2}])
+        executor = LocalExecutor()
+        submitted = []
+        executor.submit = lambda task, arg: submitted.append((task, arg[0])) or task(arg)
+
+        process_datasets(Dataset.objects.all(), executor)
+        self.assertEqual(submitted, [(second_test_function_stream, large.pk), (run_chain, small.pk)])
+        for dataset in (large, small):
+            dataset.refresh_from_db()
+            self.assertEqual(get_result(dataset), compute_result(dataset.data)[0])
+
+
+@override_settings(DATASETS_RESULT_CACHE=True)
+class ResultCacheTest(TestCase):
+    """
+    Tests for the content-addressed cache of results.
+    """
+    def test_cached_results_are_reused(self):
+        legal = [{'a': 1, 'b': 2}]
+        illegal = [{'a': 1, 'b': 'Hello'}]
+        store_result(json_hash(legal), [{'result': 3}], '')
+        store_result(json_hash(illegal), [], 'TypeError: oops')
+
+        processing = Processing.objects.create(exceptions=False)
+        hit = Dataset.objects.create(data=legal, data_hash=json_hash(legal))
+        duplicate = Dataset.objects.create(data=legal, data_hash=json_hash(legal))
+        hit_with_exception = Dataset.objects.create(data=illegal, data_hash=json_hash(illegal))
+        miss = Dataset.objects.create(data=[{'a': 2, 'b': 2}], data_hash=json_hash([{'a': 2, 'b': 2}]))
+        unhashed = Dataset.objects.create(data=legal)
+
+        left = use_cached_results(Dataset.objects.filter(processing=None), processing.pk)
+        self.assertEqual(set(left.values_list('pk', flat=True)), {miss.pk, unhashed.pk})
+
+        for dataset in (hit, duplicate):
+            dataset.refresh_from_db()
+            self.assertEqual(dataset.processing, processing)
+            self.assertEqual(get_result(dataset), [{'result': 3}])
+        hit_with_exception.refresh_from_db()
+        self.assertEqual(get_result(hit_with_exception), [])
+        self.assertEqual(hit_with_exception.exception, 'TypeError: oops')
+
+        refresh_processing(processing)
+        self.assertEqual(processing.cache_hits, 3)
+        self.assertEqual(processing.cache_misses, 1)
+        self.assertIs(processing.exceptions, True)
+        self.assertEqual(CachedResult.objects.get(data_hash=json_hash(legal)).hits, 2)
+
+    def test_third_function_stores_result(self):
+        data = [{'a': 1, 'b': 2}]
+        dataset = Dataset.objects.create(data=data, data_hash=json_hash(data))
+
+        third_save_json_to_db((dataset.pk, [{'result': 3}]))
+        entry = CachedResult.objects.get(data_hash=json_hash(data), kernel_version=KERNEL_VERSION)
+        self.assertEqual(entry.result, [{'result': 3}])
+
+    def test_evict_cached_results(self):
+        store_result('stale', [], '')
+        CachedResult.objects.filter(data_hash='stale').update(kernel_version=KERNEL_VERSION - 1)
+        store_result('old', [], '')
+        CachedResult.objects.filter(data_hash='old').\
+            update(last_used=timezone.now() - datetime.timedelta(days=365))
+        store_result('fresh', [], '')
+
+        self.assertEqual(evict_cached_results(), 2)
+        self.assertEqual(list(CachedResult.objects.values_list('data_hash', flat=True)), ['fresh'])
+
+        with self.settings(DATASETS_RESULT_CACHE_MAX_ENTRIES=1):
+            store_result('fresher', [], '')
+            evict_cached_results()
+        self.assertEqual(list(CachedResult.objects.values_list('data_hash', flat=True)), ['fresher'])
+
+
+class ClaimRowsTest(TransactionTestCase):
+    """
+    Tests for claiming unprocessed datasets.
+    """
+    def claim_in_thread(self, processing):
+        """
+        A non-testing helper function that claims unprocessed datasets over another DB connection.
+        """
+        claimed = []
+
+        def claim():
+            try:
+                claimed.extend(claim_rows(Dataset.objects.filter(processing__isnull=True),
+                                          'processing', processing.pk))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=claim)
+        thread.start()
+        thread.join()
+        return claimed
+
+    def test_claim_rows_claims_unprocessed_datasets_once(self):
+        first, second = Processing.objects.create(), Processing.objects.create()
+        processed = Dataset.objects.create(processing=first)
+        unprocessed = Dataset.objects.create()
+
+        unprocessed_datasets = Dataset.objects.filter(processing__isnull=True)
+        self.assertEqual(claim_rows(unprocessed_datasets, 'processing', second.pk), [unprocessed.pk])
+        self.assertEqual(claim_rows(unprocessed_datasets, 'processing', first.pk), [])
+
+        processed.refresh_from_db()
+        unprocessed.refresh_from_db()
+        self.assertEqual(processed.processing, first)
+        self.assertEqual(unprocessed.processing, second)
+
+    def test_claim_rows_skips_locked_datasets(self):
+        processing = Processing.objects.create()
+        locked = Dataset.objects.create()
+        free = Dataset.objects.create()
+
+        with transaction.atomic():
+            list(Dataset.objects.select_for_update().filter(pk=locked.pk))
+            # doesn't wait for the lock to be released
+            self.assertEqual(self.claim_in_thread(processing), [free.pk])
+
+        self.assertEqual(self.claim_in_thread(processing), [locked.pk])
+
+
+@override_settings(DATASETS_PIPELINE='queue')
+class QueueTest(TestCase):
+    """
+    Tests for the broker-less database queue.
+    """
+    inputs = [[{'a': 1, 'b': 2}, {'a': 3, 'b': 4}], [{'a': 1, 'b': 'Hello'}], [], None]
+
+    def run_chain(self, data):
+        """
+        A non-testing helper function that runs the chain's tasks one by one on new datasets.
+        """
+        processing = Processing.objects.create()
+        datasets = [Dataset.objects.create(data=item) for item in data]
+        datasets.append(Dataset.objects.create(exception='Unknown Exception'))
+        for dataset in datasets:
+            try:
+                third_save_json_to_db(second_test_function(
+                    first_select_json_from_dataset((dataset.pk, processing.pk))))
+            except DatasetInputError:
+                pass
+        return processing, datasets
+
+    def test_queue_gives_the_same_state_as_chain(self):
+        chain_processing, chain_datasets = self.run_chain(self.inputs)
+
+        datasets = [Dataset.objects.create(data=item) for item in self.inputs]
+        datasets.append(Dataset.objects.create(exception='Unknown Exception'))
+        processing_pk = process_datasets(Dataset.objects.filter(pk__in=[d.pk for d in datasets]))
+        self.assertEqual(pending_datasets().count(), len(self.inputs))
+
+        for workers in (0, 2):
+            call_command('process_queue', once=True, workers=workers, batch_size=2,
+                         stdout=StringIO())
+        self.assertFalse(pending_datasets().exists())
+
+        processing = Processing.objects.get(pk=processing_pk)
+        refresh_processing(processing)
+        refresh_processing(chain_processing)
+        self.assertEqual(processing.exceptions, chain_processing.exceptions)
+        for dataset, chain_dataset in zip(datasets, chain_datasets):
+            dataset.refresh_from_db()
+            chain_dataset.refresh_from_db()
+            self.assertEqual(dataset.processing_id, processing_pk)
+            self.assertEqual(get_result(dataset), get_result(chain_dataset))
+            self.assertEqual(dataset.exception, chain_dataset.exception)
+        for dataset in datasets[:len(self.inputs)]:
+            self.assertIsNotNone(dataset.started)
+
+    def test_picked_batch_is_running(self):
+        datasets = [Dataset.objects.create(data=[{'a': i, 'b': i}]) for i in range(2)]
+        processing_pk = process_datasets(Dataset.objects.all())
+
+        def map_function(function, items):
+            # the batch is picked, but not processed yet
+            status = processing_status(processing_pk, fresh=True)
+            self.assertEqual((status['running'], status['done']), (2, 0))
+            # other workers don't pick it, unless it is lost
+            self.assertEqual(process_pending(2), 0)
+            with self.settings(DATASETS_DISPATCH_TIMEOUT=-1):
+                self.assertEqual(process_pending(1), 1)
+            return map(function, items)
+
+        self.assertEqual(process_pending(2, map_function), 2)
+        for dataset in datasets:
+            dataset.refresh_from_db()
+            self.assertIsNotNone(dataset.processed)
+
+    def test_queue_with_a_pool_of_workers(self):
+        datasets = [Dataset.objects.create(data=[{'a': i, 'b': i}]) for i in range(5)]
+        process_datasets(Dataset.objects.all())
+
+        out = StringIO()
+        call_command('process_queue', once=True, workers=2, batch_size=2, stdout=out)
+        self.assertIn('5 datasets processed', out.getvalue())
+        for i, dataset in enumerate(datasets):
+            dataset.refresh_from_db()
+            self.assertEqual(get_result(dataset), [{'result': 2 * i}])
+
+
+class ExecutorsTest(TransactionTestCase):
+    """
+    Tests for running tasks with no Celery workers.
+    """
+    def create_datasets(self):
+        """
+        A non-testing helper function that creates legal and illegal datasets.
+        """
+        return [Dataset.objects.create(data=[{'a': 1, 'b': 2}]),
+                Dataset.objects.create(data=[{'a': 1, 'b': 'Hello'}]),
+                Dataset.objects.create(exception='Unknown Exception')]
+
+    def assert_processed(self, datasets, processing_pk):
+        legal, illegal, submitted_with_exception = datasets
+        for dataset in datasets:
+            dataset.refresh_from_db()
+            self.assertEqual(dataset.processing_id, processing_pk)
+        self.assertEqual(get_result(legal), [{'result': 3}])
+        self.assertIn('TypeError', illegal.exception)
+        self.assertIsNone(get_result(submitted_with_exception))
+        self.assertIs(Processing.objects.get(pk=processing_pk).exceptions, True)
+
+    def test_local_executor_with_each_pipeline(self):
+        for pipeline in ('chain', 'fused', 'batch', 'sql'):
+            with self.settings(DATASETS_PIPELINE=pipeline):
+                datasets = self.create_datasets()
+                processing_pk = process_datasets(Dataset.objects.all(), LocalExecutor())
+                self.assert_processed(datasets, processing_pk)
+
+    def test_process_datasets_command_with_a_pool(self):
+        datasets = self.create_datasets()
+        out = StringIO()
+        call_command('process_datasets', workers=2, stdout=out)
+        self.assertIn('is done', out.getvalue())
+        self.assert_processed(datasets, Processing.objects.get().pk)
+
+
+def run_chain_and_close(dataset_and_processing_pks):
+    """
+    A non-testing helper function that runs a chain in a thread, not leaving its DB connection open.
+    """
+    try:
+        run_chain(dataset_and_processing_pks)
+    finally:
+        connection.close()
+
+
+def terminate_backend(backend_pid):
+    """
+    A non-testing helper function that drops a DB connection, as a server restart would.
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [backend_pid])
+    finally:
+        connection.close()
+
+
+@override_settings(DATASETS_EVENTS_TIMEOUT=10, DATASETS_EVENTS_KEEPALIVE=1)
+class EventsTest(TransactionTestCase):
+    """
+    Tests for completion notifications of processings.
+    """
+    def setUp(self):
+        cache.clear()
+        self.processing = Processing.objects.create(datasets_total=2)
+        self.datasets = [Dataset.objects.create(data=[{'a': 1, 'b': 2}], size=1, processing=self.processing)
+                         for _ in range(2)]
+
+    def serve(self, client):
+        """
+        A non-testing helper function that runs a client coroutine against an events server.
+        """
+        loop = asyncio.new_event_loop()
+        events = EventServer(loop)
+        events.listen()
+
+        async def run():
+            server = await asyncio.start_server(events.handle, '127.0.0.1', 0)
+            try:
+                return await asyncio.wait_for(client(loop, server.sockets[0].getsockname()[1]), 20)
+            finally:
+                server.close()
+                # let status reads in flight finish
+                while events.refreshing:
+                    await asyncio.sleep(0.05)
+
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            events.close()
+            loop.close()
+
+    async def request(self, port, target, method='GET'):
+        """
+        A non-testing helper function that sends a request and returns the response head and body.
+        """
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write('{0} {1} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(method, target).encode())
+        head = await reader.readuntil(b'\r\n\r\n')
+        body = await reader.read()
+        writer.close()
+        return head.decode(), body.decode()
+
+    def test_trigger_notifies_on_dataset_status(self):
+        listener = connection.get_new_connection(connection.get_connection_params())
+        listener.autocommit = True
+        try:
+            listener.cursor().execute('LISTEN {0}'.format(CHANNEL))
+
+            Dataset.objects.filter(pk=self.datasets[0].pk).update(data=[])
+            Dataset.objects.create(data=[], processed=timezone.now())
+            listener.poll()
+            self.assertEqual(listener.notifies, [])
+
+            Dataset.objects.update(started=timezone.now())
+            # delivered asynchronously once committed
+            select.select([listener], [], [], 5)
+            listener.poll()
+            # one per processing per transaction
+            self.assertEqual([notify.payload for notify in listener.notifies], [str(self.processing.pk)])
+        finally:
+            listener.close()
+
+    def test_stream(self):
+        dataset_pks = [dataset.pk for dataset in self.datasets]
+
+        async def client(loop, port):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('GET /events/{0} HTTP/1.1\r\n\r\n'.format(self.processing.pk).encode())
+            head = await reader.readuntil(b'\r\n\r\n')
+            first = await reader.readuntil(b'\n\n')
+            for dataset_pk in dataset_pks:
+                await loop.run_in_executor(None, run_chain_and_close, (dataset_pk, self.processing.pk))
+            rest = await reader.read()
+            writer.close()
+            return head.decode(), (first + rest).decode()
+
+        head, body = self.serve(client)
+        self.assertIn('200 OK', head)
+        self.assertIn('Content-Type: text/event-stream', head)
+
+        statuses = [json.loads(line[len('data: '):]) for line in body.splitlines() if line.startswith('data: ')]
+        self.assertEqual((statuses[0]['done'], statuses[0]['finished']), (0, False))
+        # the stream ends once the processing is finished
+        self.assertEqual((statuses[-1]['done'], statuses[-1]['rows_processed'], statuses[-1]['finished']),
+                         (2, 2, True))
+
+    def test_listener_reconnects(self):
+        async def client(loop, events):
+            queue = events.subscribe(self.processing.pk)
+            backend_pid = events.listener.get_backend_pid()
+            await loop.run_in_executor(None, terminate_backend, backend_pid)
+            while events.listener is None or events.listener.get_backend_pid() == backend_pid:
+                await asyncio.sleep(0.05)
+
+            await loop.run_in_executor(None, run_chain_and_close, (self.datasets[0].pk, self.processing.pk))
+            status = await queue.get()
+            while status['done'] < 1:
+                status = await queue.get()
+            return status
+
+        loop = asyncio.new_event_loop()
+        events = EventServer(loop)
+        events.listen()
+        try:
+            status = loop.run_until_complete(asyncio.wait_for(client(loop, events), 20))
+            loop.run_until_complete(asyncio.sleep(0.2))
+        finally:
+            events.close()
+            loop.close()
+        self.assertEqual(status['done'], 1)
+
+    def test_long_poll(self):
+        async def client(loop, port):
+            target = '/events/{0}?poll&done=0'.format(self.processing.pk)
+            response = asyncio.ensure_future(self.request(port, target))
+            await asyncio.sleep(0.2)
+            self.assertFalse(response.done())
+
+            await loop.run_in_executor(None, run_chain_and_close, (self.datasets[0].pk, self.processing.pk))
+            changed = await response
+
+            behind = await self.request(port, '/events/{0}?poll&done=5'.format(self.processing.pk))
+            missing = await self.request(port, '/events/0?poll')
+            not_allowed = await self.request(port, '/events/{0}'.format(self.processing.pk), 'POST')
+            not_found = await self.request(port, '/report')
+            return changed, behind, missing, not_allowed, not_found
+
+        changed, behind, missing, not_allowed, not_found = self.serve(client)
+        self.assertIn('200 OK', changed[0])
+        self.assertNotEqual(json.loads(changed[1])['running'] + json.loads(changed[1])['done'], 0)
+        # answered at once, as the client is behind
+        self.assertIn('200 OK', behind[0])
+        self.assertEqual(json.loads(behind[1])['id'], self.processing.pk)
+        self.assertIn('404 Not Found', missing[0])
+        self.assertIn('405 Method Not Allowed', not_allowed[0])
+        self.assertIn('404 Not Found', not_found[0])
+
+
+@override_settings(DATASETS_REPORT_CACHE_SECONDS=60)
+class ReportCacheTest(TransactionTestCase):
+    """
+    Tests for caching of the report page.
+    """
+    def setUp(self):
+        caches['report'].clear()
+
+    def process(self, name):
+        """
+        A non-testing helper function that submits a dataset and processes it right away.
+        """
+        Dataset.objects.create(name=name, data=[{'a': 1, 'b': 2}], size=1)
+        return process_datasets(Dataset.objects.all(), LocalExecutor())
+
+    def test_report_page_is_cached_till_results_change(self):
+        first_pk = self.process('first.json')
+
+        response = self.client.get(reverse('datasets:report'))
+        self.assertContains(response, 'first.json')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        etag = response['ETag']
+
+        # the generation is all that is read
+        with self.assertNumQueries(1):
+            cached = self.client.get(reverse('datasets:report'))
+        self.assertEqual(cached.content, response.content)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('datasets:report'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('datasets:report'),
+                                   HTTP_IF_MODIFIED_SINCE=cached['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        # another page is cached on its own
+        response = self.client.get(reverse('datasets:report'), data={'page': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        second_pk = self.process('second.json')
+        self.assertNotEqual(second_pk, first_pk)
+
+        response = self.client.get(reverse('datasets:report'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'second.json')
+        self.assertContains(response, '<strong id="id_last_check_num">{0}</strong>'.format(second_pk),
+                            html=True)
+
+    def test_tasks_bump_the_generation(self):
+        processing_pk = self.process('first.json')
+        generation = current_generation()
+
+        dataset = Dataset.objects.create(data=[{'a': 1, 'b': 2}], processing_id=processing_pk)
+        run_chain((dataset.pk, processing_pk))
+        self.assertGreater(current_generation(), generation)
+
+        with self.settings(DATASETS_REPORT_CACHE_SECONDS=0):
+            self.assertIsNone(current_generation())
+
+    def test_pages_with_messages_are_not_conditional(self):
+        self.process('first.json')
+        etag = self.client.get(reverse('datasets:report'))['ETag']
+
+        self.client.post(reverse('datasets:process'))
+        response = self.client.get(reverse('datasets:report'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'has started')
+        self.assertFalse(response.has_header('ETag'))
+
+
+class PayloadsTest(TestCase):
+    """
+    Tests for passing results between tasks by reference.
+    """
+    result = [{'result': i} for i in range(100)]
+
+    def test_small_payloads_stay_inline(self):
+        with self.settings(DATASETS_PAYLOAD_STORE=''):
+            self.assertIs(put_payload(self.result), self.result)
+        with self.settings(DATASETS_PAYLOAD_STORE='db', DATASETS_PAYLOAD_INLINE_BYTES=65536):
+            self.assertIs(put_payload(self.result), self.result)
+            self.assertIs(load_payload(self.result), self.result)
+
+    def test_payload_stores(self):
+        with tempfile.TemporaryDirectory() as payload_dir:
+            for store in ('db', 'file'):
+                with self.settings(DATASETS_PAYLOAD_STORE=store, DATASETS_PAYLOAD_INLINE_BYTES=0,
+                                   DATASETS_PAYLOAD_DIR=payload_dir):
+                    ref = put_payload(self.result)
+                    self.assertEqual(payload_ref(ref).store, store)
+                    self.assertEqual(load_payload(ref), self.result)
+                    self.assertEqual(load_payload(payload_ref(ref)), self.result)
+                    delete_payload(ref)
+                    with self.assertRaises((Payload.DoesNotExist, FileNotFoundError)):
+                        load_payload(ref)
+
+                    put_payload(self.result)
+                    self.assertEqual(purge_payloads(), 0)
+                    with self.settings(DATASETS_PAYLOAD_MAX_AGE=-1):
+                        self.assertEqual(purge_payloads(), 1)
+
+    @override_settings(DATASETS_PAYLOAD_STORE='db', DATASETS_PAYLOAD_INLINE_BYTES=0)
+    def test_chain_passes_result_by_reference(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(data=[{'a': 1, 'b': 2}], processing=processing)
+
+        dataset_pk, ref = second_test_function((dataset.pk, processing.pk))
+        self.assertIsInstance(payload_ref(ref), PayloadRef)
+        self.assertTrue(third_save_json_to_db((dataset_pk, ref)))
+
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), [{'result': 3}])
+        self.assertFalse(Payload.objects.exists())
+
+    @override_settings(DATASETS_PAYLOAD_STORE='db', DATASETS_PAYLOAD_INLINE_BYTES=0)
+    def test_shards_pass_results_by_reference(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(data=[{'a': i, 'b': i} for i in range(5)],
+                                         processing=processing)
+
+        shard_results = [second_test_function_shard((dataset.pk, processing.pk), start, start + 2)
+                         for start in range(0, 5, 2)]
+        self.assertTrue(third_merge_shards(shard_results))
+
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), [{'result': 2 * i} for i in range(5)])
+        self.assertFalse(Payload.objects.exists())
+
+    @override_settings(DATASETS_PAYLOAD_STORE='db', DATASETS_PAYLOAD_INLINE_BYTES=0)
+    def test_references_survive_json_serialization(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(data=[{'a': i, 'b': i} for i in range(5)],
+                                         processing=processing)
+
+        # shard results reach the merge through the result backend, serialized as JSON
+        shard_results = [second_test_function_shard((dataset.pk, processing.pk), start, start + 2)
+                         for start in range(0, 5, 2)]
+        self.assertTrue(third_merge_shards(kombu_json.loads(kombu_json.dumps(shard_results))))
+
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), [{'result': 2 * i} for i in range(5)])
+        self.assertFalse(Payload.objects.exists())
+
+
+class StorageTest(TestCase):
+    """
+    Tests for columnar file storage of datasets.
+    """
+    def setUp(self):
+        # directory where all dataset files for testing stored
+        self.test_files_dir = os.path.join(settings.MEDIA_ROOT, 'tests')
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media_root.name, DATASETS_STORAGE='file')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_to_columns(self):
+        a, b = to_columns([{'a': 1, 'b': 2.5}, {'b': 3.5, 'a': -4}])
+        self.assertEqual((a.typecode, list(a)), ('q', [1, -4]))
+        self.assertEqual((b.typecode, list(b)), ('d', [2.5, 3.5]))
+        self.assertEqual([list(column) for column in to_columns([])], [[], []])
+
+        for data in ({'a': 1, 'b': 2},
+                     [{'a': 1, 'b': 2, 'c': 3}],
+                     [{'a': 1, 'b': 'Hello'}],
+                     [{'a': 1, 'b': True}],
+                     [{'a': 1, 'b': 2}, {'a': 1.5, 'b': 2}],
+                     [{'a': 2 ** 63, 'b': 2}]):
+            self.assertIsNone(to_columns(data))
+
+    def test_columnar_file(self):
+        data = [{'a': i, 'b': i / 2} for i in range(10)]
+        columns = ColumnarData.open(write_columns('dataset.json', to_columns(data)))
+
+        self.assertEqual(len(columns), 10)
+        self.assertEqual(columns.to_list(), data)
+        self.assertEqual(columns[3:5].to_list(), data[3:5])
+        self.assertEqual(add_column_pairs(columns.column('a'), columns.column('b')),
+                         add_pairs_python(data))
+
+    def test_columnar_datasets_get_the_same_results(self):
+        first_legal_file = os.path.join(self.test_files_dir, 'dataset1.json')
+        with open(first_legal_file) as fp:
+            self.client.post(reverse('datasets:submit'), {'upload': fp})
+        with open(first_legal_file) as data_file:
+            data = json.load(data_file)
+
+        dataset = Dataset.objects.get()
+        self.assertIsNone(dataset.data)
+        self.assertTrue(dataset.columns.name.endswith('.columns'))
+        self.assertEqual(dataset.size, len(data))
+
+        processing = Processing.objects.create()
+        third_save_json_to_db(second_test_function(
+            first_select_json_from_dataset((dataset.pk, processing.pk))))
+        dataset.refresh_from_db()
+        self.assertEqual(get_result(dataset), add_pairs_python(data))
+
+        shard_results = [second_test_function_shard((dataset.pk, processing.pk), start, start + 7)
+                         for start in range(0, len(data), 7)]
+        self.assertEqual([item for _, _, result, _ in shard_results for item in result],
+                         add_pairs_python(data))
+
+        response = self.client.get(reverse('datasets:items', args=[dataset.pk, 'data']),
+                                   HTTP_RANGE='items=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(json.loads(response.content.decode())['items'], data[2:5])
+
+    def test_other_data_stays_in_the_db(self):
+        dataset = Dataset(name='dataset.json')
+        parse_dataset(dataset, [b'[{"a": 1, "b": "Hello"}]'])
+        self.assertEqual(dataset.data, [{'a': 1, 'b': 'Hello'}])
+        self.assertEqual(dataset.columns.name, '')
+
+
+class ResultsTest(TestCase):
+    """
+    Tests for packed results.
+    """
+    result = [{'result': i * 3} for i in range(20)]
+
+    def test_pack_result(self):
+        for result in (self.result, [{'result': 0.5}, {'result': -1.0}], []):
+            self.assertEqual(PackedResult(pack_result(result)).to_list(), result)
+        self.assertEqual(len(pack_result(self.result)), 1 + 8 * len(self.result))
+        self.assertEqual(PackedResult(pack_result(self.result))[5:7], self.result[5:7])
+
+        for result in ({'result': 1},
+                       [{'result': 'Hello'}],
+                       [{'result': True}],
+                       [{'result': 1}, {'result': 1.5}],
+                       [{'result': 2 ** 63}],
+                       [{'result': 1, 'other': 2}]):
+            self.assertIsNone(pack_result(result))
+
+    def test_packed_result_views(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(processing=processing,
+                                         result_packed=pack_result(self.result))
+
+        response = self.client.get(reverse('datasets:result', args=[dataset.pk]))
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['result'], self.result)
+
+        response = self.client.get(reverse('datasets:items', args=[dataset.pk, 'result']),
+                                   HTTP_RANGE='items=15-')
+        self.assertEqual(response.status_code, 206)
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual((content['items'], content['total']), (self.result[15:], 20))
+
+        with self.settings(DATASETS_RESULT_PREVIEW_ITEMS=2):
+            response = self.client.get(reverse('datasets:report'))
+        self.assertEqual(response.context['datasets'][0].result_preview, self.result[:2])
+        self.assertEqual(response.context['datasets'][0].result_length, 20)
+
+    def test_json_encoding(self):
+        processing = Processing.objects.create()
+        dataset = Dataset.objects.create(processing=processing, data=[{'a': 1, 'b': 2}])
+
+        with self.settings(DATASETS_RESULT_ENCODING='json'):
+            third_save_json_to_db(second_test_function((dataset.pk, processing.pk)))
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.result, [{'result': 3}])
+        self.assertIsNone(dataset.result_packed)
+
+    def test_pack_results_migration(self):
+        migration = importlib.import_module('datasets.migrations.0017_dataset_result_packed')
+        packable = Dataset.objects.create(result=self.result)
+        not_packable = Dataset.objects.create(result=[{'result': 'Hello'}])
+
+        with self.settings(DATASETS_RESULT_ENCODING='json'):
+            migration.pack_results(apps, None)
+        packable.refresh_from_db()
+        self.assertIsNone(packable.result_packed)
+
+        migration.pack_results(apps, None)
+        packable.refresh_from_db()
+        not_packable.refresh_from_db()
+        self.assertIsNone(packable.result)
+        self.assertEqual(get_result(packable), self.result)
+        self.assertEqual(not_packable.result, [{'result': 'Hello'}])
+
+        migration.unpack_results(apps, None)
+        packable.refresh_from_db()
+        self.assertEqual(packable.result, self.result)
+        self.assertIsNone(packable.result_packed)
+
+
+@override_settings(DATASETS_PIPELINE='sql')
+class SqlEngineTest(TestCase):
+    """
+    Tests for computing results in the database.
+    """
+    computable = [[{'a': 1, 'b': 2}, {'a': -3, 'b': 4}],
+                  [{'a': 0.1, 'b': 0.2}, {'a': 1.5, 'b': -2.25}],
+                  [{'a': 1, 'b': 0.5}, {'a': 2, 'b': 3}],
+                  [{'a': 2 ** 53 - 1, 'b': 2 ** 53 - 1}],
+                  [{'a': 0.5, 'b': 0.5}, {'a': 1, 'b': 2}],
+                  [{'a': 1e16, 'b': 0.5}, {'a': -1.5, 'b': -1.5}, {'a': 1, 'b': 2}],
+                  [{'a': 1, 'b': 2, 'c': 'extra'}],
+                  []]
+    raising = [[{'a': 1, 'b': 2}, {'a': 1, 'b': 'Hello'}, {'a': 'Hello', 'b': 1}],
+               [{'a': 'Hello', 'b': 1}],
+               [{'a': 1}],
+               [{'a': None, 'b': 1}],
+               [[1, 2]],
+               [1],
+               [{'a': 10 ** 400, 'b': 0.5}]]
+    not_raising = [[{'a': 1, 'b': 2}, {'a': 'Hello', 'b': 'World'}, {'a': 1, 'b': 'Hello'}],
+                   [{'a': True, 'b': 1}],
+                   [{'a': [1], 'b': [2]}],
+                   # whole numbers that may have been floats written with an exponent
+                   [{'a': 1, 'b': 2}, {'a': 1e16, 'b': 1}],
+                   [{'a': 1e300, 'b': 1e300}],
+                   [{'a': 2 ** 63, 'b': 2 ** 63}]]
+
+    def assert_same_as_python(self, dataset):
+        # data as the Python path gets it back from JSONB, e.g. 1e300 turns into an int
+        dataset.refresh_from_db()
+        result, exception = compute_result(dataset.data)
+        self.assertEqual(get_result(dataset), result)
+        # ints and floats are equal, but they are stored differently
+        self.assertEqual([type(item['result']) for item in get_result(dataset)],
+                         [type(item['result']) for item in result])
+        self.assertEqual(dataset.exception, exception)
+        self.assertEqual(dataset.result_packed is not None,
+                         result_fields(result)['result_packed'] is not None)
+
+    def test_sql_gives_the_same_results_as_python(self):
+        inputs = self.computable + self.raising
+        for encoding in ('packed', 'json'):
+            with self.settings(DATASETS_RESULT_ENCODING=encoding):
+                processing = Processing.objects.create()
+                datasets = [Dataset.objects.create(processing=processing, data=data)
+                            for data in inputs]
+                left = compute_in_database(Dataset.objects.filter(processing=processing))
+                self.assertEqual(list(left.values_list('data', flat=True)), [])
+                for dataset in datasets:
+                    self.assert_same_as_python(dataset)
+                refresh_processing(processing)
+                self.assertIs(processing.exceptions, True)
+
+    def test_sql_leaves_the_rest_to_the_chain(self):
+        processing = Processing.objects.create()
+        datasets = [Dataset.objects.create(processing=processing, data=data)
+                    for data in self.not_raising + [None, {'a': 1, 'b': 2}]]
+        datasets.append(Dataset.objects.create(processing=processing, exception='Unknown'))
+        left = compute_in_database(Dataset.objects.filter(processing=processing))
+        self.assertEqual(sorted(left.values_list('pk', flat=True)),
+                         [dataset.pk for dataset in datasets])
+        processing.refresh_from_db()
+        self.assertIsNone(processing.exceptions)
+
+        with self.settings(DATASETS_KERNEL='other'):
+            query_set = Dataset.objects.filter(pk=datasets[0].pk)
+            self.assertIs(compute_in_database(query_set), query_set)
+
+    def test_process_datasets_with_sql_pipeline(self):
+        inputs = self.computable + self.raising + self.not_raising
+        datasets = [Dataset.objects.create(data=data) for data in inputs]
+        processing_pk = process_datasets(Dataset.objects.all(), LocalExecutor())
+        for dataset in datasets:
+            self.assert_same_as_python(dataset)
+            self.assertEqual(dataset.processing_id, processing_pk)
+
+
+class StatusTest(TestCase):
+    """
+    Tests for status of processings merged from their datasets.
+    """
+    def test_tasks_never_write_the_processing(self):
+        datasets = [Dataset.objects.create(data=[{'a': 1, 'b': 2}]),
+                    Dataset.objects.create(data=[{'a': 1, 'b': 'Hello'}]),
+                    Dataset.objects.create(exception='Unknown Exception'),
+                    Dataset.objects.create(data=[{'a': 3, 'b': 4}])]
+        processing = Processing.objects.create(datasets_total=len(datasets))
+
+        with CaptureQueriesContext(connection) as queries:
+            for dataset in datasets[:3]:
+                run_chain((dataset.pk, processing.pk))
+        self.assertFalse([query for query in queries.captured_queries
+                          if Processing._meta.db_table in query['sql']])
+
+        self.assertEqual(merge_unfinished(), [processing.pk])
+        processing.refresh_from_db()
+        self.assertEqual((processing.datasets_total, processing.datasets_done,
+                          processing.datasets_failed), (4, 3, 2))
+        self.assertIs(processing.exceptions, True)
+        self.assertEqual(processing.last_modified, max(
+            Dataset.objects.filter(processing=processing).values_list('processed', flat=True)))
+
+        # nothing changed since
+        self.assertEqual(merge_unfinished(), [])
+
+        run_chain((datasets[3].pk, processing.pk))
+        response = self.client.get(reverse('datasets:report'))
+        processing.refresh_from_db()
+        self.assertEqual(processing.datasets_done, 4)
+        self.assertEqual(response.context['last_check'].last_modified, processing.last_modified)
+        self.assertFalse(unfinished_processings().exists())
+
+    def test_failed_datasets_are_done(self):
+        processing = Processing.objects.create(datasets_total=2)
+        failing = Dataset.objects.create(processing=processing, exception='Unknown Exception')
+        Dataset.objects.create(processing=processing, data=[{'a': 1, 'b': 2}])
+
+        # failed on submission, but not reached by the processing yet
+        merge_unfinished()
+        processing.refresh_from_db()
+        self.assertEqual((processing.datasets_done, processing.datasets_failed), (0, 0))
+        self.assertIsNone(processing.exceptions)
+
+        run_chain((failing.pk, processing.pk))
+        merge_unfinished()
+        processing.refresh_from_db()
+        self.assertEqual((processing.datasets_done, processing.datasets_failed), (1, 1))
+        self.assertIs(processing.exceptions, True)
+
+    def test_status_endpoint(self):
+        cache.clear()
+        datasets = [Dataset.objects.create(data=[{'a': i, 'b': i}] * 3, size=3) for i in range(4)]
+        processing = Processing.objects.create(datasets_total=len(datasets))
+        Dataset.objects.update(processing=processing)
+
+        run_chain((datasets[0].pk, processing.pk))
+        first_select_json_from_dataset((datasets[1].pk, processing.pk))
+
+        url = reverse('datasets:status', args=[processing.pk])
+        status = self.client.get(url).json()
+        self.assertEqual({key: status[key] for key in ('total', 'queued', 'running', 'done',
+                                                       'failed', 'rows_processed', 'finished')},
+                         {'total': 4, 'queued': 2, 'running': 1, 'done': 1, 'failed': 0,
+                          'rows_processed': 3, 'finished': False})
+
+        # served from the cache till it expires
+        for dataset in datasets[1:]:
+            run_chain((dataset.pk, processing.pk))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()['done'], 1)
+
+        cache.clear()
+        status = self.client.get(url).json()
+        self.assertEqual((status['done'], status['rows_processed'], status['finished']),
+                         (4, 12, True))
+
+        self.assertEqual(self.client.get(reverse('datasets:status', args=[0])).status_code, 404)
+
+    @override_settings(DATASETS_STATUS_CACHE_SECONDS=0)
+    def test_status_of_no_datasets_is_not_cached_for_good(self):
+        cache.clear()
+        processing = Processing.objects.create()
+        self.assertTrue(processing_status(processing.pk)['finished'])
+
+        Processing.objects.filter(pk=processing.pk).update(datasets_total=1)
+        self.assertFalse(processing_status(processing.pk)['finished'])
+
+
+class WritesTest(TestCase):
+    """
+    Tests for writes of changed fields only and the status write buffer.
+    """
+    def test_chain_never_rewrites_data(self):
+        processing = Processing.objects.create()
+        datasets = [Dataset.objects.create(data=[{'a': 1, 'b': 2}]),
+                    Dataset.objects.create(data=[{'a': 1, 'b': 'Hello'}])]
+
+        with CaptureQueriesContext(connection) as queries:
+            for dataset in datasets:
+                run_chain((dataset.pk, processing.pk))
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE')]
+        self.assertTrue(updates)
+        self.assertFalse([sql for sql in updates if '"data" =' in sql])
+
+        for dataset in datasets:
+            dataset.refresh_from_db()
+            self.assertEqual(dataset.processing, processing)
+            self.assertIsNotNone(dataset.processed)
+        self.assertEqual(get_result(datasets[0]), [{'result': 3}])
+        self.assertIn('TypeError', datasets[1].exception)
+
+    @override_settings(DATASETS_WRITE_BUFFER_SIZE=3, DATASETS_WRITE_BUFFER_SECONDS=60)
+    def test_status_updates_are_buffered(self):
+        processing = Processing.objects.create()
+        datasets = [Dataset.objects.create() for _ in range(3)]
+
+        update_status(datasets[0].pk, processing_id=processing.pk)
+        update_status(datasets[1].pk, processing_id=processing.pk)
+        update_status(datasets[0].pk, processed=timezone.now())
+        self.assertFalse(Dataset.objects.filter(processing=processing).exists())
+
+        # the third dataset fills the buffer up
+        update_status(datasets[2].pk, processing_id=processing.pk)
+        self.assertEqual(Dataset.objects.filter(processing=processing).count(), 3)
+        self.assertEqual(Dataset.objects.filter(processed__isnull=False).get(), datasets[0])
+
+        update_status(datasets[0].pk, processing_id=None)
+        with self.settings(DATASETS_WRITE_BUFFER_SECONDS=0):
+            self.assertEqual(status_buffer.flush_if_due(), 1)
+        self.assertEqual(Dataset.objects.filter(processing=processing).count(), 2)
+
+    @override_settings(DATASETS_WRITE_BUFFER_SIZE=100, DATASETS_WRITE_BUFFER_SECONDS=60)
+    def test_local_executor_flushes_buffered_updates(self):
+        legal = Dataset.objects.create(data=[{'a': 1, 'b': 2}])
+        illegal = Dataset.objects.create(exception='Unknown Exception')
+
+        processing_pk = process_datasets(Dataset.objects.all(), LocalExecutor())
+        processing = Processing.objects.get(pk=processing_pk)
+        self.assertEqual((processing.datasets_total, processing.datasets_done,
+                          processing.datasets_failed), (2, 2, 1))
+        for dataset in (legal, illegal):
+            dataset.refresh_from_db()
+            self.assertIsNotNone(dataset.processed)
+
+
+class WriteTimerTest(TransactionTestCase):
+    """
+    Tests for flushing the status write buffer of an idle worker.
+    """
+    @override_settings(DATASETS_WRITE_BUFFER_SIZE=100, DATASETS_WRITE_BUFFER_SECONDS=0.1)
+    def test_buffer_is_flushed_with_no_further_tasks(self):
+        dataset = Dataset.objects.create(exception='Unknown Exception')
+
+        update_status(dataset.pk, processed=timezone.now())
+        self.assertFalse(Dataset.objects.filter(processed__isnull=False).exists())
+
+        deadline = time.monotonic() + 5
+        while not Dataset.objects.filter(processed__isnull=False).exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(Dataset.objects.filter(processed__isnull=False).exists())
+        self.assertIsNone(status_buffer.timer)
@@ -15,4 +15,13 @@ urlpatterns = [
 
     # see results of processing
     url(r'^report$', views.report, name='report'),
+
+    # get progress of a processing
+    url(r'^status/(?P<processing_pk>\d+)$', views.status, name='status'),
+
+    # get a full result of a dataset processing
+    url(r'^result/(?P<dataset_pk>\d+)$', views.result, name='result'),
+
+    # get a slice of a dataset's result or data
+    url(r'^items/(?P<dataset_pk>\d+)/(?P<field>result|data)$', views.items, name='items'),
 ]
@@ -1,15 +1,55 @@
+import re
 import json
 
+from django.conf import settings
+from django.http import Http404, JsonResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib import messages
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.db import connection, transaction
 
 from .models import Dataset, Processing
 from .forms import UploadFileForm
-from .tasks import process_datasets
+from .tasks import process_datasets, parse_dataset, first_parse_upload
+from .pagination import CursorPaginator
+from .storage import ColumnarData
+from .results import PackedResult, HEADER_SIZE, ITEM_SIZE, load_result, packed_result_slice
+from .db import json_array_length_sql, json_array_head_sql, json_array_slice
+from .status import merge_unfinished, processing_status
+from .report_cache import current_generation, page_key, get_fragments, set_fragments
+
+
+def paginate(request, query_set, ordering):
+    """
+    Return a page of the QuerySet requested.
+
+    :param request: Request
+    :param query_set: QuerySet
+    :param ordering: tuple of field names for cursor pagination
+    :return: Page or CursorPage
+    """
+    if settings.DATASETS_PAGINATION == 'cursor':
+        paginator = CursorPaginator(query_set, ordering, 25,
+                                    estimate=settings.DATASETS_PAGINATION_ESTIMATE)
+        return paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+
+    paginator = Paginator(query_set, 25)
+    page = request.GET.get('page')
+
+    try:
+        return paginator.page(page)
+    except PageNotAnInteger:
+        # If page is not an integer, deliver first page.
+        return paginator.page(1)
+    except EmptyPage:
+        # If page is out of range (e.g. 9999), deliver last page of results.
+        return paginator.page(paginator.num_pages)
 
 
 def index(request):
@@ -28,6 +68,9 @@ def submit(request):
 
     We might want to set an upload size limit in settings.py like this:
     https://www.djangosnippets.org/snippets/1303/
+
+    With DATASETS_INGESTION = 'async' the raw upload is only stored,
+    it is parsed by a task once the dataset is saved.
     :param request: Request
     :return: HttpResponse
     """
@@ -39,19 +82,18 @@ def submit(request):
             dataset = Dataset(name=upload.name)
 
             exception_message = ''
-            # json parsing; if fails, save exceptions
-            try:
-                # TODO: using .chunks() for large input instead?
-                fl = upload.read()
-                data = json.loads(fl.decode('utf-8'))
-                dataset.data = data
-            except Exception as err:
-                exception_message = "{type}: {message}".\
-                    format(type=type(err).__name__, message=err)
-                dataset.exception = exception_message
-
-            # save data on a model
-            dataset.save()
+            if settings.DATASETS_INGESTION == 'async':
+                # stream the upload to the storage; parse it in a worker once committed
+                dataset.upload = upload
+                dataset.parse_pending = True
+                dataset.save()
+                transaction.on_commit(lambda: first_parse_upload.delay(dataset.pk))
+            else:
+                # json parsing chunk by chunk; if fails, save exceptions
+                exception_message = parse_dataset(dataset, upload.chunks())
+
+                # save data on a model
+                dataset.save()
 
             # set flash message
             if exception_message:
@@ -76,53 +118,227 @@ def process(request):
     :param request: Request
     :return: HttpResponse
     """
-    unprocessed_datasets = Dataset.objects.filter(processing__isnull=True)
+    unprocessed_datasets = Dataset.objects.filter(processing__isnull=True, parse_pending=False)
 
     if request.method == 'POST':
         # process data here
         check_number = process_datasets(unprocessed_datasets)
         messages.info(request, "Datasets processing #{0} has started. "
-                               "Please refresh the page in a few moments.".
-                      format(check_number))
+                               "Please refresh the page in a few moments, "
+                               "or follow its progress at {1}.".
+                      format(check_number, reverse('datasets:status', args=[check_number])))
 
         return redirect(reverse('datasets:report'))
 
-    paginator = Paginator(unprocessed_datasets, 25)
-    page = request.GET.get('page')
-
-    try:
-        datasets = paginator.page(page)
-    except PageNotAnInteger:
-        # If page is not an integer, deliver first page.
-        datasets = paginator.page(1)
-    except EmptyPage:
-        # If page is out of range (e.g. 9999), deliver last page of results.
-        datasets = paginator.page(paginator.num_pages)
+    # fetch only the columns displayed
+    datasets = paginate(request, unprocessed_datasets.only('id', 'name', 'added').order_by('id'),
+                        ('id',))
 
     context = {'page_alias': 'process', 'datasets': datasets}
     return render(request, 'datasets/process.html', context)
 
 
 def report(request):
-    processed_datasets = Dataset.objects.exclude(processing__isnull=True).\
-                             order_by('-processing__pk', '-processing__last_modified')
-    paginator = Paginator(processed_datasets, 25)
+    """
+    Show results of processing.
 
-    page = request.GET.get('page')
+    Only the columns displayed are fetched, processing is joined in the same query;
+    results are shown as previews of their first DATASETS_RESULT_PREVIEW_ITEMS items,
+    sliced by PostgreSQL, packed results included.
+    Status of unfinished processings is merged from their datasets first.
+
+    With DATASETS_REPORT_CACHE_SECONDS set, the page of datasets and the Last Check sidebar
+    are cached till results change, and unchanged pages get 304, see report_cache.py.
+
+    :param request: Request
+    :return: HttpResponse
+    """
+    preview_items = settings.DATASETS_RESULT_PREVIEW_ITEMS
+    generation = current_generation()
+    datasets_name = 'datasets:{0}'.format(page_key(request))
+    fragments, modified = get_fragments(generation, [datasets_name, 'last_check'])
+
+    # a page with messages is neither cached by browsers nor answered with 304
+    conditional = generation is not None and not len(messages.get_messages(request))
+    # unquoted: that is what get_conditional_response matches If-None-Match against
+    etag = '{0}-{1}'.format(generation, datasets_name[len('datasets:'):])
+    if conditional:
+        not_modified = get_conditional_response(request, etag=etag, last_modified=modified)
+        if not_modified is not None:
+            return not_modified
+
+    context = {'page_alias': 'report'}
+    rendered = {}
+    if len(fragments) < 2:
+        merge_unfinished()
+
+    if datasets_name not in fragments:
+        datasets = report_datasets(request, preview_items)
+        context['datasets'] = datasets
+        rendered[datasets_name] = render_to_string('datasets/report_datasets.html',
+                                                   {'datasets': datasets, 'preview_items': preview_items},
+                                                   request)
+
+    if 'last_check' not in fragments:
+        try:
+            last_check = processed_datasets()[0].processing
+        except IndexError:
+            last_check = None
+        context['last_check'] = last_check
+        rendered['last_check'] = render_to_string('datasets/report_last_check.html',
+                                                  {'last_check': last_check}, request)
+
+    if rendered:
+        modified = set_fragments(generation, rendered)
+    fragments.update(rendered)
+    context.update(datasets_fragment=fragments[datasets_name], last_check_fragment=fragments['last_check'])
+
+    response = render(request, 'datasets/report.html', context)
+    if conditional:
+        response['ETag'] = quote_etag(etag)
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+        # revalidated on each visit
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def processed_datasets():
+    """
+    :return: QuerySet of datasets claimed for processings, the latest first, processing joined
+    """
+    return Dataset.objects.exclude(processing__isnull=True).\
+        select_related('processing').\
+        only('id', 'name', 'exception', 'processing', 'processing__exceptions',
+             'processing__last_modified').\
+        order_by('-processing__pk', '-processing__last_modified')
+
+
+def report_datasets(request, preview_items):
+    """
+    Return the page of processed datasets requested, with previews of their results.
+
+    :param request: Request
+    :param preview_items: int: number of result items to preview
+    :return: Page or CursorPage
+    """
+    packed = '{0}.{1}'.format(connection.ops.quote_name(Dataset._meta.db_table),
+                              connection.ops.quote_name('result_packed'))
+    # extra columns are left out of the paginator's COUNT(*)
+    datasets = paginate(request, processed_datasets().extra(select={
+        'result_length': 'COALESCE((octet_length({packed}) - {header}) / {item}, {length})'.format(
+            packed=packed, header=HEADER_SIZE, item=ITEM_SIZE,
+            length=json_array_length_sql(Dataset, 'result')),
+        'result_preview': '({0})::text'.format(
+            json_array_head_sql(Dataset, 'result', preview_items)),
+        'result_preview_packed': 'substring({packed} from 1 for {length})'.format(
+            packed=packed, length=HEADER_SIZE + preview_items * ITEM_SIZE),
+    }), ('-processing_id', '-id'))
+
+    for dataset in datasets:
+        if dataset.result_preview_packed is not None:
+            dataset.result_preview = PackedResult(bytes(dataset.result_preview_packed)).to_list()
+        elif dataset.result_preview is not None:
+            dataset.result_preview = json.loads(dataset.result_preview)
+
+    return datasets
+
+
+def status(request, processing_pk):
+    """
+    Return progress of a processing as JSON.
+
+    Counters are cached for DATASETS_STATUS_CACHE_SECONDS, so polling this is cheap,
+    unlike polling the report page.
+
+    :param request: Request
+    :param processing_pk: Processing PK
+    :return: JsonResponse
+    """
+    processing_progress = processing_status(int(processing_pk))
+    if processing_progress is None:
+        raise Http404('No processing found')
+
+    return JsonResponse(processing_progress)
+
+
+def result(request, dataset_pk):
+    """
+    Return a full result of a dataset processing as JSON.
+
+    :param request: Request
+    :param dataset_pk: Dataset PK
+    :return: JsonResponse
+    """
     try:
-        datasets = paginator.page(page)
-    except PageNotAnInteger:
-        # If page is not an integer, deliver first page.
-        datasets = paginator.page(1)
-    except EmptyPage:
-        # If page is out of range (e.g. 9999), deliver last page of results.
-        datasets = paginator.page(paginator.num_pages)
+        dataset_result, packed = Dataset.objects.filter(pk=dataset_pk).\
+            values_list('result', 'result_packed').get()
+    except Dataset.DoesNotExist:
+        raise Http404('No dataset found')
+
+    return JsonResponse({'id': int(dataset_pk),
+                         'result': load_result(dataset_result, packed and bytes(packed))})
+
+
+def items(request, dataset_pk, field):
+    """
+    Return a slice of a dataset's result or data items as JSON.
+
+    The slice is given either with a Range header in items, e.g. `Range: items=0-99`
+    (both ends inclusive, like bytes ranges are), or with `offset` and `limit` query parameters.
+    Either way, no more than DATASETS_ITEMS_MAX_LIMIT items are returned.
+    Slicing happens inside PostgreSQL, so only the requested items are fetched from the DB.
+
+    :param request: Request
+    :param dataset_pk: Dataset PK
+    :param field: str: either 'result' or 'data'
+    :return: JsonResponse: 206 Partial Content for Range requests, 200 OK otherwise
+    """
+    max_limit = settings.DATASETS_ITEMS_MAX_LIMIT
+
+    # invalid ranges are ignored, as for bytes ranges
+    range_match = re.match(r'^items=(\d+)-(\d*)$', request.META.get('HTTP_RANGE', ''))
+    if range_match:
+        offset = int(range_match.group(1))
+        last = range_match.group(2)
+        limit = int(last) - offset + 1 if last else max_limit
+    else:
+        try:
+            offset = max(int(request.GET.get('offset', 0)), 0)
+            limit = int(request.GET.get('limit', max_limit))
+        except ValueError:
+            offset, limit = 0, max_limit
+    limit = min(max(limit, 0), max_limit)
 
     try:
-        last_check = processed_datasets[0].processing
-    except IndexError:
-        last_check = None
+        slice_items, total = json_array_slice(Dataset, dataset_pk, field, offset, offset + limit)
+    except Dataset.DoesNotExist:
+        raise Http404('No dataset found')
+
+    if slice_items is None and field == 'result':
+        slice_items, total = packed_result_slice(dataset_pk, offset, offset + limit)
+
+    if slice_items is None and field == 'data':
+        # data may be stored in a columnar file rather than in the DB
+        columns_name = Dataset.objects.filter(pk=dataset_pk).values_list('columns', flat=True).get()
+        if columns_name:
+            columns = ColumnarData.open(columns_name)
+            slice_items, total = columns[offset:offset + limit].to_list(), len(columns)
+
+    if slice_items is None:
+        raise Http404('Dataset has no {0} items'.format(field))
+
+    if range_match and (offset >= total or limit == 0):
+        response = JsonResponse({'error': 'Requested range not satisfiable'}, status=416)
+        response['Content-Range'] = 'items */{0}'.format(total)
+        return response
 
-    context = {'page_alias': 'report', 'datasets': datasets, 'last_check': last_check}
+    response = JsonResponse({'id': int(dataset_pk), 'field': field, 'offset': offset,
+                             'total': total, 'items': slice_items},
+                            status=206 if range_match else 200)
+    response['Accept-Ranges'] = 'items'
+    if range_match:
+        response['Content-Range'] = 'items {0}-{1}/{2}'.format(
+            offset, offset + len(slice_items) - 1, total)
 
-    return render(request, 'datasets/report.html', context)
+    return response
@@ -0,0 +1,143 @@
+import time
+import threading
+
+from celery import signals
+from django.conf import settings
+from django.db import connection
+
+from .models import Dataset
+from .db import bulk_update
+from .report_cache import bump_generation
+
+# Write-coalescing of dataset status updates.
+#
+# Tasks write only the fields they change, never whole rows with their large JSON.
+# Status updates no later task reads back (e.g. which processing a dataset belongs to,
+# when it was started or done with) are buffered in the worker process and written for many
+# datasets at once with UPDATE ... FROM (VALUES ...), see db.bulk_update. The buffer is flushed
+# once it holds DATASETS_WRITE_BUFFER_SIZE datasets, once its oldest update is
+# DATASETS_WRITE_BUFFER_SECONDS old (by a timer armed with the first update, so that updates
+# of a worker that has gone idle get written too), and whenever the worker process, the worker
+# or a local executor is done.
+# With DATASETS_WRITE_BUFFER_SIZE = 0 nothing is buffered.
+
+
+class WriteBuffer(object):
+    """
+    Updates of a model's fields, coalesced per instance and written in batches.
+    """
+    def __init__(self, model):
+        """
+        :param model: Model class
+        """
+        self.model = model
+        self.updates = {}
+        self.started = None
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def add(self, pk, **fields):
+        """
+        Buffer an update; later updates of the same fields of an instance win.
+
+        :param pk: PK of the model instance
+        :param fields: field names to values
+        :return: None
+        """
+        with self.lock:
+            if not self.updates:
+                self.started = time.monotonic()
+                self.timer = threading.Timer(settings.DATASETS_WRITE_BUFFER_SECONDS, self.flush_on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+            self.updates.setdefault(pk, {}).update(fields)
+            full = len(self.updates) >= settings.DATASETS_WRITE_BUFFER_SIZE
+
+        if full:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Flush the buffer if its oldest update has waited for DATASETS_WRITE_BUFFER_SECONDS.
+
+        :return: int: number of updated rows
+        """
+        if self.started is None or \
+                time.monotonic() - self.started < settings.DATASETS_WRITE_BUFFER_SECONDS:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """
+        Write all buffered updates, one batched UPDATE per set of fields updated.
+
+        :return: int: number of updated rows
+        """
+        with self.lock:
+            updates, self.updates, self.started = self.updates, {}, None
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+
+        groups = {}
+        for pk, fields in updates.items():
+            groups.setdefault(tuple(sorted(fields)), []).append(self.model(pk=pk, **fields))
+
+        updated = sum(bulk_update(self.model, objs, list(names)) for names, objs in groups.items())
+        if any('processed' in names for names in groups):
+            bump_generation()
+        return updated
+
+    def flush_on_timer(self):
+        """
+        Flush the buffer from the timer's thread, closing the thread's DB connection afterwards.
+
+        :return: None
+        """
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+status_buffer = WriteBuffer(Dataset)
+
+
+def update_status(dataset_pk, **fields):
+    """
+    Update status fields of a dataset, buffered if DATASETS_WRITE_BUFFER_SIZE is set.
+
+    Only fields no task reads back later may be updated this way.
+
+    :param dataset_pk: Dataset PK
+    :param fields: field names to values, e.g. processing_id, started, processed
+    :return: None
+    """
+    if settings.DATASETS_WRITE_BUFFER_SIZE:
+        status_buffer.add(dataset_pk, **fields)
+    else:
+        Dataset.objects.filter(pk=dataset_pk).update(**fields)
+        if 'processed' in fields:
+            bump_generation()
+
+
+def flush_status():
+    """
+    Write all buffered status updates of this process.
+
+    :return: int: number of updated rows
+    """
+    return status_buffer.flush()
+
+
+@signals.task_postrun.connect
+def _flush_status_if_due(**kwargs):
+    status_buffer.flush_if_due()
+
+
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def _flush_status_on_shutdown(**kwargs):
+    flush_status()
@@ -100,6 +100,23 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # rendered report pages; e.g. django.core.cache.backends.filebased.FileBasedCache
+    # with a directory as the location to share them by all processes of a machine
+    'report': {
+        'BACKEND': os.environ.get('DATASETS_REPORT_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DATASETS_REPORT_CACHE_LOCATION', 'datasets-report'),
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -167,6 +184,93 @@ CELERY_TASK_ROUTES = {
             {'queue': os.environ.get('CELERY_QUEUE_THIRD', '')},
 }
 
+# Datasets
+# Compute kernel for the test function: 'python' or 'columnar' (requires NumPy, not installed
+# with requirements/prod.txt)
+DATASETS_KERNEL = os.environ.get('DATASETS_KERNEL', 'python')
+
+# How submitted files are parsed: 'sync' on the request, or 'async' in a worker
+# after the raw upload is stored under MEDIA_ROOT (shared with the workers)
+DATASETS_INGESTION = os.environ.get('DATASETS_INGESTION', 'sync')
+
+# Where submitted data is kept: 'db' (JSONB) or 'file' (columnar files under MEDIA_ROOT, shared with
+# the workers, for datasets of numeric `a` and `b` pairs only; any other data is kept in the DB)
+DATASETS_STORAGE = os.environ.get('DATASETS_STORAGE', 'db')
+
+# How process_datasets runs the test function: 'chain' of three tasks per dataset,
+# 'fused' single task per dataset, 'batch' that processes many small datasets in a single task,
+# 'queue' that sends no tasks, leaving datasets to `manage.py process_queue` workers,
+# or 'sql' that computes results in PostgreSQL (12+), leaving to the chain only datasets SQL can't compute
+DATASETS_PIPELINE = os.environ.get('DATASETS_PIPELINE', 'chain')
+# What runs the tasks: 'celery' workers, 'local' (this very process) or a 'pool' of local processes
+DATASETS_EXECUTOR = os.environ.get('DATASETS_EXECUTOR', 'celery')
+# Number of processes of the pool; 0 for number of CPUs
+DATASETS_EXECUTOR_WORKERS = int(os.environ.get('DATASETS_EXECUTOR_WORKERS', 0))
+# Batch bounds: total number of items, number of datasets
+DATASETS_BATCH_ROWS = int(os.environ.get('DATASETS_BATCH_ROWS', 10000))
+DATASETS_BATCH_SIZE = int(os.environ.get('DATASETS_BATCH_SIZE', 100))
+# Max number of datasets of a processing in flight at once, dispatched by a task off the request;
+# 0 to dispatch all datasets right on the request
+DATASETS_DISPATCH_WINDOW = int(os.environ.get('DATASETS_DISPATCH_WINDOW', 1000))
+# Seconds between top-ups of the window
+DATASETS_DISPATCH_INTERVAL = float(os.environ.get('DATASETS_DISPATCH_INTERVAL', 1))
+# Seconds a dispatched dataset holds its place in the window; after that its tasks are taken
+# for lost (e.g. a worker crashed), and the place goes to another dataset.
+# A batch picked by a process_queue worker is taken for lost after as long
+DATASETS_DISPATCH_TIMEOUT = float(os.environ.get('DATASETS_DISPATCH_TIMEOUT', 600))
+# Status updates of datasets buffered by a worker process and written in batches of this many
+# datasets, or once the oldest one has waited for this many seconds; 0 to write them right away
+DATASETS_WRITE_BUFFER_SIZE = int(os.environ.get('DATASETS_WRITE_BUFFER_SIZE', 0))
+DATASETS_WRITE_BUFFER_SECONDS = float(os.environ.get('DATASETS_WRITE_BUFFER_SECONDS', 1))
+# Progress of a processing, served by the status endpoint, is cached for this many seconds
+DATASETS_STATUS_CACHE_SECONDS = float(os.environ.get('DATASETS_STATUS_CACHE_SECONDS', 1))
+# Clients waiting for a processing are held by the serve_events command for this many seconds
+# at most, and sent a keep-alive every this many seconds
+DATASETS_EVENTS_TIMEOUT = float(os.environ.get('DATASETS_EVENTS_TIMEOUT', 300))
+DATASETS_EVENTS_KEEPALIVE = float(os.environ.get('DATASETS_EVENTS_KEEPALIVE', 15))
+# Rendered report pages are cached in the `report` cache for this many seconds at most,
+# and served till results change; 0 to render them on each request
+DATASETS_REPORT_CACHE_SECONDS = int(os.environ.get('DATASETS_REPORT_CACHE_SECONDS', 0))
+# How results are stored: 'packed' arrays of numbers, or 'json' lists of {"result": ..} dicts;
+# results of anything but int64 or float64 numbers are stored as JSON anyway
+DATASETS_RESULT_ENCODING = os.environ.get('DATASETS_RESULT_ENCODING', 'packed')
+# Pagination of process and report pages: 'page' numbers or 'cursor' (keyset pagination)
+DATASETS_PAGINATION = os.environ.get('DATASETS_PAGINATION', 'page')
+# Whatever non-empty value will make it True: show total number of datasets estimated by PostgreSQL
+# on cursor-paginated pages
+DATASETS_PAGINATION_ESTIMATE = bool(os.environ.get('DATASETS_PAGINATION_ESTIMATE', False))
+# Number of result items shown on the report page for each dataset
+DATASETS_RESULT_PREVIEW_ITEMS = int(os.environ.get('DATASETS_RESULT_PREVIEW_ITEMS', 10))
+# Max number of items returned at once by the endpoint for slices of datasets' result and data
+DATASETS_ITEMS_MAX_LIMIT = int(os.environ.get('DATASETS_ITEMS_MAX_LIMIT', 1000))
+# Whatever non-empty value will make it True: reuse results of datasets with the same content
+DATASETS_RESULT_CACHE = bool(os.environ.get('DATASETS_RESULT_CACHE', False))
+# Cached results unused for this many days get evicted, as do least recently used ones above the limit
+DATASETS_RESULT_CACHE_MAX_AGE = int(os.environ.get('DATASETS_RESULT_CACHE_MAX_AGE', 30))
+DATASETS_RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('DATASETS_RESULT_CACHE_MAX_ENTRIES', 10000))
+# Where results passed between tasks are put, rather than into broker messages:
+# 'db' (PostgreSQL table), 'file' (DATASETS_PAYLOAD_DIR shared by workers), or empty to pass them inline
+DATASETS_PAYLOAD_STORE = os.environ.get('DATASETS_PAYLOAD_STORE', '')
+DATASETS_PAYLOAD_DIR = os.environ.get('DATASETS_PAYLOAD_DIR', os.path.join(BASE_DIR, 'payloads'))
+# Results of no more than this many bytes of JSON are passed inline anyway
+DATASETS_PAYLOAD_INLINE_BYTES = int(os.environ.get('DATASETS_PAYLOAD_INLINE_BYTES', 65536))
+# Payloads left behind by failed tasks are deleted after this many hours
+DATASETS_PAYLOAD_MAX_AGE = int(os.environ.get('DATASETS_PAYLOAD_MAX_AGE', 24))
+# Datasets of more items than this are processed in parallel shards of this size; 0 to turn off
+DATASETS_SHARD_ROWS = int(os.environ.get('DATASETS_SHARD_ROWS', 0))
+# Datasets of more items than this are streamed through a single task in chunks of this size,
+# so that a worker never holds a whole dataset or result in memory; 0 to turn off
+DATASETS_STREAM_ROWS = int(os.environ.get('DATASETS_STREAM_ROWS', 0))
+# Tasks of datasets of more items than this go to the large lanes of queues,
+# so that they don't hold up small datasets; 0 to turn off
+DATASETS_LARGE_ROWS = int(os.environ.get('DATASETS_LARGE_ROWS', 0))
+# Large lanes of each stage's queue; stages with an empty one route all tasks with CELERY_TASK_ROUTES
+DATASETS_LARGE_QUEUES = {
+    'first': os.environ.get('CELERY_QUEUE_FIRST_LARGE', ''),
+    'second': os.environ.get('CELERY_QUEUE_SECOND_LARGE', ''),
+    'third': os.environ.get('CELERY_QUEUE_THIRD_LARGE', ''),
+}
+
 # Flower
 FLOWER_BASIC_AUTH = os.environ.get('FLOWER_BASIC_AUTH', '')
 FLOWER_PORT = os.environ.get('FLOWER_PORT', '5555')